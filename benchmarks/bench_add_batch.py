@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Time to submit `--tasks` tasks: one `add` per task (a shell loop of
+`gpulimit add`, or one persistent / pipelined `GpulimitClient`), against a
+single `add-batch` request.
+
+    python benchmarks/bench_add_batch.py --tasks 1000 20000
+"""
+import time
+import argparse
+import tempfile
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_client import GpulimitClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description='add-batch against sequential add')
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1000, 20000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as logdir:
+        server = common.start_server(logdir)
+        address = server.server_address
+
+        def add_loop(cmds_list):
+            for cmds in cmds_list:
+                with GpulimitClient(address, pwd='/tmp') as client:
+                    assert client.request(cmds)['code'] == 0
+
+        def add_persistent(cmds_list):
+            with GpulimitClient(address, pwd='/tmp') as client:
+                for cmds in cmds_list:
+                    assert client.request(cmds)['code'] == 0
+
+        def add_pipeline(cmds_list):
+            with GpulimitClient(address, pwd='/tmp') as client:
+                assert all(response['code'] == 0 for response in client.pipeline_requests(cmds_list))
+
+        def add_batch(cmds_list):
+            lines = '\n'.join(' '.join(cmds[1:]) for cmds in cmds_list)
+            with GpulimitClient(address, pwd='/tmp') as client:
+                assert client.request(['add-batch', f'--lines={lines}'])['code'] == 0
+
+        table = pt.PrettyTable(['tasks', 'method', 'time', 'tasks/s'])
+        for n in args.tasks:
+            cmds_list = [['add', 'python', 'train.py', f'--lr={i}'] for i in range(n)]
+            for name, func in (('add, connection per task', add_loop),
+                               ('add, persistent', add_persistent),
+                               ('add, pipelined', add_pipeline),
+                               ('add-batch', add_batch)):
+                start = time.perf_counter()
+                func(cmds_list)
+                elapsed = time.perf_counter() - start
+                table.add_row([n, name, f'{elapsed:.2f}s', f'{n / elapsed:.0f}'])
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Time to fill an empty machine: `--tasks` tasks queued at once on `--gpus`
+idle GPUs, in the simulator. Reports the virtual time until every GPU runs
+a task, the tasks started by then, and the wall time of a pass.
+
+    python benchmarks/bench_dispatch.py --gpus=8 --tasks=500
+"""
+import argparse
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_core.simulator import Simulator, TraceTask
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+
+
+class FillSimulator(Simulator):
+    """
+    records when all GPUs run a task first.
+    """
+    full_time = None
+    full_starts = None
+
+    def on_start(self, task):
+        super().on_start(task)
+        if self.full_time is None and all(self._gpu_running):
+            self.full_time, self.full_starts = self.now, self._starts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time to full GPU utilization')
+    parser.add_argument('--gpus', type=int, default=8)
+    parser.add_argument('--tasks', type=int, default=500)
+    args = parser.parse_args()
+
+    # tasks allocate 4G in their first 20 seconds, and run longer than the benchmark
+    unsized = [TraceTask(submit=0, duration=3600, gpu_mem=[(0, 0.5), (20, 4)])
+               for _ in range(args.tasks)]
+    sized = [task._replace(request_gpu_mem=4.5) for task in unsized]
+
+    table = pt.PrettyTable(['tasks', 'BATCH_DISPATCH', 'time to full', 'started',
+                            'pass time'])
+    for name, trace in (('no --gpu-mem', unsized), ('--gpu-mem=4.5', sized)):
+        for batch in (1, 0):
+            simulator = FillSimulator(BaseScheduling(), gpus=args.gpus, gpu_memory=24,
+                                      params={'BATCH_DISPATCH': batch})
+            report = simulator.run(trace, max_time=1800)
+            if simulator.full_time is None:
+                full, started = 'never', '-'
+            else:
+                full, started = f'{simulator.full_time:.0f}s', simulator.full_starts
+            table.add_row([name, batch, full, started,
+                           common.ms(report.pass_time / max(report.passes, 1))])
+    print(f'{args.gpus} GPUs, {args.tasks} queued tasks, pass time of the first 30 virtual minutes')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
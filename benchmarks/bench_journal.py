@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Restart time with `--tasks` queued tasks: replaying the journal, and
+loading the snapshot after `TaskJournal.snapshot`, then rebuilding the
+queue (`TaskManage.restore_journal`), as `gpulimit_server` does on start.
+
+    python benchmarks/bench_journal.py --tasks=100000
+"""
+import os
+import argparse
+import tempfile
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_core.run_task_core import TaskManage
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+from gpulimit.gpulimit_core.task_journal import TaskJournal
+
+
+def new_task_manage(logdir):
+    """
+    a task manage writing the journal in `logdir`, without the scheduler
+    thread.
+    """
+    task_manage = TaskManage(BaseScheduling())
+    task_manage.logdir = logdir
+    task_manage.journal = TaskJournal(os.path.join(logdir, 'state'), sync_interval=3600)
+    task_manage.journal.start(task_manage._journal_snapshot, task_manage.lock)
+    return task_manage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='journal replay time')
+    parser.add_argument('--tasks', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as logdir:
+        os.makedirs(os.path.join(logdir, 'state'))
+        task_manage = new_task_manage(logdir)
+        for start in range(0, args.tasks, 10000):
+            lines = '\n'.join(f'python train.py --lr={i}' for i in range(start, min(start + 10000, args.tasks)))
+            task_manage.add_batch('/tmp', lines=lines)
+        journal = task_manage.journal
+        write = common.timeit(journal.flush)
+
+        table = pt.PrettyTable(['from', 'size', 'write', 'replay', 'restore_journal', 'tasks'])
+        for name in ('journal', 'snapshot'):
+            if name == 'snapshot':
+                write = common.timeit(journal.snapshot)
+                path = journal.snapshot_path
+            else:
+                path = journal.journal_path
+            restarted = new_task_manage(logdir)
+            result = []
+            replay = common.timeit(lambda: result.append(restarted.journal.replay()))
+            restore = common.timeit(lambda: restarted.restore_journal(*result[0]))
+            table.add_row([name, f'{os.path.getsize(path) / 1024 ** 2:.1f}MB', f'{write:.2f}s',
+                           f'{replay:.2f}s', f'{restore:.2f}s', len(restarted.queue)])
+        print(f'{args.tasks} queued tasks')
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Packing efficiency of the batch dispatcher in the simulator: GPU busy
+time, OOM runs and queue wait of a synthetic trace, with memory
+reservations (`--gpu-mem`) given for all, some (as in the trace) or none
+of the tasks, and best fit decreasing over a window of `PACKING_WINDOW`
+tasks or one task at a time.
+
+    python benchmarks/bench_packing.py --tasks=300 --gpus=4 --interval=300
+"""
+import argparse
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_core.simulator import Simulator, synthetic_trace
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+
+
+def with_requests(trace, requests):
+    if requests == 'all':
+        # 10% over the peak, as the trace tasks with `--gpu-mem`
+        return [task._replace(request_gpu_mem=round(max(memory for _, memory in task.gpu_mem) * 1.1, 1))
+                for task in trace]
+    if requests == 'none':
+        return [task._replace(request_gpu_mem=None) for task in trace]
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser(description='packing efficiency')
+    parser.add_argument('--tasks', type=int, default=300)
+    parser.add_argument('--gpus', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=300,
+                        help='mean seconds between submits.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    trace = synthetic_trace(args.tasks, 24, args.seed, args.interval)
+    table = pt.PrettyTable(['--gpu-mem', 'PACKING_WINDOW', 'GPU busy', 'oom', 'complete',
+                            'mean wait', 'makespan'])
+    for requests in ('all', 'trace', 'none'):
+        for window in (16, 1):
+            # no memory learned from earlier runs, only the given reservations count
+            params = {'PACKING_WINDOW': window, 'MEMORY_PREDICTION': 0}
+            simulator = Simulator(BaseScheduling(), gpus=args.gpus, gpu_memory=24, params=params)
+            report = simulator.run(with_requests(trace, requests))
+            busy = 1 - report.gpu_idle_hours * 3600 / (args.gpus * report.makespan)
+            table.add_row([requests, window, f'{busy:.1%}', report.oom, report.complete,
+                           f'{report.mean_wait / 3600:.2f}h', f'{report.makespan / 3600:.1f}h'])
+    print(f'{args.tasks} synthetic tasks on {args.gpus} GPUs (24G), '
+          f'GPU busy: share of time a GPU runs a task')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
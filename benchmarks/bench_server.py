@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of `add` requests with `--clients` concurrent clients, each a
+separate process sending `--requests` requests, on a new connection per
+request (as `gpulimit add`) or on one persistent `GpulimitClient`.
+
+    python benchmarks/bench_server.py --clients 1 16 128 --workers=16
+"""
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_client import GpulimitClient
+
+
+def run_client(address, requests, persistent, barrier, results):
+    latencies = []
+    client = GpulimitClient(address, pwd='/tmp') if persistent else None
+    barrier.wait()
+    for i in range(requests):
+        start = time.perf_counter()
+        cmds = ['add', 'python', 'train.py', f'--seed={i}']
+        if persistent:
+            response = client.request(cmds)
+        else:
+            with GpulimitClient(address, pwd='/tmp') as new_client:
+                response = new_client.request(cmds)
+        latencies.append(time.perf_counter() - start)
+        if response['code'] != 0:
+            raise RuntimeError(response['msg'])
+    results.put(latencies)
+
+
+def run(address, clients, requests, persistent):
+    """
+    return (latencies, seconds) of all requests.
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(clients + 1)
+    results = context.Queue()
+    processes = [context.Process(target=run_client,
+                                 args=(address, requests, persistent, barrier, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    barrier.wait()
+    start = time.perf_counter()
+    latencies = []
+    for _ in processes:
+        latencies += results.get()
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='add latency under concurrent clients')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 16, 128])
+    parser.add_argument('--requests', type=int, default=50, help='requests of each client.')
+    parser.add_argument('--workers', type=int, default=16, help='server worker threads.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as logdir:
+        server = common.start_server(logdir, args.workers)
+        table = pt.PrettyTable(['clients', 'connection', 'requests', 'p50', 'p99', 'max',
+                                'requests/s'])
+        for clients in args.clients:
+            for persistent in (False, True):
+                latencies, elapsed = run(server.server_address, clients, args.requests, persistent)
+                table.add_row([clients, 'persistent' if persistent else 'per request',
+                               len(latencies), common.ms(common.percentile(latencies, 50)),
+                               common.ms(common.percentile(latencies, 99)),
+                               common.ms(max(latencies)), f'{len(latencies) / elapsed:.0f}'])
+        print(f'{args.workers} workers')
+        print(table)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of the simulator: wall time of a `--tasks` synthetic trace on
+`--gpus` GPUs for each scheduling policy, and the share of it spent in
+scheduling passes.
+
+    python benchmarks/bench_simulator.py --tasks=500 --gpus=4
+"""
+import time
+import argparse
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_core.simulator import Simulator, synthetic_trace
+from gpulimit.gpulimit_core.policies import policies, get_policy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='simulator speed')
+    parser.add_argument('--tasks', type=int, default=500)
+    parser.add_argument('--gpus', type=int, default=4)
+    parser.add_argument('--policy', nargs='+', default=None, help='default all policies.')
+    args = parser.parse_args()
+
+    trace = synthetic_trace(args.tasks, 24)
+    table = pt.PrettyTable(['policy', 'virtual time', 'wall time', 'speedup', 'passes',
+                            'pass time', 'in passes'])
+    for name in args.policy or list(policies()):
+        simulator = Simulator(get_policy(name), gpus=args.gpus, gpu_memory=24)
+        start = time.perf_counter()
+        report = simulator.run(trace)
+        elapsed = time.perf_counter() - start
+        table.add_row([name, f'{report.makespan / 3600:.1f}h', f'{elapsed:.2f}s',
+                       f'{report.makespan / elapsed:.0f}x', report.passes,
+                       common.ms(report.pass_time / max(report.passes, 1)),
+                       f'{report.pass_time / elapsed:.0%}'])
+    print(f'{args.tasks} synthetic tasks on {args.gpus} GPUs')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
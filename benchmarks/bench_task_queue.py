@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of `TaskQueue` operations against sorting all tasks every scheduling
+pass (`BaseScheduling.sort_for_timer_call`), at queue sizes of `--sizes`.
+
+    python benchmarks/bench_task_queue.py --sizes 10000 100000
+"""
+import random
+import argparse
+
+import common
+from gpulimit.utils import prettytable as pt
+from gpulimit.gpulimit_core.tasks import Task, STATUS_RUNNING
+from gpulimit.gpulimit_core.task_queue import TaskQueue
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+
+
+def make_queue(n, running=0.1, seed=0):
+    rng = random.Random(seed)
+    queue = TaskQueue()
+    for id in range(n):
+        task = Task(id, '/tmp', ['python', 'train.py', str(id)], priority=rng.randint(1, 9))
+        if rng.random() < running:
+            task.status = STATUS_RUNNING
+        queue.push(task)
+    return queue
+
+
+def per_op(func, ops, repeat=3):
+    return common.timeit(lambda: [func() for _ in range(ops)], repeat) / ops
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TaskQueue operations')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    table = pt.PrettyTable(['tasks', 'sort per pass', 'pop_runnable+update', 'push+remove',
+                            'update (priority)', 'move', 'snapshot (unchanged)'])
+    for n in args.sizes:
+        queue = make_queue(n)
+        rng = random.Random(1)
+        sort = per_op(lambda: BaseScheduling.sort_for_timer_call(queue.snapshot())[0], 1)
+
+        def pop():
+            # next task does not fit, it is put back
+            queue.update(queue.pop_runnable())
+
+        def push_remove():
+            task = Task(n, '/tmp', ['python', 'train.py'])
+            queue.push(task)
+            queue.remove(task.id)
+
+        def update():
+            task = queue.get(rng.randrange(n))
+            task.priority = rng.randint(1, 9)
+            queue.update(task)
+
+        def move():
+            queue.move(rng.randrange(n), rng.randrange(n))
+
+        table.add_row([n, common.ms(sort), common.us(per_op(pop, 1000)),
+                       common.us(per_op(push_remove, 1000)), common.us(per_op(update, 1000)),
+                       common.ms(per_op(move, 10)), common.us(per_op(queue.snapshot, 1000))])
+    print('10% of tasks running, time per operation')
+    print(table)
+
+
+if __name__ == '__main__':
+    main()
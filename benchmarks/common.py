@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers of the benchmark scripts, run them from the repo root:
+
+    python benchmarks/bench_dispatch.py
+
+Benchmarks need no GPU: the scheduler runs in the simulator, or against a
+fake `System` backend (see `tests/conftest.py`) of a machine without GPUs,
+so queued tasks are never started.
+"""
+import os
+import sys
+import math
+import time
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from gpulimit.gpulimit_core.system_info import System
+
+
+def fake_system(gpus=0, gpu_memory=24):
+    from tests.conftest import FakeBackend
+    backend = FakeBackend(gpus, gpu_memory)
+    System.set_backend(backend)
+    return backend
+
+
+def start_server(logdir, workers=16, timeout=30):
+    """
+    start the global `task_manage` in `logdir` and a server on a socket in
+    it, as `Server.__init__` does without touching `/tmp/gpulimit`. Queued
+    tasks are not started (no GPU).
+    """
+    from gpulimit.gpulimit_core import task_manage
+    from gpulimit.gpulimit_server import Server
+
+    fake_system()
+    task_manage.start_thread.daemon = True
+    task_manage.start(logdir=logdir)
+
+    server = object.__new__(Server)
+    server.workers, server.backlog, server.timeout = workers, 1024, timeout
+    server.metrics_port = None
+    server.max_request_size = 256 * 1024 * 1024
+    server.server_address = os.path.join(logdir, 'gpulimit.sock')
+    server.task_manage = task_manage
+    server.func_map = {'add': task_manage.add, 'add-batch': task_manage.add_batch}
+    server.func_map.update(task_manage.func_map)
+    threading.Thread(target=server.start, daemon=True).start()
+    while not os.path.exists(server.server_address):
+        time.sleep(0.01)
+    return server
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def timeit(func, repeat=1):
+    """
+    best wall time (seconds) of `repeat` calls.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def ms(seconds):
+    return f'{seconds * 1000:.2f}ms'
+
+
+def us(seconds):
+    return f'{seconds * 1e6:.1f}us'
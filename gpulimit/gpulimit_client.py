@@ -1,12 +1,11 @@
 #! /usr/bin/python3
 
 import sys, socket, os
-import pickle as pk
 
 parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) 
 sys.path.insert(0, parentdir) 
 
-from gpulimit.gpulimit_core.socket_utils import send_all, recv_all_str
+from gpulimit.gpulimit_core import protocol
 
 
 if sys.platform == 'linux':
@@ -28,27 +27,196 @@ def connect():
     return sock
 
 
+def send_request(sock, request):
+    """
+    send `request`, if the server closed the connection while it is sent
+    (e.g. the request is too large), its error response is read next.
+    """
+    try:
+        protocol.send_message(sock, request)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+class GpulimitClient(object):
+    """
+    Python client of gpulimit server.
+    
+    Keep one connection open, and send requests with request ids on it, 
+    `pipeline` sends up to `window` requests before reading responses.
+    
+    Examples:
+        
+        ```
+        with GpulimitClient() as client:
+            print(client.call(['ls']))
+            results = client.pipeline([['add', 'python3', 'main.py', f'--lr={lr}'] 
+                                       for lr in [0.1, 0.01, 0.001]])
+            for chunk in client.stream(['log', '1', '--follow']):
+                print(chunk, end='')
+        ```
+        
+    """
+    def __init__(self, address=None, pwd=None, window=64):
+        self.address = server_address if address is None else address
+        self.pwd = os.getcwd() if pwd is None else pwd
+        self.window = window
+        
+        if isinstance(self.address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect(self.address)
+        self._request_id = 0
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+        
+    def close(self):
+        self.sock.close()
+        
+    def _send(self, cmds, pwd):
+        request_id = self._request_id
+        self._request_id += 1
+        send_request(self.sock, protocol.make_request(self.pwd if pwd is None else pwd, cmds, request_id))
+        return request_id
+    
+    def _recv(self):
+        return protocol.recv_message(self.sock, max_size=None)
+    
+    def request(self, cmds, pwd=None):
+        """
+        send one command, e.g. `['ls', '--rows']`, return the response dict
+        with `code`, `msg` and `data`.
+        """
+        return self.pipeline_requests([cmds], pwd)[0]
+        
+    def call(self, cmds, pwd=None):
+        """
+        send one command, e.g. `['ls', '--all']`, return the response str.
+        """
+        return self.request(cmds, pwd)['msg']
+    
+    def pipeline_requests(self, cmds_list, pwd=None):
+        """
+        send many commands, return response dicts in the same order.
+        """
+        responses = {}
+        request_ids = []
+        
+        def recv():
+            response = self._recv()
+            request_id = response['id']
+            if request_id is None: # request rejected before its id was read
+                request_id = min(set(request_ids) - set(responses))
+            responses[request_id] = response
+            
+        for cmds in cmds_list:
+            request_ids.append(self._send(cmds, pwd))
+            if len(request_ids) - len(responses) >= self.window:
+                recv()
+        while len(responses) < len(request_ids):
+            recv()
+        return [responses[request_id] for request_id in request_ids]
+    
+    def pipeline(self, cmds_list, pwd=None):
+        """
+        send many commands, return response strs in the same order.
+        """
+        return [response['msg'] for response in self.pipeline_requests(cmds_list, pwd)]
+    
+    def stream(self, cmds, pwd=None):
+        """
+        send a streaming command, e.g. `['log', '1', '--follow']`, yield
+        output strs until the command ends, then the response is in 
+        `self.last_response`. It uses a new connection, which is closed by
+        the server after the response.
+        """
+        self.last_response = None
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+            send_request(sock, protocol.make_request(self.pwd if pwd is None else pwd, cmds))
+            for message in recv_stream(sock):
+                if protocol.is_chunk(message):
+                    yield message['chunk']
+                else:
+                    self.last_response = message
+                    if message['msg']:
+                        yield message['msg']
+        finally:
+            sock.close()
+    
+
+def recv_stream(sock):
+    """
+    yield chunk messages and the final response of a streaming command,
+    a normal command only has the response.
+    """
+    while True:
+        message = protocol.recv_message(sock, max_size=None)
+        yield message
+        if not protocol.is_chunk(message):
+            return
+
+
 def show_help():
     print('help: this is help')
 
 
+def read_batch(argv):
+    """
+    `add-batch [file]`: read task lines from [file] or stdin, and send them
+    as `--lines`.
+    """
+    args = [arg for arg in argv[1:] if not arg.startswith('--')]
+    options = [arg for arg in argv[1:] if arg.startswith('--')]
+    if not args or args[0] == '-':
+        lines = sys.stdin.read()
+    else:
+        with open(args[0], 'r', encoding='utf8') as f:
+            lines = f.read()
+    return [argv[0]] + options + [f'--lines={lines}']
+
+
 def main():
     if len(sys.argv) == 1:
         print(f'use `{sys.argv[0]} help` to show help message.')
         exit(0)
+    argv = sys.argv[1:]
+    if argv[0] == 'add-batch':
+        argv = read_batch(argv)
+        
     sock = connect()
     pwd = os.getcwd()
     
-    send_all(sock, pk.dumps([pwd, sys.argv[1:]]))
-    result = recv_all_str(sock)
-    sock.close()
-    print(f'{result}')
-
-    if sys.argv[1] == 'log':
-        if result != 'Error':
-            os.system(f'less {result}')
-        else:
-            print('[error]: please check task id.')
+    send_request(sock, protocol.make_request(pwd, argv))
+    try:
+        for response in recv_stream(sock):
+            if protocol.is_chunk(response):
+                sys.stdout.write(response['chunk'])
+                sys.stdout.flush()
+    except KeyboardInterrupt: # stop `log --follow`
+        sys.exit(0)
+    finally:
+        sock.close()
+    
+    streamed = isinstance(response['data'], dict) and 'offset' in response['data']
+    print(f'{response["msg"]}', end='' if streamed and response['code'] == 0 else '\n')
+    
+    if argv[0] == 'log' and response['code'] == 0 and not streamed:
+        if os.path.exists(response['msg']):
+            os.system(f'less {response["msg"]}')
+        else: # server is on another host
+            print(f'[info]: use `log {" ".join(argv[1:])} --tail=N` or `--follow` to read it from server.')
+    
+    sys.exit(response['code'] != 0)
 
 
 if __name__=='__main__':
@@ -1,2 +1,2 @@
 from .run_task_core import task_manage
-from .socket_utils import send_all, recv_all, send_all_str, recv_all_str
\ No newline at end of file
+from .socket_utils import send_all, send_parts, recv_all, send_all_str, recv_all_str
\ No newline at end of file
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Server log and structured task events.
+
+All log records go through a `QueueHandler` to one background writer
+thread (`QueueListener`), so threads logging in hot paths (scheduler,
+server workers, supervisor) never wait for the disk.
+
+Records emitted by `emit(event, msg, **fields)` are also written to the
+events file, one json object per line:
+
+    {"time": 1700000000.0, "event": "finish", "id": 3, "gpu": [0], "msg": "...", ...}
+
+Event types (`EVENT_TYPES`) and their fields:
+
+    add                      id, pwd, cmds, priority, gpus (`add-batch`: id, 
+                             last_id, count, one event for all tasks)
+    start                    id, gpu, run_times, pid, gpu_mem, cpu_mem, wait (seconds 
+                             from added or the last run ended)
+    finish                   id, gpu, status, returncode, runtime, peak_gpu_mem, peak_cpu_mem
+    oom                      id, gpu, returncode, reason ('host': SIGKILL by the
+                             OOM killer, 'gpu': out of memory in output)
+    kill                     id, gpu, runtime
+    error                    id, error (command can not be started)
+    attach                   id, gpu, pid (running task found after restart)
+    pause, resume            id
+"""
+import os
+import json
+import queue
+import logging
+import logging.handlers
+
+
+EVENT_TYPES = ('add', 'start', 'finish', 'oom', 'kill', 'error', 'attach', 'pause', 'resume')
+
+logger = logging.getLogger('gpulimit.events')
+
+# `listener(event, fields)` is called in the emitting thread for each event
+listeners = []
+
+
+def emit(event, msg, **fields):
+    """
+    log `msg` to the server log and the event with `fields` to the events
+    file, `event` is one of `EVENT_TYPES`.
+    """
+    for listener in listeners:
+        try:
+            listener(event, fields)
+        except Exception as e:
+            logger.warning(f'[events]: listener failed: {e}')
+    logger.info(msg, extra={'event': event, 'fields': fields})
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {'time': round(record.created, 3), 'event': record.event}
+        event.update(record.fields)
+        event['msg'] = record.getMessage()
+        return json.dumps(event, separators=(',', ':'), default=str)
+
+
+class EventLog(object):
+    """
+    Property:
+
+        log_file                 str: server log (text)
+        events_file              str: events (json lines), rotated at
+                                 `max_bytes` with `backup_count` backups
+
+    Functions:
+
+        start(log_file, events_file, level=logging.INFO)
+        stop()                   write all queued records and stop the writer
+        query(types=None, ids=None, since=None, limit=50)
+
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, backup_count=3):
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.log_file = None
+        self.events_file = None
+        self._listener = None
+        self._queue_handler = None
+
+    def start(self, log_file, events_file, level=logging.INFO):
+        self.stop()
+        self.log_file, self.events_file = log_file, events_file
+
+        text_handler = logging.FileHandler(log_file)
+        text_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        event_handler = logging.handlers.RotatingFileHandler(
+                events_file, maxBytes=self.max_bytes, backupCount=self.backup_count)
+        event_handler.setFormatter(JsonFormatter())
+        event_handler.addFilter(lambda record: hasattr(record, 'event'))
+
+        records = queue.SimpleQueue()
+        self._queue_handler = logging.handlers.QueueHandler(records)
+        self._listener = logging.handlers.QueueListener(
+                records, text_handler, event_handler, respect_handler_level=True)
+        root = logging.getLogger()
+        root.addHandler(self._queue_handler)
+        root.setLevel(level)
+        self._listener.start()
+
+    def stop(self):
+        if self._listener is not None:
+            logging.getLogger().removeHandler(self._queue_handler)
+            self._listener.stop()
+            for handler in self._listener.handlers:
+                handler.close()
+            self._listener = None
+
+    def _files(self):
+        """
+        events files, oldest first.
+        """
+        files = [f'{self.events_file}.{i}' for i in range(self.backup_count, 0, -1)]
+        return [path for path in files + [self.events_file] if os.path.exists(path)]
+
+    @staticmethod
+    def _match_ids(event, ids):
+        first = event.get('id')
+        if not isinstance(first, int):
+            return False
+        last = event.get('last_id', first)
+        return any(start <= last and first <= end for start, end in ids)
+
+    def query(self, types=None, ids=None, since=None, limit=50):
+        """
+        return the last `limit` events (dicts, oldest first) whose type is in
+        `types`, task id in `ids` (a list of (start, end) ranges, see
+        `check_ids`) and time is not before `since`, None means no filter.
+        """
+        if self.events_file is None:
+            return []
+        # cheap text match before parsing the line
+        keys = None if types is None else [f'"event":"{event}"' for event in types]
+        events = []
+        for path in self._files():
+            with open(path, encoding='utf8', errors='replace') as f:
+                for line in f:
+                    if keys is not None and not any(key in line for key in keys):
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError: # being written
+                        continue
+                    if since is not None and event['time'] < since:
+                        continue
+                    if ids is not None and not self._match_ids(event, ids):
+                        continue
+                    events.append(event)
+                    if len(events) > 2 * limit:
+                        del events[:-limit]
+        return events[-limit:] if limit > 0 else events
+
+
+event_log = EventLog()
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import codecs
+import socket
+import logging
+import selectors
+import threading
+import traceback
+
+from collections import namedtuple
+
+from . import protocol
+
+
+# `path` is sent from `offset`, if `follow`, new output is sent until
+# `done()` returns True and the file is sent to the end
+LogStream = namedtuple('LogStream', ('path', 'offset', 'follow', 'done'), defaults=(0, False, None))
+
+
+def tail_offset(path, lines, block_size=64 * 1024):
+    """
+    offset of the last `lines` lines of file `path`, read backwards from
+    the end by blocks, so only the tail of a big file is read.
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if lines <= 0:
+            return end
+        offset = end
+        count = -1 # the last line has no line break after it, or ends the file
+        while offset > 0:
+            size = min(block_size, offset)
+            offset -= size
+            f.seek(offset)
+            block = f.read(size)
+            if offset + size == end and block.endswith(b'\n'):
+                block = block[:-1]
+            i = len(block)
+            while True:
+                i = block.rfind(b'\n', 0, i)
+                if i < 0:
+                    break
+                count += 1
+                if count == lines - 1:
+                    return offset + i + 1
+        return 0
+
+
+class _Stream(object):
+    """
+    state of one streaming connection.
+    """
+    def __init__(self, sock, request_id, log_stream):
+        self.sock = sock
+        self.request_id = request_id
+        self.path = log_stream.path
+        self.offset = log_stream.offset
+        self.follow = log_stream.follow
+        self.done = log_stream.done
+
+        self.file = None
+        self.decoder = codecs.getincrementaldecoder('utf8')(errors='replace')
+        self.buffer = memoryview(b'') # framed message not sent yet
+        self.eof = False # read to the current end of file
+        self.finished = False # final response is in buffer
+        self.writing = False # registered for EVENT_WRITE
+
+    def open(self):
+        if self.file is None:
+            try:
+                self.file = open(self.path, 'rb')
+            except FileNotFoundError: # task not started yet
+                return False
+            self.file.seek(self.offset)
+        elif os.fstat(self.file.fileno()).st_size < self.offset:
+            # truncated
+            self.offset = 0
+            self.file.seek(0)
+            self.decoder.reset()
+        return True
+
+    def rotated(self):
+        """
+        return True if `path` was replaced (rotated, see `LogWriter`), it is
+        reopened after the old file is read to the end.
+        """
+        try:
+            stat = os.fstat(self.file.fileno())
+            rotated = os.stat(self.path).st_ino != stat.st_ino
+        except FileNotFoundError:
+            return False
+        # output written before rotated is read first
+        if rotated and stat.st_size <= self.offset:
+            self.file.close()
+            self.file = None
+            self.offset = 0
+        return rotated
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        self.sock.close()
+
+
+class LogStreamer(object):
+    """
+    Send log files to clients in one thread (`log --tail`, `log --follow`),
+    instead of keeping a server worker thread for each following client.
+
+    The server hands the connection over with `add`, each file is sent in
+    chunk messages (see `protocol.make_chunk`) of at most `chunk_size`
+    bytes, then a final response, and the connection is closed.
+
+    Sockets are non-blocking, the next chunk of a stream is only read after
+    the last one was sent, so a slow client just slows down its own stream
+    (backpressure) and the server keeps at most one chunk per stream in
+    memory. Following streams at the end of file check the file size every
+    `poll_interval` seconds, and reopen the file if it was rotated.
+
+    Functions:
+
+        add(sock, request_id, log_stream)
+                                     stream `LogStream` on `sock`, `sock` is
+                                     closed by the streamer
+
+    """
+    def __init__(self, chunk_size=64 * 1024, poll_interval=0.2):
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._streams = set()
+        self._selector = None
+        self._wake_r, self._wake_w = None, None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._streams)
+
+    def _start(self):
+        if self._thread is None:
+            self._selector = selectors.DefaultSelector()
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._wake_w.setblocking(False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ)
+            self._thread = threading.Thread(target=self._thread_loop, daemon=True)
+            self._thread.start()
+
+    def add(self, sock, request_id, log_stream):
+        sock.setblocking(False)
+        with self._lock:
+            self._start()
+            self._pending.append(_Stream(sock, request_id, log_stream))
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass # already woken
+
+    def _register(self, stream):
+        self._streams.add(stream)
+        # readable when the client closed the connection
+        self._selector.register(stream.sock, selectors.EVENT_READ, stream)
+
+    def _remove(self, stream):
+        self._streams.discard(stream)
+        try:
+            self._selector.unregister(stream.sock)
+        except (KeyError, ValueError):
+            pass
+        stream.close()
+
+    def _read(self, stream):
+        """
+        frame the next chunk of `stream` into its buffer.
+        """
+        if not stream.open():
+            data = b''
+        else:
+            data = stream.file.read(self.chunk_size)
+        if data:
+            stream.offset += len(data)
+            stream.eof = False
+            chunk = stream.decoder.decode(data)
+            if chunk:
+                stream.buffer = memoryview(protocol.frame(protocol.make_chunk(stream.request_id, chunk)))
+            return
+
+        if stream.follow and stream.file is not None and stream.rotated():
+            return
+        stream.eof = True
+        if stream.follow and not (stream.done is not None and stream.done()):
+            return
+        # `done` is checked before the last read, no output is lost
+        if stream.follow and stream.file is not None and \
+                os.fstat(stream.file.fileno()).st_size > stream.offset:
+            stream.eof = False
+            return
+        tail = stream.decoder.decode(b'', final=True)
+        data = {'offset': stream.offset}
+        if stream.file is None:
+            response = protocol.make_response(stream.request_id, 1,
+                            f'[error]: log file {stream.path} not found.', data)
+        else:
+            response = protocol.make_response(stream.request_id, 0, tail, data)
+        stream.buffer = memoryview(protocol.frame(response))
+        stream.finished = True
+
+    def _send(self, stream):
+        """
+        send as much of the buffer as the socket takes, return False if the
+        client closed the connection.
+        """
+        try:
+            sent = stream.sock.send(stream.buffer)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError: # client closed
+            return False
+        stream.buffer = stream.buffer[sent:]
+
+        writing = len(stream.buffer) > 0
+        if writing != stream.writing:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if writing else 0)
+            self._selector.modify(stream.sock, events, stream)
+            stream.writing = writing
+        return True
+
+    def _closed(self, stream):
+        try:
+            return stream.sock.recv(4096) == b''
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+
+    def _step(self, stream):
+        if len(stream.buffer) == 0:
+            if stream.finished:
+                self._remove(stream)
+                return
+            self._read(stream)
+        if len(stream.buffer) and not self._send(stream):
+            self._remove(stream)
+        elif stream.finished and len(stream.buffer) == 0:
+            self._remove(stream)
+
+    def _thread_loop(self):
+        last_poll = 0
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            for stream in pending:
+                self._register(stream)
+
+            # streams which can be read without waiting
+            ready = [stream for stream in self._streams
+                     if not len(stream.buffer) and not stream.eof]
+            if ready or pending:
+                timeout = 0
+            elif any(stream.eof and not len(stream.buffer) for stream in self._streams):
+                timeout = max(0, last_poll + self.poll_interval - time.time())
+            else:
+                timeout = None
+
+            events = self._selector.select(timeout)
+            for key, mask in events:
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                stream = key.data
+                if mask & selectors.EVENT_READ and self._closed(stream):
+                    self._remove(stream)
+                elif mask & selectors.EVENT_WRITE:
+                    ready.append(stream)
+
+            if time.time() - last_poll >= self.poll_interval:
+                last_poll = time.time()
+                ready += [stream for stream in self._streams
+                          if stream.eof and not len(stream.buffer)]
+
+            for stream in set(ready):
+                if stream not in self._streams:
+                    continue
+                try:
+                    self._step(stream)
+                except Exception:
+                    logging.warning(f'[log]: stream {stream.path} failed.\n{traceback.format_exc()}')
+                    self._remove(stream)
+
+
+log_streamer = LogStreamer()
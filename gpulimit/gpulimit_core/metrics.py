@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduler metrics in OpenMetrics text format (readable by Prometheus),
+see `metrics` command and `gpulimit_server --metrics-port`.
+
+Task lifecycle metrics are updated from task events (`events.listeners`),
+task and GPU gauges are collected when scraped.
+"""
+import time
+import math
+import bisect
+import threading
+
+from . import events
+from .system_info import System
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# seconds, from a fast dispatch to a long training run
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+                300, 900, 1800, 3600, 3 * 3600, 12 * 3600, 24 * 3600, 72 * 3600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join([f'{name}="{_escape(value)}"' for name, value in pairs]) + '}'
+
+
+class Metric(object):
+    """
+    A metric family with label names, values are kept per label values.
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def samples(self):
+        """
+        list of (suffix, label str, value).
+        """
+        with self._lock:
+            values = list(self._values.items())
+        return [('', _labels(self.labelnames, key), value) for key, value in values]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape(self.help)}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{self.name}{suffix}{labels} {_number(value)}'
+                  for suffix, labels, value in self.samples()]
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        return [('_total', labels, value) for _, labels, value in super().samples()]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # [bucket counts (not cumulative), count, sum]
+                counts = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts[0]), counts[1], counts[2]) for key, counts in self._values.items()]
+        samples = []
+        for key, buckets, count, total in values:
+            cumulative = 0
+            for le, n in zip(self.buckets, buckets):
+                cumulative += n
+                le = '+Inf' if le == math.inf else repr(float(le))
+                samples.append(('_bucket', _labels(self.labelnames, key, [('le', le)]), cumulative))
+            samples.append(('_count', _labels(self.labelnames, key), count))
+            samples.append(('_sum', _labels(self.labelnames, key), total))
+        return samples
+
+
+class Registry(object):
+    """
+    Functions:
+
+        register(metric)             return metric
+        add_collector(func)          call `func()` before each `render`, e.g.
+                                     to set gauges
+        render()                     OpenMetrics text
+
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, func):
+        self.collectors.append(func)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines + ['# EOF']) + '\n'
+
+
+registry = Registry()
+
+tasks_gauge = registry.register(Gauge(
+        'gpulimit_tasks', 'Tasks in queue and archive by status.', ['status']))
+events_counter = registry.register(Counter(
+        'gpulimit_task_events', 'Task events by type (see `events`).', ['event']))
+queue_wait = registry.register(Histogram(
+        'gpulimit_queue_wait_seconds', 'Time from task added (or last run ended) to started.'))
+run_duration = registry.register(Histogram(
+        'gpulimit_task_duration_seconds', 'Run time of finished tasks by status.', ['status']))
+dispatch_latency = registry.register(Histogram(
+        'gpulimit_dispatch_latency_seconds',
+        'Time from both the task and its GPUs were free (last task on GPU ended) to dispatch.'))
+timer_call_duration = registry.register(Histogram(
+        'gpulimit_timer_call_duration_seconds', 'Duration of a scheduling pass (`timer_call`).'))
+request_duration = registry.register(Histogram(
+        'gpulimit_request_duration_seconds', 'Server request latency by command.', ['command']))
+gpu_idle = registry.register(Counter(
+        'gpulimit_gpu_idle_seconds', 'Time GPU had no gpulimit task running.', ['gpu']))
+gpu_memory = registry.register(Gauge(
+        'gpulimit_gpu_memory_bytes', 'GPU memory.', ['gpu', 'kind']))
+gpu_utilization = registry.register(Gauge(
+        'gpulimit_gpu_utilization_ratio', 'GPU utilization (0-1).', ['gpu']))
+gpu_tasks = registry.register(Gauge(
+        'gpulimit_gpu_running_tasks', 'Running gpulimit tasks on GPU.', ['gpu']))
+host_memory = registry.register(Gauge(
+        'gpulimit_host_memory_bytes', 'Host memory.', ['kind']))
+
+
+class TaskMetrics(object):
+    """
+    Update lifecycle metrics from task events, and GPU idle time from the
+    `System` sampler.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.gpu_free_time = {} # gpu -> time its last task ended
+        self.gpu_running = {} # gpu -> running tasks
+        self._last_sample = None
+
+    def on_event(self, event, fields):
+        events_counter.inc(event=event)
+        gpus = fields.get('gpu') or []
+        now = time.time()
+        if event in ('start', 'attach'):
+            with self._lock:
+                for gpu in gpus:
+                    self.gpu_running[gpu] = self.gpu_running.get(gpu, 0) + 1
+            if event == 'start':
+                wait = fields.get('wait') or 0
+                queue_wait.observe(wait)
+                with self._lock:
+                    free_time = max([self.gpu_free_time.get(gpu, 0) for gpu in gpus] + [now - wait])
+                dispatch_latency.observe(max(0, now - free_time))
+        elif event == 'finish':
+            if fields.get('runtime') is not None:
+                run_duration.observe(fields['runtime'], status=fields.get('status'))
+            with self._lock:
+                for gpu in gpus:
+                    self.gpu_running[gpu] = max(0, self.gpu_running.get(gpu, 0) - 1)
+                    self.gpu_free_time[gpu] = now
+
+    def on_sample(self, info):
+        with self._lock:
+            last, self._last_sample = self._last_sample, info.time
+            if last is None:
+                return
+            for gpu in info.gpu:
+                if not self.gpu_running.get(gpu.id):
+                    gpu_idle.inc(info.time - last, gpu=gpu.id)
+
+    def collect_system(self):
+        info = System.snapshot()
+        for gpu in info.gpu:
+            for kind in ('total', 'free', 'used'):
+                gpu_memory.set(getattr(gpu, kind) * 1024 ** 3, gpu=gpu.id, kind=kind)
+            if gpu.utilization is not None:
+                gpu_utilization.set(gpu.utilization, gpu=gpu.id)
+            with self._lock:
+                gpu_tasks.set(self.gpu_running.get(gpu.id, 0), gpu=gpu.id)
+        for kind in ('total', 'free', 'used'):
+            host_memory.set(getattr(info.memory, kind) * 1024 ** 3, kind=kind)
+
+
+task_metrics = TaskMetrics()
+events.listeners.append(task_metrics.on_event)
+registry.add_collector(task_metrics.collect_system)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduling policies, selected by name with `gpulimit policy [name]` (no
+restart, tasks in queue are kept) or `gpulimit_server --policy=[name]`.
+
+A policy is a `Scheduling` class which can be created without arguments.
+Other packages can add policies with an entry point in group
+`gpulimit.policies`, e.g. in their setup.py:
+
+    entry_points={'gpulimit.policies': ['my-policy = my_package:MyScheduling']}
+
+"""
+import os
+import heapq
+import logging
+
+from .system_info import System
+from .tasks import Task
+from .scheduling import BaseScheduling
+
+try:
+    import pwd
+except ImportError: # not POSIX
+    pwd = None
+
+
+ENTRY_POINT_GROUP = 'gpulimit.policies'
+DEFAULT_POLICY = 'base'
+
+# name -> scheduling class
+POLICIES = {}
+_entry_points_loaded = False
+
+
+def register_policy(name):
+    """
+    class decorator, register a scheduling class as policy `name`.
+    """
+    def decorator(cls):
+        POLICIES[name] = cls
+        return cls
+    return decorator
+
+
+def _load_entry_points():
+    try:
+        from importlib.metadata import entry_points
+    except ImportError: # python < 3.8
+        return
+    points = entry_points()
+    if hasattr(points, 'select'):
+        points = points.select(group=ENTRY_POINT_GROUP)
+    else:
+        points = points.get(ENTRY_POINT_GROUP, [])
+    for point in points:
+        if point.name in POLICIES:
+            continue
+        try:
+            POLICIES[point.name] = point.load()
+        except Exception as e:
+            logging.warning(f'[policy]: load policy `{point.name}` ({point.value}) failed: {e}')
+
+
+def policies():
+    """
+    dict of policy name -> scheduling class, including entry points.
+    """
+    global _entry_points_loaded
+    if not _entry_points_loaded:
+        _entry_points_loaded = True
+        _load_entry_points()
+    return POLICIES
+
+
+def get_policy(name):
+    """
+    a new scheduling object of policy `name`, None if not found.
+    """
+    cls = policies().get(name)
+    return None if cls is None else cls()
+
+
+def policy_name(scheduling):
+    """
+    policy name of a scheduling object, its class name if not registered.
+    """
+    for name, cls in policies().items():
+        if type(scheduling) is cls:
+            return name
+    return type(scheduling).__name__
+
+
+register_policy(DEFAULT_POLICY)(BaseScheduling)
+
+
+class PolicyScheduling(BaseScheduling):
+    """
+    Base of policies which choose the order tasks are started in. Memory
+    checks and GPU placement are those of `BaseScheduling` (see
+    `dispatch_state`, `try_start`).
+    """
+    def __init__(self):
+        super().__init__()
+        self._runtimes = {} # task id -> expected runtime
+        self._stats_version = None
+
+    def runnable_tasks(self, task_manage):
+        """
+        runnable tasks in listing order, except tasks which ran
+        `MAX_ERR_TIMES` times.
+        """
+        return [task for task in task_manage.queue.ordered() if task_manage.queue.runnable(task)
+                and task.run_times < self.param['MAX_ERR_TIMES']]
+
+    def expected_runtime(self, task_manage, task):
+        """
+        mean runtime (seconds) of complete runs of the same command (see
+        `TaskStats`), None if unknown.
+        """
+        stats = task_manage.stats
+        if self._stats_version != stats.version:
+            self._stats_version = stats.version
+            self._runtimes = {}
+        if task.id not in self._runtimes:
+            estimate = stats.estimate(task.pwd, task.cmds)
+            self._runtimes[task.id] = None if estimate is None else estimate.runtime
+        return self._runtimes[task.id]
+
+    def start(self, task_manage, task, state, excluded_gpu_ids=()):
+        """
+        start task if it fits, return the GPU ids, or None.
+        """
+        if not self.can_start(task, state):
+            return None
+        selected = self.try_start(task, state, excluded_gpu_ids)
+        if selected is not None:
+            task_manage.queue.update(task)
+        return selected
+
+    def reserve_for(self, task, state):
+        gpu_ids = self.reserve(task, state.gpu_free, [gpu.id for gpu in state.gpus], state.running_nums)
+        logging.info(f'reserve GPU({Task._change_gpu_id(gpu_ids)}) for task {task.id}.')
+        return gpu_ids
+
+
+@register_policy('fifo-backfill')
+class FifoBackfillScheduling(PolicyScheduling):
+    """
+    First in first out (listing order, see `mv`), with backfilling.
+
+    If the first waiting task does not fit, it reserves GPUs (see
+    `reserve`) and later tasks are started on the other GPUs. A later task
+    is started on the reserved GPUs only if it is expected to end before
+    the tasks running on them (see `expected_runtime`), so it does not
+    delay the first task (EASY backfilling).
+    """
+    def shadow_time(self, task_manage, gpu_ids, now):
+        """
+        expected time when the tasks running on `gpu_ids` end, None if the
+        runtime of one of them is unknown (nothing is backfilled on them).
+        """
+        end_time = now
+        for task in task_manage.tasks:
+            if task.gpu is None or not set(task.gpu) & set(gpu_ids):
+                continue
+            runtime = self.expected_runtime(task_manage, task)
+            if runtime is None or task.start_time is None:
+                return None
+            end_time = max(end_time, task.start_time + runtime)
+        return end_time
+
+    def timer_call(self, task_manage):
+        state = self.dispatch_state(task_manage)
+        now = System.time()
+        reserved_gpu_ids, shadow_time = [], None
+
+        started = 0
+        with task_manage.lock:
+            for task in self.runnable_tasks(task_manage):
+                if not self.can_start(task, state):
+                    continue
+                excluded_gpu_ids = reserved_gpu_ids
+                if reserved_gpu_ids:
+                    runtime = self.expected_runtime(task_manage, task)
+                    if runtime is not None and shadow_time is not None and now + runtime <= shadow_time:
+                        excluded_gpu_ids = ()
+                if self.start(task_manage, task, state, excluded_gpu_ids) is not None:
+                    started += 1
+                elif not reserved_gpu_ids:
+                    reserved_gpu_ids = self.reserve_for(task, state)
+                    shadow_time = self.shadow_time(task_manage, reserved_gpu_ids, now)
+        return started > 0
+
+
+@register_policy('sjf')
+class ShortestJobFirstScheduling(PolicyScheduling):
+    """
+    Shortest expected job first.
+
+    Tasks are started in order of expected runtime (see
+    `expected_runtime`), then priority and listing order. Tasks never run
+    before are expected to run `SJF_DEFAULT_RUNTIME` seconds.
+
+    Tasks waiting longer than `SJF_MAX_WAIT` seconds (0: never) go first,
+    the first of them which does not fit reserves GPUs (see `reserve`), so
+    long tasks are not starved by a stream of short ones.
+    """
+    def __init__(self):
+        super().__init__()
+        self.param.update({
+            'SJF_DEFAULT_RUNTIME': 3600,
+            'SJF_MAX_WAIT': 86400,
+        })
+
+    def timer_call(self, task_manage):
+        state = self.dispatch_state(task_manage)
+        now = System.time()
+        max_wait = self.param['SJF_MAX_WAIT']
+
+        def key(task):
+            runtime = self.expected_runtime(task_manage, task)
+            starved = 0 < max_wait < now - task.ready_time
+            return (not starved, self.param['SJF_DEFAULT_RUNTIME'] if runtime is None else runtime,
+                    task.priority)
+
+        reserved_gpu_ids = []
+        started = 0
+        with task_manage.lock:
+            for task in sorted(self.runnable_tasks(task_manage), key=key):
+                if not self.can_start(task, state):
+                    continue
+                if self.start(task_manage, task, state, reserved_gpu_ids) is not None:
+                    started += 1
+                elif not reserved_gpu_ids and 0 < max_wait < now - task.ready_time:
+                    reserved_gpu_ids = self.reserve_for(task, state)
+        return started > 0
+
+
+@register_policy('fair-share')
+class FairShareScheduling(PolicyScheduling):
+    """
+    Fair share of GPUs between users.
+
+    Users are owners of the task `pwd`, the next task is taken from the
+    user with the fewest GPUs in use, then the least GPU time used
+    recently (GPU seconds of ended runs, halved every
+    `FAIR_SHARE_HALF_LIFE` seconds). Tasks of a user are started by
+    priority, then listing order.
+
+    Usage is counted from the finished tasks in archive when the policy
+    is selected, and then from ended runs (`callback_process_end`).
+    """
+    def __init__(self):
+        super().__init__()
+        self.param.update({
+            'FAIR_SHARE_HALF_LIFE': 86400,
+        })
+        self._users = {} # pwd -> user
+        self._usage = {} # user -> (GPU seconds, time)
+        self._counted = False
+
+    def user(self, task):
+        user = self._users.get(task.pwd)
+        if user is None:
+            try:
+                user = pwd.getpwuid(os.stat(task.pwd).st_uid).pw_name
+            except (OSError, KeyError, AttributeError): # not found, or not POSIX
+                user = task.pwd
+            self._users[task.pwd] = user
+        return user
+
+    def usage(self, user, now):
+        usage, time = self._usage.get(user, (0, now))
+        return usage * 0.5 ** (max(0, now - time) / self.param['FAIR_SHARE_HALF_LIFE'])
+
+    def _count(self, task, now):
+        if task.start_time is None or task.end_time is None:
+            return
+        gpu_time = task.gpu_num * (task.end_time - task.start_time)
+        # GPU time decayed from the task end
+        gpu_time *= 0.5 ** (max(0, now - task.end_time) / self.param['FAIR_SHARE_HALF_LIFE'])
+        user = self.user(task)
+        self._usage[user] = (self.usage(user, now) + gpu_time, now)
+
+    def _count_archive(self, task_manage, now, skip_id=None):
+        if not self._counted:
+            self._counted = True
+            for record in task_manage.archived_tasks:
+                if record.id != skip_id:
+                    self._count(record, now)
+
+    def callback_process_end(self, task_manage, *args, task=None, **kwargs):
+        if task is not None:
+            now = System.time()
+            self._count_archive(task_manage, now, skip_id=task.id)
+            self._count(task, now)
+
+    def timer_call(self, task_manage):
+        state = self.dispatch_state(task_manage)
+        now = System.time()
+        self._count_archive(task_manage, now)
+
+        started = 0
+        with task_manage.lock:
+            queues = {}
+            for task in sorted(self.runnable_tasks(task_manage), key=lambda task: task.priority):
+                queues.setdefault(self.user(task), []).append(task)
+            used_gpus = {}
+            for task in task_manage.tasks:
+                if task.gpu is not None:
+                    user = self.user(task)
+                    used_gpus[user] = used_gpus.get(user, 0) + len(task.gpu)
+
+            heap = [(used_gpus.get(user, 0), self.usage(user, now), user) for user in queues]
+            heapq.heapify(heap)
+            while heap:
+                gpus, usage, user = heapq.heappop(heap)
+                tasks = queues[user]
+                # the first tasks of a user which fit, others wait for the next pass
+                for i, task in enumerate(tasks[:self.param['PACKING_WINDOW']]):
+                    if self.start(task_manage, task, state) is not None:
+                        started += 1
+                        del tasks[i]
+                        if tasks:
+                            heapq.heappush(heap, (gpus + task.gpu_num, usage, user))
+                        break
+        return started > 0
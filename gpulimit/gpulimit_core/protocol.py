@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Wire protocol between `gpulimit` client and `gpulimit_server`.
+
+Each message is a length-prefixed (see `socket_utils`) utf8 JSON object.
+
+    request:     {"v": 1, "id": request_id or null, "pwd": str, "cmds": [str, ...]}
+    response:    {"v": 1, "id": request_id or null, "code": int, "msg": str, "data": ...}
+
+`code` is the return code of the command (0 means succeed), or
+`CODE_BAD_REQUEST` / `CODE_SERVER_ERROR` for protocol and server errors.
+`data` is an optional structured payload, e.g. `ls --rows` returns
+`{"columns": [...], "rows": [[...], ...]}`.
+
+The server rejects requests bigger than its `max_request_size` (see 
+`gpulimit_server --max-request-size`): it responds `CODE_BAD_REQUEST` and
+closes the connection. Responses read by the client have no size limit.
+
+If the request `id` is null, the server closes the connection after the
+response, else the connection is kept for more requests.
+
+Streaming commands (e.g. `log --follow`) send any number of chunk messages
+before the response, and the connection is closed after the response:
+
+    chunk:       {"v": 1, "id": request_id or null, "chunk": str}
+"""
+import json
+
+from .socket_utils import HEADER, send_all, recv_all
+
+
+PROTOCOL_VERSION = 1
+
+CODE_OK = 0
+CODE_BAD_REQUEST = 400
+CODE_SERVER_ERROR = 500
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':'), default=str).encode('utf8')
+
+
+def decode(data):
+    try:
+        message = json.loads(data.decode('utf8'))
+    except ValueError as e:
+        raise ProtocolError(f'message is not json: {e}')
+    if not isinstance(message, dict):
+        raise ProtocolError('message is not a json object.')
+    if message.get('v') != PROTOCOL_VERSION:
+        raise ProtocolError(f'protocol version {message.get("v")} is not supported, '
+                            f'server use version {PROTOCOL_VERSION}.')
+    return message
+
+
+def make_request(pwd, cmds, request_id=None):
+    return {'v': PROTOCOL_VERSION, 'id': request_id, 'pwd': pwd, 'cmds': list(cmds)}
+
+
+def make_response(request_id, code, msg, data=None):
+    return {'v': PROTOCOL_VERSION, 'id': request_id, 'code': code, 'msg': msg, 'data': data}
+
+
+def make_chunk(request_id, chunk):
+    return {'v': PROTOCOL_VERSION, 'id': request_id, 'chunk': chunk}
+
+
+def is_chunk(message):
+    return 'chunk' in message
+
+
+def check_request(message):
+    pwd, cmds = message.get('pwd'), message.get('cmds')
+    if not isinstance(pwd, str):
+        raise ProtocolError('request `pwd` must be a str.')
+    if not isinstance(cmds, list) or not cmds or not all(isinstance(cmd, str) for cmd in cmds):
+        raise ProtocolError('request `cmds` must be a non-empty list of str.')
+    return message.get('id'), pwd, cmds
+
+
+def frame(message):
+    """
+    encoded message with length header, as sent by `send_message`.
+    """
+    data = encode(message)
+    return HEADER.pack(len(data)) + data
+
+
+def send_message(sock, message):
+    send_all(sock, encode(message))
+
+
+def recv_message(sock, max_size=None):
+    return decode(recv_all(sock, max_size=max_size))
@@ -1,15 +1,30 @@
 # -*- coding: utf-8 -*-
-import os, time
+import os
+import json
+import gc
+import time
+import shlex
+import types
 import threading
 import logging
-import heapq # TODO
+import psutil
 
 from gpulimit.utils import prettytable as pt
-from gpulimit.utils import check_input
+from gpulimit.utils import check_input, check_ids, memory_size, time_span
 
 from .system_info import System
-from .tasks import Task, STATUS_COMPLETE, STATUS_CMD_ERROR, Status
+from .tasks import Task, STATUS_COMPLETE, STATUS_CMD_ERROR, STATUS_RUNNING, STATUS_KILLED, \
+                   STATUS_PAUSED, STATUS_INTERRUPTED, STATUS_WAITING, ALIVE_STATUS, Status
+from .task_queue import TaskQueue
+from .task_archive import TaskArchive, ARCHIVE_STATUS
+from .task_stats import TaskStats
+from .task_journal import TaskJournal
+from .log_stream import LogStream, tail_offset
+from .task_log import base_paths, attempt_path
+from .events import emit, event_log, EVENT_TYPES
+from .metrics import registry, task_metrics, tasks_gauge, timer_call_duration
 from .scheduling import BaseScheduling
+from .policies import policies, get_policy, policy_name
 
 
 class TaskManage(object):
@@ -18,7 +33,10 @@ class TaskManage(object):
     
     Property:
         
-        tasks                    list: all task list
+        queue                    TaskQueue: indexed priority queue of live tasks
+        archive                  TaskArchive: finished (complete, CMD_ERROR, killed) tasks
+        stats                    TaskStats: peak memory and runtime of complete tasks
+        journal                  TaskJournal: journal of task changes, None before `start`
         logdir                   str: log dir path
         scheduling               scheduling class
         setter_param             a dict of variable parameter
@@ -28,17 +46,34 @@ class TaskManage(object):
         start(self, logdir='./tmp', MINI_MEM_REMAIN=1024, MAX_ERR_TIMES=5, WAIT_TIME=10)
         add_task(self, new_task, priority=5)
         get_task(self, id)
+        get_tasks(self, id_ranges)
         rm_task(self, id)
+        rm_tasks(self, ids)
+        add_batch(self, pwd, *, lines, priority=5)
+        restore_task(self, id)
+        restore_journal(self, next_id, records)
+        tasks_gpu_memory(self)
+        hidden_gpu_memory(self)
+        tasks_memory(self)
+        estimate_memory(self, task)
         mv_task(self, id, index)
         change_priority(self, id, priority)
+        set_scheduling(self, scheduling)
         
     Decorator:
         
         client
         
     """
+    # class of new tasks, e.g. `SimTask` in `Simulator`
+    task_class = Task
+    
     def __init__(self, scheduling):
-        self.queue = []
+        self.lock = threading.RLock()
+        self.queue = TaskQueue(self.lock)
+        self.archive = TaskArchive()
+        self.stats = TaskStats()
+        self.journal = None
         self._id_give = 0
         
         self.logdir = None
@@ -47,28 +82,81 @@ class TaskManage(object):
         
         self._setter_param = {
             'TIMER_POLLING_TIME': 10,
+            'MAX_ARCHIVE_TASKS': 10000,
+            'GPU_SAMPLE_INTERVAL': 1,
+            'GPU_MAX_STALENESS': 5,
+            'MEMORY_PREDICTION': 1,
+            'PREDICTION_MARGIN': 0.1,
+            'JOURNAL_SYNC_INTERVAL': 0.2,
+            'SNAPSHOT_EVENTS': 100000,
+            'KILL_TIMEOUT': 5,
+            'LOG_MAX_SIZE': 0,
+            'LOG_MAX_FILES': 5,
+            'LOG_COMPRESS': 1,
+            'LOG_DISK_BUDGET': 0,
         }
         
         self._setter_param.update(self.scheduling.param)
         
         self.start_thread = threading.Thread(target=self._thread_start_task)
-        self.lock = threading.RLock()
+        
+        # wake up `_thread_start_task` when a task ends, a task is added or
+        # a param changed, `TIMER_POLLING_TIME` is only the fallback timeout.
+        self._wakeup = threading.Condition()
+        self._wakeup_flag = False
+        self._logs_checked = 0
         # print('init')
         
     def set_param(self, k, v):
         self._setter_param[k] = v
         if k in self.scheduling.param:
             self.scheduling.param[k] = v
+        if k == 'GPU_SAMPLE_INTERVAL':
+            System.set_sampling(interval=v)
+        if k == 'GPU_MAX_STALENESS':
+            System.set_sampling(max_staleness=v)
+        if k == 'JOURNAL_SYNC_INTERVAL' and self.journal is not None:
+            self.journal.sync_interval = v
+        if k == 'SNAPSHOT_EVENTS' and self.journal is not None:
+            self.journal.snapshot_events = v
+        if k == 'KILL_TIMEOUT':
+            Task.kill_timeout = v
+        if k == 'LOG_MAX_SIZE':
+            Task.log_max_size = int(v * 1024 * 1024 * 1024)
+        if k == 'LOG_MAX_FILES':
+            Task.log_max_files = v
+        if k == 'LOG_COMPRESS':
+            Task.log_compress = v
+        self.notify_scheduling()
     
     def get_param(self, k):
         return self._setter_param[k]
     
+    def set_scheduling(self, scheduling):
+        """
+        replace the scheduling object, tasks in queue are kept. Params of 
+        the new scheduling which the old one also has keep their values.
+        
+        """
+        with self.lock:
+            old = self.scheduling
+            for k in old.param:
+                if k not in scheduling.param:
+                    self._setter_param.pop(k, None)
+            for k, v in scheduling.param.items():
+                if k in old.param:
+                    scheduling.param[k] = old.param[k]
+                else:
+                    self._setter_param[k] = v
+            self.scheduling = scheduling
+        self.notify_scheduling()
+    
     def get_params(self):
         return self._setter_param.items()
         
     def start(self, logdir='./tmp', **kwargs):
         """
-        init setting, and start timer scheduling
+        init setting, restore tasks from journal, and start timer scheduling
         
         """
         print('start')
@@ -76,76 +164,470 @@ class TaskManage(object):
         self.logdir = logdir
         if not os.path.exists(logdir):
             os.makedirs(logdir)
-        else:
-            # del logfiles in log dir
-            for logname in os.listdir(self.logdir):
-                path = os.path.join(logdir, logname) 
-                if os.path.isfile(path):
-                    os.remove(path)   
 
         self.log_file = os.path.join(self.logdir, 'main.log')
-
-        logging.basicConfig(filename=self.log_file, level=logging.INFO, format='%(asctime)s - %(message)s')
-        logging.basicConfig(filename=self.log_file, level=logging.WARNING, format='%(asctime)s - %(message)s')
-
-
+        
+        # files in `state` dir are kept between restarts
+        state_dir = os.path.join(self.logdir, 'state')
+        if not os.path.exists(state_dir):
+            os.makedirs(state_dir)
+        event_log.start(self.log_file, os.path.join(state_dir, 'events.jsonl'))
+        self.stats.path = os.path.join(state_dir, 'task_stats.json')
+        self.stats.load()
+        
         for k, v in kwargs.items():
             self.set_param(k, v)
         
+        self.journal = TaskJournal(state_dir, self.get_param('JOURNAL_SYNC_INTERVAL'), 
+                                   self.get_param('SNAPSHOT_EVENTS'))
+        self.restore_journal(*self.journal.replay())
+        
+        # del logfiles of removed tasks in log dir, files of other runs and
+        # rotated segments are kept with `out_path`
+        keep_paths = set([task.out_path for task in self.tasks + self.archived_tasks] + [self.log_file])
+        abs_keep_paths = None
+        for logname in os.listdir(self.logdir):
+            path = os.path.join(logdir, logname) 
+            if not os.path.isfile(path) or any(base in keep_paths for base in base_paths(path)):
+                continue
+            if abs_keep_paths is None:
+                abs_keep_paths = set(os.path.abspath(path) for path in keep_paths if path is not None)
+            if not any(os.path.abspath(base) in abs_keep_paths for base in base_paths(path)):
+                os.remove(path)
+
+        self.journal.start(self._journal_snapshot, self.lock)
+        registry.add_collector(self._collect_metrics)
+        System.add_listener(self._sample_peaks)
+        System.add_listener(task_metrics.on_sample)
+        System.start_sampler(self.get_param('GPU_SAMPLE_INTERVAL'), 
+                             self.get_param('GPU_MAX_STALENESS'))
         self.start_thread.start()
         
         
+    def restore_journal(self, next_id, records):
+        """
+        rebuild queue and archive from journal records. Running tasks whose
+        process is still alive are attached, others are `interrupted`.
+        
+        """
+        # many objects are created at once, don't let gc scan them repeatedly
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._restore_journal(next_id, records)
+        finally:
+            if gc_enabled:
+                gc.enable()
+                
+    def _restore_journal(self, next_id, records):
+        with self.lock:
+            self._id_give = max(self._id_give, next_id)
+            archived = [record for record in records if record.get('archived')]
+            for record in sorted(archived, key=lambda record: record['end_time'] or 0):
+                record = dict(record, status=Status(record['status']))
+                self.archive.add(types.SimpleNamespace(**record), self.get_param('MAX_ARCHIVE_TASKS'))
+            
+            attached = []
+            live = [record for record in records if not record.get('archived')]
+            for record in sorted(live, key=lambda record: record['order']):
+                task = self._new_task(record['id'], record['pwd'], record['cmds'], record['priority'], 
+                                      record['out_path'], record['gpu_mem'], record['cpu_mem'], 
+                                      record['gpu_num'])
+                for name in ('run_times', 'start_time', 'end_time', 'debug_msg', 'mem_estimated', 
+                             'peak_gpu_mem', 'peak_cpu_mem'):
+                    setattr(task, name, record[name])
+                task.status = Status(record['status'])
+                if task.status in (STATUS_RUNNING, STATUS_PAUSED):
+                    process = self._find_process(record)
+                    if process is None:
+                        task.status = STATUS_INTERRUPTED
+                        self._journal_put(task, order=record['order'])
+                    else:
+                        task.gpu = record['gpu']
+                        attached.append((task, process))
+                self.queue.push(task, record['order'])
+                
+            for task, process in attached:
+                task.attach(process)
+                
+        logging.info(f'restore {len(live)} tasks ({len(attached)} running) and {len(archived)} '
+                     f'finished tasks from journal.')
+        
+    @staticmethod
+    def _find_process(record):
+        """
+        the process of a running task record, None if it is not running
+        (pid reused by another process if create time changed).
+        
+        """
+        if record.get('pid') is None:
+            return None
+        try:
+            process = psutil.Process(record['pid'])
+            if abs(process.create_time() - (record.get('create_time') or 0)) > 1:
+                return None
+            return process
+        except psutil.Error:
+            return None
+    
+    def _journal_put(self, task, **kwargs):
+        if self.journal is None:
+            return
+        if 'order' not in kwargs:
+            kwargs['order'] = self.queue.order(task.id)
+        if task.pid is not None:
+            try:
+                kwargs['create_time'] = psutil.Process(task.pid).create_time()
+            except psutil.Error:
+                pass
+        self.journal.append('put', t=TaskJournal.record(task, archived=kwargs['order'] is None, **kwargs))
+    
+    def _journal_del(self, ids):
+        if self.journal is not None and ids:
+            self.journal.append('del', ids=list(ids))
+    
+    def _journal_snapshot(self):
+        """
+        (next id, records) of all tasks, called by `journal` under lock.
+        
+        """
+        records = [TaskJournal.record(task, order=self.queue.order(task.id), archived=False) 
+                   for task in self.queue.ordered()]
+        records += [TaskJournal.record(task, order=None, archived=True) 
+                    for task in self.archive.records()]
+        return self._id_give, records
+        
+    def notify_scheduling(self):
+        """
+        wake up the scheduling thread, `timer_call` will run immediately
+        instead of waiting `TIMER_POLLING_TIME`.
+        
+        """
+        with self._wakeup:
+            self._wakeup_flag = True
+            self._wakeup.notify()
+        
     def _thread_start_task(self):
         while True:
             # print('call timer_call')
+            start = time.time()
             self.scheduling.timer_call(self)
-            time.sleep(self.get_param('TIMER_POLLING_TIME'))
+            timer_call_duration.observe(time.time() - start)
+            if time.time() - self._logs_checked >= self.get_param('TIMER_POLLING_TIME'):
+                self._logs_checked = time.time()
+                try:
+                    self.evict_logs()
+                except Exception as e:
+                    logging.warning(f'[log]: evict logs failed: {e}')
+            with self._wakeup:
+                if not self._wakeup_flag:
+                    self._wakeup.wait(self.get_param('TIMER_POLLING_TIME'))
+                self._wakeup_flag = False
+    
+    def _collect_metrics(self):
+        """
+        set task metrics before they are scraped.
+        """
+        counts = dict((str(status), 0) for status in map(Status, Status._int2str))
+        for task in self.tasks + self.archived_tasks:
+            counts[str(task.status)] += 1
+        for status, count in counts.items():
+            tasks_gauge.set(count, status=status)
+        
+    def evict_logs(self):
+        """
+        if files in log dir are bigger than `LOG_DISK_BUDGET` (GB, 0 is no 
+        limit), remove log files of finished (archived) tasks, the task 
+        finished first is removed first. Logs of live tasks are kept.
+        
+        return the number of tasks whose logs are removed.
+        """
+        budget = self.get_param('LOG_DISK_BUDGET') * 1024 * 1024 * 1024
+        if budget <= 0:
+            return 0
+        # out_path -> log files (all runs and segments) in log dir
+        files, used = {}, 0
+        with os.scandir(self.logdir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                size = entry.stat().st_size
+                used += size
+                for base in set(base_paths(os.path.abspath(entry.path))):
+                    files.setdefault(base, []).append((entry.path, size))
+        
+        evicted = 0
+        for record in self.archived_tasks:
+            if used <= budget:
+                break
+            if record.out_path is None:
+                continue
+            removed = False
+            for path, size in files.pop(os.path.abspath(record.out_path), []):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                used -= size
+                removed = True
+            evicted += removed
+        if evicted:
+            logging.info(f'[log]: remove logs of {evicted} finished tasks, log dir uses '
+                         f'{used / 1024 / 1024 / 1024:.2f}G.')
+        return evicted
     
     @property
     def tasks(self):
-        return self.queue.copy()
+        """
+        tuple of live tasks in listing order, an immutable snapshot.
+        """
+        return self.queue.snapshot()
+    
+    @property
+    def archived_tasks(self):
+        """
+        tuple of finished tasks, an immutable snapshot.
+        """
+        records = self.archive.cached_snapshot
+        if records is None:
+            with self.lock:
+                records = self.archive.snapshot()
+        return records
     
     def __len__(self):
         return len(self.queue)
     
     def add_task(self, new_task):
-        self.lock.acquire()
-        self.queue.append(new_task)
-        self.lock.release()
+        with self.lock:
+            self.queue.push(new_task)
+            self._journal_put(new_task)
     
     def get_task(self, id):
-        for task in self.queue:
-            if task.id == id:
-                return task
-        return None
+        """
+        find task [id] in queue, or in archive if it is finished.
+        
+        """
+        with self.lock:
+            task = self.queue.get(id)
+            if task is None:
+                task = self.archive.get(id)
+            return task
+    
+    def get_tasks(self, id_ranges):
+        """
+        find tasks (including archived) in id ranges (from `check_ids`), 
+        sorted by id.
+        
+        """
+        with self.lock:
+            tasks = {}
+            for start, end in id_ranges:
+                if end - start < len(self.queue) + len(self.archive):
+                    for id in range(start, end + 1):
+                        task = self.get_task(id)
+                        if task is not None:
+                            tasks[id] = task
+                else:
+                    for task in self.queue.ordered() + self.archive.records():
+                        if start <= task.id <= end:
+                            tasks[task.id] = task
+            return [tasks[id] for id in sorted(tasks)]
+    
+    def tasks_gpu_memory(self):
+        """
+        GPU memory (GB) used by running tasks, including their child 
+        processes. return dict of task id -> {GPU id: memory}.
+        
+        """
+        pids = dict((task.pid, task.id) for task in self.tasks if task.pid is not None)
+        result = {}
+        for process in System.gpu_processes():
+            id = pids.get(process.pid)
+            if id is None:
+                try:
+                    for parent in psutil.Process(process.pid).parents():
+                        if parent.pid in pids:
+                            id = pids[parent.pid]
+                            break
+                except psutil.Error:
+                    continue
+            if id is not None:
+                used = result.setdefault(id, {})
+                used[process.gpu] = used.get(process.gpu, 0) + process.gpu_memory
+        return result
+    
+    def hidden_gpu_memory(self):
+        """
+        GPU memory (GB) used by processes which are not visible in this PID
+        namespace, e.g. NVML reports host PIDs and the server runs in a 
+        container, so they can not be matched to tasks. return dict of GPU
+        id -> memory.
+        
+        """
+        pids = set(task.pid for task in self.tasks if task.pid is not None)
+        result = {}
+        for process in System.gpu_processes():
+            if process.pid in pids or psutil.pid_exists(process.pid):
+                continue
+            result[process.gpu] = result.get(process.gpu, 0) + process.gpu_memory
+        return result
+    
+    def tasks_memory(self):
+        """
+        host memory (GB, rss) used by running tasks, including their child
+        processes. return dict of task id -> memory.
+        
+        """
+        result = {}
+        for task in self.tasks:
+            if task.pid is None:
+                continue
+            try:
+                process = psutil.Process(task.pid)
+                processes = [process] + process.children(recursive=True)
+            except psutil.Error:
+                continue
+            memory = 0
+            for process in processes:
+                try:
+                    memory += process.memory_info().rss
+                except psutil.Error:
+                    pass
+            result[task.id] = memory / 1024 / 1024 / 1024
+        return result
+    
+    def _sample_peaks(self, info):
+        """
+        sampler listener, update peak memory of running tasks.
+        
+        """
+        if not self.get_param('MEMORY_PREDICTION'):
+            return
+        gpu_used = self.tasks_gpu_memory()
+        memory_used = self.tasks_memory()
+        for id, memory in memory_used.items():
+            task = self.queue.get(id)
+            if task is None:
+                continue
+            task.peak_cpu_mem = max(task.peak_cpu_mem or 0, memory)
+            task.peak_gpu_mem = max([task.peak_gpu_mem or 0] + list(gpu_used.get(id, {}).values()))
+    
+    def estimate_memory(self, task):
+        """
+        use peak memory of previous runs of the same command (see 
+        `TaskStats`) plus `PREDICTION_MARGIN` as the default `gpu_mem` / 
+        `cpu_mem` of task.
+        
+        """
+        if not self.get_param('MEMORY_PREDICTION'):
+            return
+        estimate = self.stats.estimate(task.pwd, task.cmds)
+        if estimate is None:
+            return
+        margin = 1 + self.get_param('PREDICTION_MARGIN')
+        # 0 means the memory was not seen (e.g. pid not visible to NVML)
+        if task.gpu_mem is None and estimate.gpu_mem > 0:
+            task.gpu_mem = round(estimate.gpu_mem * margin, 2)
+            task.mem_estimated = True
+        if task.cpu_mem is None and estimate.cpu_mem > 0:
+            task.cpu_mem = round(estimate.cpu_mem * margin, 2)
+            task.mem_estimated = True
     
     def rm_task(self, id):
-        task = self.get_task(id)
-        if task is None:
-            return False
-        task.kill()
-        self.lock.acquire()
-        self.queue.remove(task)
-        self.lock.release()
-        return True
+        return len(self.rm_tasks([id])) == 1
+    
+    def rm_tasks(self, ids):
+        """
+        remove tasks in one locked pass, running tasks are killed.
+        return removed tasks.
+        
+        """
+        with self.lock:
+            tasks = [self.queue.get(id) for id in ids]
+            tasks = [task for task in tasks if task is not None]
+            for task in tasks:
+                task.kill()
+            removed = self.queue.remove_many([task.id for task in tasks])
+            removed += self.archive.remove_many(ids)
+            self._journal_del([task.id for task in removed])
+            return removed
+    
+    def restore_task(self, id):
+        """
+        move killed task [id] from archive back to queue, so it can be 
+        started again. return the task, or None.
+        
+        """
+        with self.lock:
+            record = self.archive.get(id)
+            if record is None or record.status != STATUS_KILLED:
+                return None
+            self.archive.remove_many([id])
+            task = self._new_task(record.id, record.pwd, record.cmds, record.priority, 
+                                  record.out_path, record.gpu_mem, record.cpu_mem, 
+                                  record.gpu_num)
+            task.run_times = record.run_times
+            task.status = record.status
+            task.mem_estimated = record.mem_estimated
+            self.add_task(task)
+            return task
            
     def mv_task(self, id, index):
-        task = self.get_task(id)
-        if task is None:
-            return False
-        self.lock.acquire()
-        self.queue.remove(task)
-        self.queue.insert(index, task)
-        self.lock.release()
-        return True
+        with self.lock:
+            renumbered = self.queue.renumbered
+            if not self.queue.move(id, index):
+                return False
+            # all orders changed
+            for task in self.queue.ordered() if self.queue.renumbered != renumbered else [self.queue.get(id)]:
+                self._journal_put(task)
+            return True
     
     def change_priority(self, id, priority):
-        task = self.get_task(id)
-        task.priority = priority
-        return True
+        with self.lock:
+            task = self.get_task(id)
+            if task is None:
+                return False
+            task.priority = priority
+            self.queue.update(task)
+            self._journal_put(task)
+            return True
 
     
-    def add(self, pwd, cmds, *, priority:int=5, logpath=None):
+    def _new_task(self, id, pwd, cmds, priority, logpath, gpu_mem=None, cpu_mem=None, gpu_num=1):
+        def task_callback():
+            self._task_end(task)
+            
+        task = self.task_class(id, pwd, cmds, priority, logpath, task_callback, gpu_mem, cpu_mem, gpu_num)
+        task.start_callback = lambda: self._task_started(task)
+        return task
+    
+    def _task_started(self, task):
+        with self.lock:
+            if self.queue.get(task.id) is task:
+                self._journal_put(task)
+    
+    def _task_end(self, task):
+        """
+        task end callback, finished task is moved to archive.
+        
+        """
+        if task.status == STATUS_COMPLETE:
+            self.stats.record(task)
+        # processes of task exited, GPU memory is free now
+        System.invalidate()
+        with self.lock:
+            if self.queue.get(task.id) is task:
+                if task.status in ARCHIVE_STATUS:
+                    self.queue.remove(task.id)
+                    self.archive.add(task, self.get_param('MAX_ARCHIVE_TASKS'))
+                    self._journal_put(task, order=None)
+                else:
+                    self.queue.update(task)
+                    self._journal_put(task)
+        self.scheduling.callback_process_end(self, task=task)
+        self.notify_scheduling()
+    
+    def add(self, pwd, cmds, *, priority:int=5, logpath=None, gpu_mem=None, cpu_mem=None, gpus:int=1):
         '''
         add [cmds]                    ls GPU task queue status
         
@@ -153,23 +635,110 @@ class TaskManage(object):
             
             --priority [priority]     set task priority.
             --logpath  [path]         set task output file path.
+            --gpu-mem  [size]         reserve GPU memory for task (on each GPU), e.g. `6G`, `512M`.
+            --cpu-mem  [size]         reserve host memory for task.
+            --gpus     [num]          number of GPUs the task uses, default 1.
         '''
-        priority = int(priority)
-        
-        def task_callback():
-            self.scheduling.callback_process_end(self)
+        (priority, gpu_mem, cpu_mem, gpus), err_msg = check_input(
+                ((priority, int), (gpu_mem, memory_size), (cpu_mem, memory_size), (gpus, int)))
+        if err_msg:
+            return 1, err_msg
+        if gpus < 1:
+            return 1, f'[error]: `gpus` must be at least 1, but got {gpus}.'
             
-        if logpath is None:
-            logpath = os.path.join(self.logdir, f'{self._id_give}.log')
-        
-        task = Task(self._id_give, pwd, cmds, priority, logpath, task_callback)
-        self._id_give += 1
-        self.add_task(task)
+        with self.lock:
+            if logpath is None:
+                logpath = os.path.join(self.logdir, f'{self._id_give}.log')
+            
+            task = self._new_task(self._id_give, pwd, cmds, priority, logpath, gpu_mem, cpu_mem, gpus)
+            self.estimate_memory(task)
+            self._id_give += 1
+            self.add_task(task)
         
         result = f'add task(id:{task.id}) to queue(len: {len(self.queue)})'
-        logging.info(f'add task(id:{task.id}): {pwd}$ {cmds})')
+        emit('add', f'add task(id:{task.id}): {pwd}$ {cmds})', id=task.id, pwd=pwd, cmds=cmds, 
+             priority=priority, gpus=gpus)
     
         err, result_ = self.scheduling.callback_add_process(self)
+        self.notify_scheduling()
+        
+        return err, '\n'.join([result, result_])
+    
+    @staticmethod
+    def _parse_batch_line(pwd, line, priority):
+        """
+        parse one line of `add-batch`, return 
+        (pwd, cmds, priority, logpath, gpu_mem, cpu_mem, gpus).
+        
+        """
+        if not line.startswith('{'):
+            return pwd, shlex.split(line), priority, None, None, None, 1
+        
+        item = json.loads(line)
+        cmds = item['cmds'] if 'cmds' in item else shlex.split(item['cmd'])
+        if not isinstance(cmds, list) or not cmds:
+            raise ValueError('`cmds` must be a non-empty list.')
+        cwd = os.path.join(pwd, item['cwd']) if 'cwd' in item else pwd
+        gpus = int(item.get('gpus', 1))
+        if gpus < 1:
+            raise ValueError(f'`gpus` must be at least 1, but got {gpus}.')
+        return (cwd, [str(cmd) for cmd in cmds], int(item.get('priority', priority)), item.get('logpath'),
+                memory_size(item.get('gpu_mem')), memory_size(item.get('cpu_mem')), gpus)
+    
+    def add_batch(self, pwd, *, lines, priority:int=5):
+        '''
+        add-batch [file]              add tasks in [file] (or stdin), one task per line.
+        
+        Options:
+            
+            --priority [priority]     set default task priority.
+            
+        Lines:
+            
+            python3 main.py --lr=0.1                  a command line
+            {"cmd": "python3 main.py", "priority": 1} json, keys: `cmd` or 
+                                                      `cmds`(list), `priority`,
+                                                      `logpath`, `cwd`, 
+                                                      `gpu_mem`, `cpu_mem`,
+                                                      `gpus`
+            
+            empty lines and lines start with `#` are skipped.
+        '''
+        priority = int(priority)
+        
+        items = []
+        err_msg = ''
+        for i, line in enumerate(lines.splitlines()):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                items.append(self._parse_batch_line(pwd, line, priority))
+            except Exception as e:
+                err_msg += f'[error]: line {i + 1}: {e}\n'
+        if err_msg:
+            return 1, err_msg + '[error]: no task added.'
+        if not items:
+            return 1, '[error]: no task in input.'
+        
+        with self.lock:
+            tasks = []
+            for task_pwd, cmds, task_priority, logpath, gpu_mem, cpu_mem, gpus in items:
+                if logpath is None:
+                    logpath = os.path.join(self.logdir, f'{self._id_give}.log')
+                tasks.append(self._new_task(self._id_give, task_pwd, cmds, task_priority, 
+                                            logpath, gpu_mem, cpu_mem, gpus))
+                self._id_give += 1
+            for task in tasks:
+                self.estimate_memory(task)
+                self.add_task(task)
+                
+        result = f'add {len(tasks)} tasks(id:{tasks[0].id}-{tasks[-1].id}) to queue(len: {len(self.queue)})'
+        emit('add', f'add {len(tasks)} tasks(id:{tasks[0].id}-{tasks[-1].id}): {pwd}', 
+             id=tasks[0].id, last_id=tasks[-1].id, count=len(tasks), pwd=pwd)
+        
+        err, result_ = self.scheduling.callback_add_process(self)
+        self.notify_scheduling()
         
         return err, '\n'.join([result, result_])
     
@@ -200,26 +769,40 @@ task_manage = TaskManage(BaseScheduling())
 
 
 @task_manage.client('ls')
-def ls(*, all=False):
+def ls(*, all=False, rows=False):
     '''
         ls                            ls GPU task queue status
         
         Options:
             
-            --all                     default ls only show <80 commands, 
-                                      use `all` to show all commands. 
+            --all                     default ls only show <80 commands and
+                                      live tasks, use `all` to show all 
+                                      commands and finished (archived) tasks. 
+            --rows                    return rows as structured data instead
+                                      of a rendered table.
             --sort                    show by different sort type. 
                                       can use: ['id', 'priority', 'show', 'run']
     '''
     
-    (all,), err_msg = check_input(((all, bool), ))
+    (all, rows), err_msg = check_input(((all, bool), (rows, bool)))
     if err_msg: return 1, err_msg
     tasks = task_manage.tasks
+    archived_tasks = task_manage.archived_tasks if all else []
+    
+    if rows:
+        columns = ['id', 'num', 'status', 'gpu', 'run_times', 'priority', 'pwd', 'cmds']
+        data = [[task.id, None, str(task.status), task.gpu, task.run_times, 
+                 task.priority, task.pwd, task.cmds] for task in archived_tasks]
+        data += [[task.id, i, str(task.status), task.gpu, task.run_times, 
+                  task.priority, task.pwd, task.cmds] for i, task in enumerate(tasks)]
+        return 0, '', {'columns': columns, 'rows': data}
     
     table = pt.PrettyTable(['[ID]', 'num', 'status', 'run_times', 'pwd', 'cmds'])
     table.border = False
+    for task in archived_tasks:
+        table.add_row([task.id, '-', str(task.status), task.run_times, task.pwd+'#', " ".join(task.cmds)])
     for i, task in enumerate(tasks):
-        status = str(task.status) + f'(GPU:{task.gpu})' if task.gpu is not None else str(task.status)
+        status = str(task.status) + f'(GPU:{Task._change_gpu_id(task.gpu)})' if task.gpu is not None else str(task.status)
         if not all:
             table.add_row([task.id, i, status, task.run_times, task.pwd+'#', " ".join(task.cmds)[:80]])
         else:
@@ -249,10 +832,21 @@ def show(id):
     table.add_row(['task id:', task.id])
     table.add_row(['task pid:', task.pid])
     table.add_row(['priority:', task.priority])
-    table.add_row(['use gpu:', task.gpu])
+    # `-`: no reservation, the task is placed by `SAFETY_KEEP_*` params
+    reserve = lambda mem: '-' if mem is None else f'{mem}G'
+    table.add_row(['reserve memory:', f'GPU: {reserve(task.gpu_mem)}, CPU: {reserve(task.cpu_mem)}' + 
+                                      (' (estimated)' if task.mem_estimated else '')])
+    table.add_row(['gpus:', task.gpu_num])
+    table.add_row(['use gpu:', None if task.gpu is None else Task._change_gpu_id(task.gpu)])
+    if task.pid is not None:
+        gpu_used = task_manage.tasks_gpu_memory().get(task.id, {})
+        table.add_row(['gpu memory:', ', '.join([f'GPU{i}: %.2fG' % gpu_used[i] for i in sorted(gpu_used)]) 
+                                      or '0.00G'])
+    if task.peak_gpu_mem is not None:
+        table.add_row(['peak memory:', 'GPU: %.2fG, CPU: %.2fG' % (task.peak_gpu_mem, task.peak_cpu_mem or 0)])
     table.add_row(['run times:', task.run_times])
     table.add_row(['status:', task.status])
-    table.add_row(['out file:', task.out_path])
+    table.add_row(['out file:', task.log_path])
     table.add_row(['pwd:', task.pwd])
     table.add_row(['cmds:', " ".join(task.cmds)])
     return 0, str(table)
@@ -262,13 +856,21 @@ def show(id):
 def rm(id):
     '''
         rm [id]                       remove task [id] from manage, if task is running, kill it.
+        
+        Example:
+            
+            gpulimit rm 1             remove task 1
+            gpulimit rm 3-40          remove task 3 to 40
+            gpulimit rm 1,5,9         remove task 1, 5 and 9
     '''
-    (id,), err_msg = check_input(((id, int),))
+    id_ranges, err_msg = check_ids(id)
     if err_msg:
         return 1, err_msg
     
-    if task_manage.rm_task(id):
-        return 0, f'[info]: del task {id}'
+    with task_manage.lock:
+        tasks = task_manage.rm_tasks([task.id for task in task_manage.get_tasks(id_ranges)])
+    if tasks:
+        return 0, f'[info]: del task {", ".join([str(task.id) for task in tasks])}'
     else:
         return 1, f'[error]: can not found {id} in task queue.'
 
@@ -288,13 +890,10 @@ def clean(*args):
     else:
         rm_types = [Status(i) for i in args]
         
-    rm_tasks = []
-    for task in task_manage.tasks:
-        if task.status in rm_types:
-            rm_tasks.append(task)
-            
-    for task in rm_tasks:
-        task_manage.rm_task(task.id)
+    with task_manage.lock:
+        rm_tasks = [task.id for task in task_manage.tasks + task_manage.archived_tasks
+                    if task.status in rm_types]
+        rm_tasks = task_manage.rm_tasks(rm_tasks)
         
     table = pt.PrettyTable(['id', 'status', 'run_times', 'pwd', 'cmds'])
     table.border = False
@@ -309,16 +908,30 @@ def clean(*args):
 def kill(id):
     '''
         kill [id]                     kill task [id]
+        
+        Example:
+            
+            gpulimit kill 1           kill task 1
+            gpulimit kill 3-40        kill task 3 to 40
+            gpulimit kill 1,5,9       kill task 1, 5 and 9
+            gpulimit kill all         kill all running and paused tasks
     '''
     
-    (id,), err_msg = check_input(((id, int),))
-    if err_msg:
-        return 1, err_msg
-    
-    task = task_manage.get_task(id)
-    if task is None:
-        return 1, f'[error]: can not found id {id} in task queue.'
-    return task.kill()
+    with task_manage.lock:
+        if id == 'all':
+            tasks = [task for task in task_manage.tasks if task.status in ALIVE_STATUS]
+            if not tasks:
+                return 0, '[info]: no running task.'
+        else:
+            id_ranges, err_msg = check_ids(id)
+            if err_msg:
+                return 1, err_msg
+            tasks = task_manage.get_tasks(id_ranges)
+            if not tasks:
+                return 1, f'[error]: can not found id {id} in task queue.'
+        
+        results = [task.kill() for task in tasks]
+    return max([err for err, _ in results]), '\n'.join([msg for _, msg in results])
     
 
 @task_manage.client('mv') 
@@ -373,6 +986,38 @@ def set_property(name=None, value=None):
     return result
     
 
+@task_manage.client('policy')
+def policy(name=None):
+    '''
+        policy [name]                 change the scheduling policy to [name]. 
+                                      If no input, show all policies.
+        
+        Information:
+            
+            Tasks in queue are kept, running tasks are not stopped. Params
+            of the new policy which the old policy also has keep their 
+            values (see `gpulimit set`).
+    '''
+    current = policy_name(task_manage.scheduling)
+    if name is None:
+        table = pt.PrettyTable(['', 'policy', 'description'])
+        table.border = False
+        table.align = 'l'
+        for key, cls in policies().items():
+            doc = (cls.__doc__ or '').strip().split('\n')[0]
+            table.add_row(['*' if key == current else '', key, doc])
+        return 0, str(table)
+    
+    if name == current:
+        return 0, f'[info]: policy is `{name}` already.'
+    scheduling = get_policy(name)
+    if scheduling is None:
+        return 1, f'[error]: policy `{name}` not found, use one of {list(policies())}.'
+    task_manage.set_scheduling(scheduling)
+    logging.info(f'[policy]: change policy from `{current}` to `{name}`.')
+    return 0, f'[info]: change policy from `{current}` to `{name}`.'
+
+
 @task_manage.client('start') 
 def start(id=None):
     '''
@@ -389,31 +1034,133 @@ def start(id=None):
     (id, ), err_msg = check_input(((id, int),), )
     if err_msg:
         return 1, err_msg
+    if task_manage.get_task(id) is None:
+        return 1, f'[error]: can not found task[{id}]'
+    task_manage.restore_task(id) # killed task is in archive
     return task_manage.scheduling.user_start_scheduling(task_manage, id)
 
 
 @task_manage.client('log')          
-def get_output_filename(id):
+def get_output_filename(id, *, tail=None, follow=False, attempt=None):
     '''
         log [id]                      show [id] output.
         
+        Options:
+            
+            --attempt=[N]             output of the N-th run, default the
+                                      last run. 
+            --tail=[N]                send the last N lines of output 
+                                      through the socket.
+            --follow                  send new output until the task ends
+                                      (`log main --follow` until ctrl-c).
+        
         Example:
             
             gpulimit log 1            show task(id=1) output.
             gpulimit log main         show manage background log info.
+            gpulimit log 1 --tail=100 --follow
+                                      show the last 100 lines of task 1 and
+                                      follow its output.
     '''
     
-    if id=='main':
-        return 0, task_manage.log_file
+    if id == 'main':
+        path, done = task_manage.log_file, None
+    else:
+        (id, ), err_msg = check_input(((id, int),), )
+        if err_msg:
+            return 1, err_msg
+        task = task_manage.get_task(id)
+        if task is None:
+            return 1, f'[error]: can not found task[{id}], please check task id.'
+        if task.out_path is None:
+            return 1, f'[error]: output of task[{id}] is not saved.'
+        (attempt, ), err_msg = check_input(((max(task.run_times, 1) if attempt is None else attempt, int),))
+        if err_msg:
+            return 1, err_msg
+        path = os.path.abspath(attempt_path(task.out_path, attempt))
+        # the run finished and all output is written
+        done = lambda: task.run_times > attempt or (task.status not in ALIVE_STATUS and 
+                task.status != STATUS_WAITING and task.gpu is None and task.output_closed)
+    if tail is None and not follow:
+        return 0, path
     
-    (id, ), err_msg = check_input(((id, int),), )
+    # like `tail -f`, follow starts from the last 10 lines
+    (tail, ), err_msg = check_input(((10 if tail is None else tail, int),), )
+    if err_msg:
+        return 1, err_msg
+    try:
+        offset = tail_offset(path, tail)
+    except FileNotFoundError: # task not started yet
+        offset = 0
+    return 0, '', LogStream(path, offset, bool(follow), done)
+
+
+@task_manage.client('events')
+def events(*, type=None, id=None, since=None, limit=50, rows=False):
+    '''
+        events                        show task events (add, start, finish, oom, ...).
+        
+        Options:
+            
+            --type=[types]            only show events of types, e.g. 
+                                      `start,finish`, can use: 
+                                      add, start, finish, oom, kill, error, 
+                                      attach, pause, resume
+            --id=[ids]                only show events of tasks, e.g. `3`,
+                                      `3-40`, `1,5,9`
+            --since=[span]            only show events in the last span, 
+                                      e.g. `30s`, `10m`, `2h`, `1d`
+            --limit=[N]               show the last N events, default 50,
+                                      0 shows all
+            --rows                    return events as structured data 
+                                      instead of a rendered table.
+        
+        Example:
+            
+            gpulimit events --type=oom --since=1d
+    '''
+    (limit, since, rows), err_msg = check_input(((limit, int), (since, time_span), (rows, bool)))
     if err_msg:
         return 1, err_msg
+    types = None
+    if type is not None:
+        types = str(type).split(',')
+        unknown = [event for event in types if event not in EVENT_TYPES]
+        if unknown:
+            return 1, f'[error]: unknown event type {", ".join(unknown)}, can use: {", ".join(EVENT_TYPES)}.'
+    id_ranges = None
+    if id is not None:
+        id_ranges, err_msg = check_ids(id)
+        if err_msg:
+            return 1, err_msg
     
-    task = task_manage.get_task(id)
-    if task is None:
-        return 1, 'Error'
-    return 0, os.path.abspath(task.out_path)
+    results = event_log.query(types, id_ranges, None if since is None else time.time() - since, limit)
+    if rows:
+        return 0, '', {'events': results}
+    
+    table = pt.PrettyTable(['time', 'event', 'id', 'gpu', 'info'])
+    table.border = False
+    table.align = 'l'
+    for event in results:
+        info = ', '.join([f'{k}={v}' for k, v in event.items() 
+                          if k not in ('time', 'event', 'id', 'gpu', 'msg', 'pwd', 'cmds') and v is not None])
+        table.add_row([time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time'])), 
+                       event['event'], event.get('id'), 
+                       Task._change_gpu_id(event.get('gpu')) or '-', info])
+    return 0, str(table)
+
+
+@task_manage.client('metrics')
+def metrics():
+    '''
+        metrics                       show scheduler metrics in OpenMetrics text format.
+        
+        Information:
+            
+            The same text is served at `http://[host]:[port]/metrics` if
+            `gpulimit_server --metrics-port=[port]` is set, for Prometheus.
+    '''
+    return 0, registry.render()
 
 
 @task_manage.client('status')   
@@ -430,19 +1177,21 @@ def status():
     
     task_nums = [0] * len(gpus)
     for task in task_manage.tasks:
-        if task.gpu is not None:
-            task_nums[int(task.gpu)] += 1
+        for gpu_id in task.gpu or []:
+            task_nums[gpu_id] += 1
     
     result = ''
     table = pt.PrettyTable(['CPU utilization', 'memory total', 'memory free', 'memory used'])
     table.border = False
-    table.add_row(['None', memory.total, memory.free, memory.used])
+    table.add_row([System.cpu_mean(), memory.total, memory.free, memory.used])
     result += str(table)
     result += '\n\n'
-    table = pt.PrettyTable(['GPU[ID]', 'memory total', 'memory free', 'memory used', 'utilization', 'running tasks num'])
+    table = pt.PrettyTable(['GPU[ID]', 'memory total', 'memory free', 'memory used', 'utilization', 
+                            'memory utilization', 'running tasks num'])
     table.border = False
     for info, use_num in zip(gpus, task_nums):
-        table.add_row([info.id, info.total, info.free, info.used, 'None', use_num])
+        table.add_row([info.id, info.total, info.free, info.used, info.utilization, 
+                       info.memory_utilization, use_num])
     result += str(table)
     
     return 0, result
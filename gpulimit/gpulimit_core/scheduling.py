@@ -1,8 +1,9 @@
 import abc
+import types
 import logging
 
 from .system_info import System
-from .tasks import Status, STATUS_WAITING, STATUS_RUNTIME_ERROR
+from .tasks import Task
 
 
 class Scheduling(metaclass=abc.ABCMeta):
@@ -27,12 +28,25 @@ class Scheduling(metaclass=abc.ABCMeta):
     
     
 class BaseScheduling(Scheduling):
+    """
+    Priority and queue order, with best fit packing.
+    
+    Tasks are taken by priority, then listing order, the tasks in a window
+    are packed best fit decreasing, see `_timer_call_batch`.
+    """
     def __init__(self):
         self.param = {
             'MAX_ERR_TIMES': 1,
             'MAX_RUNNING_TASKS': -1,
             'SAFETY_KEEP_MEMORY': 0.2,
             'SAFETY_KEEP_GPU_MEMORY': 0.6,
+            'BATCH_DISPATCH': 1,
+            'TASK_GPU_MEMORY': 0,
+            'TASK_MEMORY': 0,
+            'MAX_GPU_UTILIZATION': 0.9,
+            'UTILIZATION_WINDOW': 10,
+            'PACKING_WINDOW': 16,
+            'START_SETTLE_TIME': 30,
         }
         
     @staticmethod
@@ -49,42 +63,313 @@ class BaseScheduling(Scheduling):
         return 0, ''
     
     def timer_call(self, task_manage):
-        gpu_id = System.best_select_gpu_id()
-        gpu = System.gpu(gpu_id)
+        if self.param['BATCH_DISPATCH']:
+            return self._timer_call_batch(task_manage)
+        return self._timer_call_single(task_manage)
+    
+    def gpu_busy(self, gpu_id):
+        """
+        GPU is busy if its mean utilization in `UTILIZATION_WINDOW` seconds
+        is bigger than `MAX_GPU_UTILIZATION`, don't start new tasks on it 
+        even if its memory is free.
+        """
+        utilization = System.gpu_utilization(gpu_id, self.param['UTILIZATION_WINDOW'])
+        return utilization is not None and utilization > self.param['MAX_GPU_UTILIZATION']
+    
+    def settling_gpu_ids(self, tasks):
+        """
+        GPUs where a task without memory reservation (see `gpu_reserve`) was
+        started in the last `START_SETTLE_TIME` seconds. Its memory may not
+        be allocated yet, the GPU is not free until it settles.
+        """
+        settle_time = System.time() - self.param['START_SETTLE_TIME']
+        return set([gpu_id for task in tasks if task.gpu is not None and self.gpu_reserve(task) <= 0
+                    and task.start_time is not None and task.start_time > settle_time
+                    for gpu_id in task.gpu])
+    
+    def _timer_call_single(self, task_manage):
+        settling = self.settling_gpu_ids(task_manage.tasks)
+        gpus = [gpu for gpu in System.gpus() if not self.gpu_busy(gpu.id) and gpu.id not in settling]
+        if not gpus:
+            return False
+        gpus = sorted(gpus, key=lambda gpu: -gpu.free)
         memory = System.memory()
         # print('timer_call: ', end='')
-        if gpu.free < self.param['SAFETY_KEEP_GPU_MEMORY'] * gpu.total:
-            # print('gpu.free return')
-            return False
-        
         if memory.free < self.param['SAFETY_KEEP_MEMORY'] * memory.total:
             # print('memory.free return')
             return False
         
-        tasks = task_manage.tasks
+        running_nums = self.running_nums(task_manage.tasks, len(System.gpus()))
 
-        if 0 < self.param['MAX_RUNNING_TASKS'] <= sum([task.gpu==gpu_id for task in tasks]):
-            return False
-
-        tasks = self.sort_for_timer_call(tasks)
-        
-        for task in tasks:
+        with task_manage.lock:
+            task = task_manage.queue.pop_runnable()
+            if task is None:
+                return False
+            # queue is ordered by run_times, the rest ran too many times too
             if task.run_times >= self.param['MAX_ERR_TIMES']:
-                continue
+                task_manage.queue.update(task)
+                return False
+            
+            # the `gpu_num` GPUs with the most free memory
+            gpus = gpus[:task.gpu_num]
+            if len(gpus) < task.gpu_num or any(
+                    gpu.free < self.param['SAFETY_KEEP_GPU_MEMORY'] * gpu.total or 
+                    0 < self.param['MAX_RUNNING_TASKS'] <= running_nums[gpu.id] for gpu in gpus):
+                # print('gpu.free return')
+                task_manage.queue.update(task)
+                return False
             
-            if task.status in [STATUS_WAITING, STATUS_RUNTIME_ERROR]:
-                task.start(gpu_id)
-                logging.info(f'start task {task.id} in GPU({gpu_id}).')
-                return True
+            gpu_ids = [gpu.id for gpu in gpus]
+            code, msg = task.start(gpu_ids)
+            task_manage.queue.update(task)
+            if code != 0:
+                return False
+            logging.info(f'start task {task.id} in GPU({Task._change_gpu_id(gpu_ids)}).')
+            return True
+    
+    @staticmethod
+    def running_nums(tasks, gpu_nums):
+        """
+        number of running tasks on each GPU.
+        """
+        running_nums = [0] * gpu_nums
+        for task in tasks:
+            for gpu_id in task.gpu or []:
+                running_nums[gpu_id] += 1
+        return running_nums
+    
+    def gpu_reserve(self, task):
+        return self.param['TASK_GPU_MEMORY'] if task.gpu_mem is None else task.gpu_mem
+    
+    def cpu_reserve(self, task):
+        return self.param['TASK_MEMORY'] if task.cpu_mem is None else task.cpu_mem
+    
+    def free_memory(self, task_manage, gpus, memory):
+        """
+        free GPU / host memory (GB) minus the memory reserved by running 
+        tasks but not allocated yet (e.g. tasks just started), return 
+        (list of GPU free memory, host free memory).
+        
+        GPUs still settling (see `settling_gpu_ids`) have no free memory.
+        
+        Memory of a task is found by its process tree, if NVML reports PIDs
+        of another namespace (e.g. in a container), memory of hidden 
+        processes (see `hidden_gpu_memory`) is taken as allocated by the 
+        tasks on that GPU, so it is not counted twice. If hidden processes 
+        belong to others (e.g. other containers), the memory reserved but
+        not allocated is underestimated by their memory.
+        """
+        gpu_free = [gpu.free for gpu in gpus]
+        memory_free = memory.free
+        
+        running = [task for task in task_manage.tasks if task.gpu is not None]
+        for gpu_id in self.settling_gpu_ids(running):
+            gpu_free[gpu_id] = 0
+        if any(self.gpu_reserve(task) > 0 for task in running):
+            gpu_used = task_manage.tasks_gpu_memory()
+            hidden = task_manage.hidden_gpu_memory()
+            pending = [0] * len(gpus)
+            for task in running:
+                used = gpu_used.get(task.id, {})
+                for gpu_id in task.gpu:
+                    pending[gpu_id] += max(0, self.gpu_reserve(task) - used.get(gpu_id, 0))
+            for gpu_id, memory in enumerate(pending):
+                gpu_free[gpu_id] -= max(0, memory - hidden.get(gpu_id, 0))
+        if any(self.cpu_reserve(task) > 0 for task in running):
+            memory_used = task_manage.tasks_memory()
+            for task in running:
+                memory_free -= max(0, self.cpu_reserve(task) - memory_used.get(task.id, 0))
+        return gpu_free, memory_free
+    
+    def place(self, task, gpus, gpu_free, gpu_ids, topology=None):
+        """
+        select `task.gpu_num` GPUs in `gpu_ids` for task, return a list of 
+        GPU ids, or None if it does not fit.
+        
+        Tasks with `gpu_mem` use best fit: the GPUs with the least free memory
+        left after placing. Tasks without `gpu_mem` need 
+        `SAFETY_KEEP_GPU_MEMORY * total` free and use the GPUs with the most 
+        free memory.
+        
+        For multi-GPU tasks, if `topology` (see `System.gpu_topology`) is 
+        given, the set with the smallest max distance between its GPUs is 
+        preferred (e.g. GPUs under the same PCIe switch). NVLink is not 
+        detected, GPUs linked by NVLink only count as close if they are 
+        also close in the PCIe tree.
+        """
+        if task.gpu_mem is None:
+            gpu_ids = [i for i in gpu_ids 
+                       if gpu_free[i] >= self.param['SAFETY_KEEP_GPU_MEMORY'] * gpus[i].total]
+            fit = lambda i: -gpu_free[i]
+        else:
+            gpu_ids = [i for i in gpu_ids if gpu_free[i] >= task.gpu_mem]
+            fit = lambda i: gpu_free[i] - task.gpu_mem
+        if len(gpu_ids) < task.gpu_num:
+            return None
+        
+        gpu_ids = sorted(gpu_ids, key=fit)
+        if task.gpu_num == 1 or topology is None:
+            return gpu_ids[:task.gpu_num]
+        
+        # greedy: from each seed GPU, add the nearest GPUs (best fit first)
+        best, best_key = None, None
+        for seed in gpu_ids:
+            selected = [seed]
+            others = [i for i in gpu_ids if i != seed]
+            while len(selected) < task.gpu_num:
+                i = min(others, key=lambda i: max(topology[i][j] for j in selected))
+                others.remove(i)
+                selected.append(i)
+            key = (max(topology[i][j] for i in selected for j in selected), 
+                   sum(fit(i) for i in selected))
+            if best_key is None or key < best_key:
+                best, best_key = sorted(selected), key
+        return best
+    
+    def reserve(self, task, gpu_free, gpu_ids, running_nums):
+        """
+        select `task.gpu_num` GPUs in `gpu_ids` to reserve for a blocked 
+        multi-GPU task: the GPUs with fewest running tasks, then most free 
+        memory, which are likely to be free first.
+        """
+        gpu_ids = sorted(gpu_ids, key=lambda i: (running_nums[i], -gpu_free[i], i))
+        return gpu_ids[:task.gpu_num]
+    
+    def dispatch_state(self, task_manage):
+        """
+        GPUs and memory free for the tasks started in one pass, updated by 
+        `try_start`.
+        
+        Memory reserved by running tasks is subtracted from the free memory,
+        because their allocations are not visible yet (see `free_memory`).
+        """
+        gpus = System.gpus()
+        memory = System.memory()
+        gpu_free, memory_free = self.free_memory(task_manage, gpus, memory)
+        return types.SimpleNamespace(
+                gpus=gpus, memory=memory, gpu_free=gpu_free, memory_free=memory_free, 
+                busy_gpu_ids=[gpu.id for gpu in gpus if self.gpu_busy(gpu.id)],
+                running_nums=self.running_nums(task_manage.tasks, len(gpus)),
+                topology=System.gpu_topology() if len(gpus) > 2 else None)
     
-        return False
+    def can_start(self, task, state):
+        """
+        task has enough GPUs and host memory in `state`, and the processes of
+        its last run exited (a killed task keeps `gpu` until then).
+        """
+        if task.gpu_num > len(state.gpus) or task.gpu is not None:
+            return False
+        return state.memory_free - self.cpu_reserve(task) >= \
+               self.param['SAFETY_KEEP_MEMORY'] * state.memory.total
+    
+    def try_start(self, task, state, excluded_gpu_ids=()):
+        """
+        start task if it fits on the GPUs not in `excluded_gpu_ids` (see 
+        `place`), and subtract its reservation from `state`. return the GPU
+        ids, or None if it does not fit or can not be started (e.g. it was
+        started by `start [id]` meanwhile).
+        
+        The reservation is `gpu_mem` / `cpu_mem` of the task, or 
+        `TASK_GPU_MEMORY` / `TASK_MEMORY` (GB), if both are unknown (0), the
+        task takes all free memory of its GPUs (one task per GPU per pass).
+        """
+        gpu_ids = [gpu.id for gpu in state.gpus if gpu.id not in state.busy_gpu_ids
+                   and gpu.id not in excluded_gpu_ids
+                   and not 0 < self.param['MAX_RUNNING_TASKS'] <= state.running_nums[gpu.id]]
+        selected = self.place(task, state.gpus, state.gpu_free, gpu_ids, state.topology)
+        if selected is None:
+            return None
+        
+        code, msg = task.start(selected)
+        if code != 0:
+            return None
+        logging.info(f'start task {task.id} in GPU({Task._change_gpu_id(selected)}).')
+        for gpu_id in selected:
+            state.running_nums[gpu_id] += 1
+            if self.gpu_reserve(task) > 0:
+                state.gpu_free[gpu_id] -= self.gpu_reserve(task)
+            else:
+                state.gpu_free[gpu_id] = 0
+        state.memory_free -= self.cpu_reserve(task)
+        return selected
+    
+    def _timer_call_batch(self, task_manage):
+        """
+        start as many waiting tasks as fit in one pass.
+        
+        The next `PACKING_WINDOW` runnable tasks are placed best fit 
+        decreasing: multi-GPU tasks first (all GPUs at once), then tasks 
+        with `gpu_mem` biggest first, then tasks without it in queue order. 
+        
+        The first multi-GPU task which does not fit reserves GPUs: smaller
+        tasks are only started on the other GPUs (backfill), so the wide 
+        task is started as soon as its reserved GPUs are free instead of 
+        starving behind a stream of small tasks.
+        
+        Memory reserved by running tasks and by tasks started in this pass 
+        is subtracted from the free memory (see `dispatch_state` and 
+        `try_start`), if the reservation of a task is unknown, host memory 
+        is only checked against `SAFETY_KEEP_MEMORY`.
+        
+        Tasks are started (`Popen`) under `task_manage.lock`: `rm` and 
+        `kill` hold the lock too, and see a task either waiting or with its 
+        process, a task removed while its process is being started would 
+        keep running untracked. A start takes about 1ms, so a full window
+        holds the lock for tens of milliseconds at most.
+        """
+        state = self.dispatch_state(task_manage)
+        reserved_gpu_ids = []
+                
+        started = 0
+        with task_manage.lock:
+            while True:
+                window = []
+                while len(window) < self.param['PACKING_WINDOW']:
+                    task = task_manage.queue.pop_runnable()
+                    if task is None:
+                        break
+                    # queue is ordered by run_times, the rest ran too many times too
+                    if task.run_times >= self.param['MAX_ERR_TIMES']:
+                        task_manage.queue.update(task)
+                        break
+                    window.append(task)
+                    
+                started_window = 0
+                wide = [task for task in window if task.gpu_num > 1]
+                sized = sorted([task for task in window if task.gpu_num == 1 and task.gpu_mem is not None], 
+                               key=lambda task: -task.gpu_mem)
+                unsized = [task for task in window if task.gpu_num == 1 and task.gpu_mem is None]
+                for task in wide + sized + unsized:
+                    if not self.can_start(task, state):
+                        continue
+                    if self.try_start(task, state, reserved_gpu_ids) is None:
+                        if task.gpu_num > 1 and not reserved_gpu_ids:
+                            reserved_gpu_ids = self.reserve(
+                                    task, state.gpu_free, [gpu.id for gpu in state.gpus], state.running_nums)
+                            logging.info(f'reserve GPU({Task._change_gpu_id(reserved_gpu_ids)}) '
+                                         f'for task {task.id}.')
+                        continue
+                    started_window += 1
+                    
+                for task in window:
+                    task_manage.queue.update(task)
+                    
+                started += started_window
+                if started_window == 0 or len(window) < self.param['PACKING_WINDOW']:
+                    break
+            
+        return started > 0
     
     def user_start_scheduling(self, task_manage, task_id=None):
         if task_id is None:
             return self.callback_add_process(task_manage)
         
         task = task_manage.get_task(task_id)
-        gpu_id = System.best_select_gpu_id()
+        if task is None:
+            return 1, f'[error]: can not found task[{task_id}]'
+        gpu_ids = System.best_select_gpu_ids(task.gpu_num)
+        if len(gpu_ids) < task.gpu_num:
+            return 1, f'[error]: task {task.id} needs {task.gpu_num} GPUs, but only {len(gpu_ids)} GPUs.'
         
-        logging.info(f'start task {task.id} in GPU({gpu_id}).')
-        return task.start(gpu_id)
\ No newline at end of file
+        logging.info(f'start task {task.id} in GPU({Task._change_gpu_id(gpu_ids)}).')
+        return task.start(gpu_ids)
\ No newline at end of file
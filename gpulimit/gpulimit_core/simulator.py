@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+"""
+Discrete event simulator of the scheduler.
+
+`Simulator` runs the real `TaskManage` and a `Scheduling` object against a
+virtual `System` (`SimBackend`) with a virtual clock: no process is started
+and no NVML is needed, a trace of days runs in seconds. It is used to
+compare scheduling policies and params offline, see `gpulimit-sim`.
+
+A trace is a list of `TraceTask`, e.g. from a json lines file:
+
+    {"submit": 0, "duration": 3600, "gpu_mem": [[0, 1], [60, 9.5]], "cpu_mem": 4}
+    {"submit": 30, "duration": 600, "gpu_mem": 5, "gpus": 2, "cmds": ["python", "b.py"]}
+
+memory is GB (per GPU), a memory curve is a list of (seconds since start,
+memory) steps.
+
+The scheduler runs as in the server: a pass (`timer_call`) after tasks are
+added or ended, and every `TIMER_POLLING_TIME` seconds while tasks wait.
+System info is sampled every `GPU_SAMPLE_INTERVAL` seconds (only when it
+changed, it is the same otherwise), so the scheduler sees memory as late
+as in the server.
+
+A task is out of memory (`oom`) if the memory of the tasks on one of its
+GPUs is more than the GPU memory when its memory grows, it fails as a
+`CUDA out of memory` error. If host memory is full, the task using most
+host memory is killed (the OOM killer).
+"""
+import json
+import math
+import heapq
+import random
+import bisect
+import time
+
+from collections import namedtuple
+
+from .system_info import System
+from .tasks import Task, ALIVE_STATUS, STATUS_KILLED, STATUS_COMPLETE, STATUS_RUNTIME_ERROR, \
+                   STATUS_CMD_ERROR
+from .run_task_core import TaskManage
+
+
+_TRACE_FIELDS = ('submit', 'duration', 'gpu_mem', 'cpu_mem', 'gpus', 'priority', 'utilization',
+                 'request_gpu_mem', 'request_cpu_mem', 'returncode', 'pwd', 'cmds')
+
+# `gpu_mem` / `cpu_mem`: GB or a memory curve, `utilization`: 0-1 of each
+# GPU, `request_*_mem`: `--gpu-mem` / `--cpu-mem` of `add` (None if not
+# given), `returncode`: exit code if the task is not out of memory
+TraceTask = namedtuple('TraceTask', _TRACE_FIELDS,
+                       defaults=(0, 0, 1, 5, 1.0, None, None, 0, '/sim', None))
+
+SimReport = namedtuple('SimReport', ('tasks', 'complete', 'failed', 'unfinished', 'oom',
+                                     'makespan', 'gpu_idle_hours', 'mean_wait', 'p95_wait',
+                                     'passes', 'pass_time'))
+
+_MemoryInfo = namedtuple('_MemoryInfo', ('total', 'free', 'used'))
+_HostMemory = namedtuple('_HostMemory', ('total', 'available', 'used'))
+_Utilization = namedtuple('_Utilization', ('gpu', 'memory'))
+_Process = namedtuple('_Process', ('pid', 'usedGpuMemory'))
+_SimProcess = namedtuple('_SimProcess', ('pid',))
+
+
+def curve(value):
+    """
+    memory curve of a trace value, a number is a constant curve.
+    """
+    if value is None:
+        return [(0, 0)]
+    if isinstance(value, (int, float)):
+        return [(0, value)]
+    return sorted((float(t), float(memory)) for t, memory in value)
+
+
+def curve_at(steps, elapsed):
+    i = bisect.bisect_right([t for t, _ in steps], elapsed) - 1
+    return steps[i][1] if i >= 0 else 0
+
+
+def load_trace(path):
+    """
+    read a trace from a json lines file of `TraceTask`, or from the events
+    file of a server (`[logdir]/state/events.jsonl`, see `trace_from_events`).
+    """
+    with open(path, encoding='utf8') as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    if items and 'event' in items[0]:
+        return trace_from_events(items)
+    return [TraceTask(**item) for item in items]
+
+
+def save_trace(trace, path):
+    with open(path, 'w', encoding='utf8') as f:
+        for trace_task in trace:
+            f.write(json.dumps(trace_task._asdict(), separators=(',', ':')) + '\n')
+
+
+def trace_from_events(events):
+    """
+    trace of the tasks finished in server events: submitted at `add`,
+    runtime, peak memory (a constant curve) and exit code of the last
+    `finish`, and memory reserved at the last `start`. Tasks added by
+    `add-batch` have no command, and use one GPU.
+    """
+    added, started, finished = {}, {}, {}
+    for event in events:
+        if event['event'] == 'add':
+            for id in range(event['id'], event.get('last_id', event['id']) + 1):
+                added[id] = event
+        elif event['event'] == 'start':
+            started[event['id']] = event
+        elif event['event'] == 'finish' and event.get('runtime') is not None:
+            finished[event['id']] = event
+    ids = sorted(id for id in finished if id in added)
+    if not ids:
+        return []
+    first = min(added[id]['time'] for id in ids)
+    trace = []
+    for id in ids:
+        add, start, finish = added[id], started.get(id, {}), finished[id]
+        trace.append(TraceTask(
+            submit=add['time'] - first, duration=finish['runtime'],
+            gpu_mem=finish.get('peak_gpu_mem') or 0, cpu_mem=finish.get('peak_cpu_mem') or 0,
+            gpus=add.get('gpus', 1), priority=add.get('priority', 5),
+            request_gpu_mem=start.get('gpu_mem'), request_cpu_mem=start.get('cpu_mem'),
+            returncode=0 if finish.get('status') == 'complete' else 1,
+            pwd=add.get('pwd', '/sim'), cmds=add.get('cmds') or ['task', str(id)]))
+    return trace
+
+
+def synthetic_trace(n=200, gpu_memory=24, seed=0, interval=600, commands=20, users=4):
+    """
+    `n` tasks submitted every `interval` seconds on average, runs of one of
+    `commands` commands have similar memory and duration. Memory grows to
+    its peak in the first minutes (loading data, first batches). Commands
+    belong to one of `users` users (`pwd` is `/home/user[i]`).
+    """
+    rng = random.Random(seed)
+    profiles = []
+    for i in range(commands):
+        profiles.append((rng.lognormvariate(math.log(1800), 1), # duration
+                         rng.uniform(0.1, 0.8) * gpu_memory, # peak GPU memory
+                         rng.uniform(2, 16), # host memory
+                         2 if rng.random() < 0.15 else 1, # GPUs
+                         rng.uniform(0.3, 1.0), # utilization
+                         rng.random() < 0.3, # memory given by `--gpu-mem`
+                         f'/home/user{rng.randrange(users)}'))
+    trace, submit = [], 0
+    for i in range(n):
+        submit += rng.expovariate(1 / interval)
+        command = rng.randrange(commands)
+        duration, peak, cpu_mem, gpus, utilization, request, pwd = profiles[command]
+        peak = min(gpu_memory, peak * rng.uniform(0.9, 1.1))
+        ramp = rng.uniform(10, 300)
+        trace.append(TraceTask(
+            submit=round(submit, 3), duration=round(duration * rng.uniform(0.8, 1.2), 3),
+            gpu_mem=[(0, round(peak * 0.1, 3)), (round(ramp / 2, 3), round(peak * 0.6, 3)),
+                     (round(ramp, 3), round(peak, 3))],
+            cpu_mem=round(cpu_mem, 3), gpus=gpus, priority=rng.choice((3, 5, 5, 5, 8)),
+            utilization=round(utilization, 3),
+            request_gpu_mem=round(peak * 1.1, 1) if request else None,
+            pwd=pwd, cmds=['python', f'train_{command}.py', '--seed', str(i)]))
+    return trace
+
+
+class SimBackend(object):
+    """
+    `System` backend of the simulated machine, memory and utilization are
+    the sum of the running tasks.
+    """
+    def __init__(self, simulator, gpus, gpu_memory, host_memory):
+        self.simulator = simulator
+        self.gpus = gpus
+        self.gpu_memory = gpu_memory
+        self.host_memory_size = host_memory
+
+    def gpu_nums(self):
+        return self.gpus
+
+    def memory_info(self, id):
+        used = self.simulator.gpu_used(id)
+        total = self.gpu_memory * 1024 ** 3
+        return _MemoryInfo(total, max(0, total - used * 1024 ** 3), min(total, used * 1024 ** 3))
+
+    def utilization(self, id):
+        return _Utilization(min(1, self.simulator.gpu_utilization(id)) * 100, 0)
+
+    def processes(self, id):
+        return [_Process(run.task.pid, run.gpu_mem() * 1024 ** 3)
+                for run in self.simulator.running.values() if id in run.gpu]
+
+    def host_memory(self):
+        total = self.host_memory_size * 1024 ** 3
+        used = min(total, self.simulator.host_used() * 1024 ** 3)
+        return _HostMemory(total, total - used, used)
+
+    def cpu_utilization(self):
+        return 0
+
+    def topology(self):
+        return None
+
+
+class SimTask(Task):
+    """
+    A task run by `Simulator` instead of a process.
+    """
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super().__init__(*args, **kwargs)
+
+    def clock(self):
+        return self.simulator.now
+
+    def _run_task(self, GPU_id):
+        self.simulator.on_start(self)
+        if self.start_callback is not None:
+            self.start_callback()
+
+    def _oom_reason(self, returncode):
+        return self.simulator.oom_reasons.pop(self.id, None)
+
+    def kill(self):
+        if self.process is not None and self.transition(ALIVE_STATUS, STATUS_KILLED):
+            self.simulator.on_kill(self)
+            return 0, f'[info]: kill task {self.id} succeed.'
+        return 1, f'[warning]: can not kill task {self.id} which have status `{self.status}`'
+
+
+class SimTaskManage(TaskManage):
+    """
+    `TaskManage` of simulated tasks, nothing is written to disk (no
+    journal, log or stats file).
+    """
+    def __init__(self, scheduling, simulator):
+        super().__init__(scheduling)
+        self.simulator = simulator
+        self.logdir = ''
+
+    def task_class(self, *args):
+        return SimTask(self.simulator, *args)
+
+    def tasks_memory(self):
+        return dict((run.task.id, run.cpu_mem()) for run in self.simulator.running.values())
+
+
+class _Run(object):
+    """
+    a run of a task.
+    """
+    def __init__(self, task, trace_task, start):
+        self.task = task
+        self.trace_task = trace_task
+        self.start = start
+        self.gpu = list(task.gpu)
+        self.gpu_curve = curve(trace_task.gpu_mem)
+        self.cpu_curve = curve(trace_task.cpu_mem)
+
+    def gpu_mem(self):
+        return curve_at(self.gpu_curve, self.task.simulator.now - self.start)
+
+    def cpu_mem(self):
+        return curve_at(self.cpu_curve, self.task.simulator.now - self.start)
+
+
+class Simulator(object):
+    """
+    Property:
+
+        now                      float: virtual time (seconds since the trace start)
+        task_manage              SimTaskManage
+        running                  dict of task id -> run of running tasks
+
+    Functions:
+
+        run(trace, max_time=None)    run the trace until all tasks ended (or
+                                     can not be started), return `SimReport`
+
+    A simulator runs one trace, `System` is restored after `run`.
+
+    """
+    def __init__(self, scheduling, gpus=4, gpu_memory=24, host_memory=256, params=None):
+        self.scheduling = scheduling
+        self.gpus = gpus
+        self.gpu_memory = gpu_memory
+        self.host_memory = host_memory
+        self.params = params or {}
+
+        self.now = 0.0
+        self.task_manage = None
+        self.running = {}
+        self.oom_reasons = {} # task id -> oom reason of the run ending now
+
+        self._events = []
+        self._seq = 0
+        self._trace = {} # task id -> TraceTask
+        self._sample_time = None # next sample, None if nothing changed
+
+        # report
+        self._waits = []
+        self._oom = 0
+        self._starts = 0
+        self._gpu_running = [0] * gpus
+        self._gpu_changed = [0.0] * gpus
+        self._gpu_idle = [0.0] * gpus
+
+    def _push(self, time, kind, *data):
+        self._seq += 1
+        heapq.heappush(self._events, (time, self._seq, kind, data))
+
+    def gpu_used(self, id):
+        return sum(run.gpu_mem() for run in self.running.values() if id in run.gpu)
+
+    def host_used(self):
+        return sum(run.cpu_mem() for run in self.running.values())
+
+    def gpu_utilization(self, id):
+        return sum(run.trace_task.utilization for run in self.running.values() if id in run.gpu)
+
+    def _changed(self):
+        """
+        system info changed, sample it in the next sampling round.
+        """
+        if self._sample_time is None:
+            interval = System.sampler.interval
+            self._sample_time = (math.floor(self.now / interval) + 1) * interval
+            self._push(self._sample_time, 'sample')
+
+    def _gpu_count(self, gpu_ids, delta):
+        for id in gpu_ids:
+            if self._gpu_running[id] == 0:
+                self._gpu_idle[id] += self.now - self._gpu_changed[id]
+            self._gpu_running[id] += delta
+            self._gpu_changed[id] = self.now
+
+    def on_start(self, task):
+        trace_task = self._trace[task.id]
+        task.process = _SimProcess(1000000000 + task.id)
+        run = self.running[task.id] = _Run(task, trace_task, self.now)
+        self._starts += 1
+        self._waits.append(task.start_time - task.ready_time)
+        self._gpu_count(run.gpu, 1)
+        for t, _ in run.gpu_curve + run.cpu_curve:
+            if t < trace_task.duration:
+                self._push(self.now + t, 'grow', run)
+        self._push(self.now + trace_task.duration, 'end', run, trace_task.returncode)
+        self._changed()
+
+    def on_kill(self, task):
+        run = self.running.get(task.id)
+        if run is not None:
+            self._push(self.now, 'end', run, -15)
+
+    def _end(self, run, returncode, oom=None):
+        del self.running[run.task.id]
+        self._gpu_count(run.gpu, -1)
+        if oom is not None:
+            self._oom += 1
+            self.oom_reasons[run.task.id] = oom
+        self._changed()
+        run.task._tree_end(returncode)
+
+    def _grow(self, run):
+        """
+        memory of `run` changed, check if it is out of memory.
+        """
+        self._changed()
+        if any(self.gpu_used(id) > self.gpu_memory + 1e-9 for id in run.gpu):
+            self._end(run, 1, 'gpu')
+        elif self.host_used() > self.host_memory + 1e-9:
+            # the OOM killer kills the biggest process
+            victim = max(self.running.values(), key=lambda run: run.cpu_mem())
+            self._end(victim, -9, 'host')
+
+    def _submit(self, trace_task):
+        task_manage = self.task_manage
+        id = task_manage._id_give
+        err, msg = task_manage.add(trace_task.pwd, list(trace_task.cmds or ['task', str(id)]), priority=trace_task.priority,
+                                   gpu_mem=trace_task.request_gpu_mem, cpu_mem=trace_task.request_cpu_mem,
+                                   gpus=trace_task.gpus)
+        if task_manage._id_give == id:
+            raise ValueError(f'can not add {trace_task}: {msg}')
+        self._trace[id] = trace_task
+
+    def _sample(self):
+        self._sample_time = None
+        info = System.sampler.sample()
+        self.task_manage._sample_peaks(info)
+
+    def _setup(self):
+        System.set_backend(SimBackend(self, self.gpus, self.gpu_memory, self.host_memory),
+                           clock=lambda: self.now)
+        self.task_manage = SimTaskManage(self.scheduling, self)
+        for k, v in self.params.items():
+            self.task_manage.set_param(k, v)
+        System.set_sampling(self.task_manage.get_param('GPU_SAMPLE_INTERVAL'),
+                            self.task_manage.get_param('GPU_MAX_STALENESS'))
+
+    def run(self, trace, max_time=None):
+        sampler, max_staleness = System.sampler, System.max_staleness
+        try:
+            self._setup()
+            return self._run(trace, max_time)
+        finally:
+            System.sampler, System.max_staleness = sampler, max_staleness
+
+    def _run(self, trace, max_time):
+        task_manage = self.task_manage
+        trace = sorted(trace, key=lambda trace_task: trace_task.submit)
+        for trace_task in trace:
+            self._push(trace_task.submit, 'submit', trace_task)
+        if trace:
+            self.now = trace[0].submit
+        for id in range(self.gpus):
+            self._gpu_changed[id] = self.now
+        start_time = self.now
+
+        passes, pass_time = 0, 0
+        next_poll = None
+        while True:
+            while self._events and self._events[0][0] <= self.now:
+                _, _, kind, data = heapq.heappop(self._events)
+                if kind == 'submit':
+                    self._submit(*data)
+                elif kind == 'sample':
+                    self._sample()
+                elif data[0].task.id in self.running and self.running[data[0].task.id] is data[0]:
+                    if kind == 'grow':
+                        self._grow(*data)
+                    elif kind == 'end':
+                        self._end(*data)
+
+            if task_manage._wakeup_flag or (next_poll is not None and self.now >= next_poll):
+                task_manage._wakeup_flag = False
+                starts = self._starts
+                t = time.perf_counter()
+                self.scheduling.timer_call(task_manage)
+                pass_time += time.perf_counter() - t
+                passes += 1
+                waiting = len(task_manage.queue) > len(self.running)
+                next_poll = self.now + task_manage.get_param('TIMER_POLLING_TIME') if waiting else None
+                # nothing will change, tasks left can not be started
+                if not self._events and not task_manage._wakeup_flag and self._starts == starts:
+                    break
+
+            times = [self._events[0][0]] if self._events else []
+            if next_poll is not None:
+                times.append(next_poll)
+            if task_manage._wakeup_flag:
+                times.append(self.now)
+            if not times or (max_time is not None and min(times) > start_time + max_time):
+                break
+            self.now = max(self.now, min(times))
+
+        records = list(task_manage.archived_tasks) + list(task_manage.tasks)
+        ended = [record.end_time for record in records if record.end_time is not None]
+        # idle until the last task ended, not the polls after it
+        end_time = max(ended + [self.now if self.running else start_time])
+        for id in range(self.gpus):
+            if self._gpu_running[id] == 0:
+                self._gpu_idle[id] += max(0, end_time - self._gpu_changed[id])
+        waits = sorted(self._waits)
+        complete = sum(record.status == STATUS_COMPLETE for record in records)
+        failed = sum(record.status in (STATUS_RUNTIME_ERROR, STATUS_CMD_ERROR, STATUS_KILLED) 
+                     for record in records)
+        return SimReport(
+            tasks=len(records), complete=complete, failed=failed, 
+            unfinished=len(records) - complete - failed, oom=self._oom,
+            makespan=end_time - start_time,
+            gpu_idle_hours=sum(self._gpu_idle) / 3600,
+            mean_wait=sum(waits) / len(waits) if waits else 0,
+            p95_wait=waits[max(0, math.ceil(0.95 * len(waits)) - 1)] if waits else 0,
+            passes=passes, pass_time=pass_time)
@@ -2,35 +2,105 @@ import socket
 import struct
 
 
+HEADER = struct.Struct('>Q')
+IOV_MAX = 1024
+# bigger messages are read into a buffer growing as bytes arrive, so a 
+# wrong length header does not allocate memory which is never sent
+PREALLOCATE_SIZE = 16 * 1024 * 1024
+
+
+class MessageTooLarge(ConnectionError):
+    """
+    the length header is bigger than `max_size` of `recv_all`, the message
+    is not read, so the connection can not be used anymore.
+    """
+    pass
+
+
+def _recv_into(sock, view, buffer_size):
+    """
+    fill `view` from socket, raise `ConnectionError` if the peer closed
+    before all bytes were received.
+    """
+    while len(view):
+        n = sock.recv_into(view, min(len(view), buffer_size))
+        if n == 0:
+            raise ConnectionError('socket closed before the whole message was received.')
+        view = view[n:]
+
+
+def send_parts(sock, parts):
+    """
+    scatter/gather send: send `parts` (bytes-like objects) as one message,
+    without joining them into a single buffer first.
+    """
+    parts = [memoryview(part).cast('B') for part in parts]
+    buffers = [memoryview(HEADER.pack(sum(len(part) for part in parts)))]
+    buffers += [part for part in parts if len(part)]
+
+    if not hasattr(sock, 'sendmsg'):
+        for buffer in buffers:
+            sock.sendall(buffer)
+        return
+
+    i = 0
+    while i < len(buffers):
+        sent = sock.sendmsg(buffers[i: i + IOV_MAX])
+        while sent:
+            if sent >= len(buffers[i]):
+                sent -= len(buffers[i])
+                i += 1
+            else:
+                buffers[i] = buffers[i][sent:]
+                sent = 0
+
+
 def send_all(sock, msg):
-    sock.send(struct.pack('>Q', len(msg)))
-    sock.sendall(msg)
-    
-    
-def recv_all(sock, buffer_size=1024):
-    msg_len = sock.recv(8)
-    msg_len = struct.unpack('>Q', msg_len)[0]
-    msg = b''
-    while len(msg) < msg_len:
-        msg += sock.recv(buffer_size)
-    return msg
+    send_parts(sock, [msg])
+
+
+def recv_all(sock, buffer_size=1024 * 1024, max_size=None):
+    """
+    receive one message, raise `MessageTooLarge` if it is bigger than
+    `max_size` bytes (None: no limit, e.g. responses read by the client).
+    """
+    header = bytearray(HEADER.size)
+    _recv_into(sock, memoryview(header), HEADER.size)
+    msg_len = HEADER.unpack(header)[0]
+    if max_size is not None and msg_len > max_size:
+        raise MessageTooLarge(f'message of {msg_len} bytes is bigger than the limit ({max_size} bytes).')
+
+    if msg_len <= PREALLOCATE_SIZE:
+        msg = bytearray(msg_len)
+        _recv_into(sock, memoryview(msg), buffer_size)
+        return bytes(msg)
     
+    # double the buffer, each byte is copied O(1) times
+    msg = bytearray(PREALLOCATE_SIZE)
+    received = 0
+    while True:
+        _recv_into(sock, memoryview(msg)[received:], buffer_size)
+        received = len(msg)
+        if received == msg_len:
+            return bytes(msg)
+        msg.extend(bytes(min(msg_len, 2 * received) - received))
+
 
 def send_all_str(sock, msg):
     msg = bytes(msg, encoding='utf8')
     send_all(sock, msg)
-    
-def recv_all_str(sock, buffer_size=1024):
+
+def recv_all_str(sock, buffer_size=1024 * 1024):
     msg = recv_all(sock, buffer_size)
     msg = msg.decode('utf8')
     return msg
 #%%
-    
+
 #sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 #sock.bind(('0.0.0.0', 19999))
 #sock.listen(1)
 #
-#conn,addr = sock.accept() 
+#conn,addr = sock.accept()
 #print(recv_all(conn))
 #send_all_str(conn, 'dqwwwdwd')
 #sock.close()
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import heapq
+import signal
+import socket
+import logging
+import itertools
+import selectors
+import threading
+import traceback
+
+import psutil
+
+
+class ProcessSupervisor(object):
+    """
+    Wait all task processes in one thread, instead of one thread blocking
+    in `process.wait()` per task.
+
+    On linux each process is watched with a pidfd (`os.pidfd_open`) in a
+    selector, which is readable when the process exits. Where pidfd is not
+    available, the watched processes are polled every `poll_interval`
+    seconds.
+
+    Timers (`call_later`) run in the same thread, e.g. `terminate` sends
+    SIGTERM and schedules SIGKILL after the timeout instead of sleeping.
+
+    Tasks are started in their own process group (`pgid`), `terminate`
+    signals the whole group and the descendants of the process, so workers
+    (e.g. DataLoader, torchrun) do not survive the task.
+
+    Callbacks run in the supervisor thread, they should not block.
+
+    Functions:
+
+        watch(process, callback)     call `callback(returncode)` when process
+                                     (`subprocess.Popen` or `psutil.Process`) exits
+        call_later(delay, func)      call `func()` after `delay` seconds
+        terminate(process, timeout, pgid)
+                                     SIGCONT and SIGTERM process tree, SIGKILL 
+                                     after `timeout` seconds if it is still alive
+        group_alive(pgid)            True if any process of the group is alive
+        wait_group(pgid, callback, timeout)
+                                     call `callback()` when all processes of the 
+                                     group exited (or after `timeout` seconds)
+
+    """
+    def __init__(self, poll_interval=0.5):
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._selector = None
+        self._wake_r, self._wake_w = None, None
+        self._thread = None
+
+        self._pending = [] # (process, callback) to watch, added by loop thread
+        self._polled = {} # process -> callback, processes without pidfd
+        self._timers = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._polled) + (len(self._selector.get_map()) - 1 if self._selector else 0)
+
+    def _start(self):
+        if self._thread is None:
+            self._selector = selectors.DefaultSelector()
+            self._wake_r, self._wake_w = socket.socketpair()
+            self._wake_r.setblocking(False)
+            self._selector.register(self._wake_r, selectors.EVENT_READ)
+            self._thread = threading.Thread(target=self._thread_loop, daemon=True)
+            self._thread.start()
+
+    def _wakeup(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass # already woken
+
+    def watch(self, process, callback):
+        with self._lock:
+            self._start()
+            self._pending.append((process, callback))
+        self._wakeup()
+
+    def call_later(self, delay, func):
+        with self._lock:
+            self._start()
+            heapq.heappush(self._timers, (time.time() + delay, next(self._counter), func))
+        self._wakeup()
+
+    def terminate(self, process, timeout=5, pgid=None):
+        descendants = self.descendants(process)
+        if not self.tree_alive(process, pgid, descendants):
+            return
+        self._signal(process, pgid, descendants, kill=False)
+        self.call_later(timeout, lambda: self.kill(process, pgid, descendants))
+
+    def kill(self, process, pgid=None, descendants=()):
+        if self.tree_alive(process, pgid, descendants):
+            logging.info(f'[supervisor]: process {process.pid} is still alive, kill it.')
+            self._signal(process, pgid, descendants, kill=True)
+
+    @staticmethod
+    def descendants(process):
+        try:
+            return psutil.Process(process.pid).children(recursive=True)
+        except psutil.Error:
+            return []
+
+    def tree_alive(self, process, pgid=None, descendants=()):
+        if not self.poll(process)[0] or self.group_alive(pgid):
+            return True
+        for child in descendants:
+            try:
+                if child.is_running():
+                    return True
+            except psutil.Error:
+                pass
+        return False
+
+    @staticmethod
+    def _signal(process, pgid, descendants, kill):
+        # a stopped process (paused task) does not handle SIGTERM until it
+        # is continued, it would only exit by SIGKILL after the timeout
+        signums = [signal.SIGKILL] if kill else [signal.SIGCONT, signal.SIGTERM]
+        for signum in signums:
+            if pgid is not None:
+                try:
+                    os.killpg(pgid, signum)
+                except OSError:
+                    pass
+            for p in [process] + list(descendants):
+                try:
+                    p.send_signal(signum)
+                except (OSError, psutil.Error): # exited just now
+                    pass
+
+    @staticmethod
+    def group_alive(pgid, reap=False):
+        """
+        if `reap`, exited processes of the group which are our children are
+        reaped first (e.g. orphans reparented to the server running as 
+        pid 1), don't reap before the group leader is waited.
+        """
+        if pgid is None:
+            return False
+        if reap:
+            try:
+                while os.waitpid(-pgid, os.WNOHANG)[0] > 0:
+                    pass
+            except ChildProcessError:
+                pass
+        try:
+            os.killpg(pgid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def wait_group(self, pgid, callback, timeout=30):
+        deadline = time.time() + timeout
+
+        def check(interval):
+            if not self.group_alive(pgid, reap=True) or time.time() > deadline:
+                callback()
+            else:
+                self.call_later(interval, lambda: check(min(2 * interval, 0.5)))
+        check(0.02)
+
+    @staticmethod
+    def poll(process):
+        """
+        return (exited, returncode), returncode of a `psutil.Process` which
+        is not our child is None.
+        """
+        if isinstance(process, psutil.Process):
+            try:
+                return True, process.wait(timeout=0)
+            except psutil.TimeoutExpired:
+                return False, None
+            except psutil.Error:
+                return True, None
+        returncode = process.poll()
+        return returncode is not None, returncode
+
+    def _register(self, process, callback):
+        pidfd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError: # kernel < 5.3, or exited
+                pidfd = None
+        if pidfd is None:
+            self._polled[process] = callback
+        else:
+            self._selector.register(pidfd, selectors.EVENT_READ, (process, callback))
+        self._check(process, callback, pidfd)
+
+    def _check(self, process, callback, pidfd=None):
+        exited, returncode = self.poll(process)
+        if not exited:
+            return
+        if pidfd is None:
+            self._polled.pop(process, None)
+        else:
+            self._selector.unregister(pidfd)
+            os.close(pidfd)
+        self._call(callback, returncode)
+
+    @staticmethod
+    def _call(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logging.warning(f'[supervisor]: callback failed.\n{traceback.format_exc()}')
+
+    def _thread_loop(self):
+        while True:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                timeout = max(0, self._timers[0][0] - time.time()) if self._timers else None
+            if self._polled:
+                timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+
+            for process, callback in pending:
+                self._register(process, callback)
+            if pending:
+                continue
+
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                    continue
+                process, callback = key.data
+                self._check(process, callback, key.fileobj)
+
+            for process, callback in list(self._polled.items()):
+                self._check(process, callback)
+
+            while True:
+                with self._lock:
+                    if not self._timers or self._timers[0][0] > time.time():
+                        break
+                    _, _, func = heapq.heappop(self._timers)
+                self._call(func)
+
+
+supervisor = ProcessSupervisor()
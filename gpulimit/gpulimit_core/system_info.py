@@ -1,65 +1,273 @@
 import os
 import sys
-import time 
+import time
 import logging
+import threading
 import psutil
 
 from collections import deque, namedtuple
 
-from gpulimit.utils.pynvml import nvmlInit, nvmlDeviceGetCount, \
-                         nvmlDeviceGetHandleByIndex, nvmlDeviceGetMemoryInfo
-                 
-                    
+from gpulimit.utils.pynvml import nvmlInit, nvmlDeviceGetCount, NVMLError, \
+                         nvmlDeviceGetHandleByIndex, nvmlDeviceGetMemoryInfo, \
+                         nvmlDeviceGetUtilizationRates, nvmlDeviceGetComputeRunningProcesses, \
+                         nvmlDeviceGetTopologyCommonAncestor
+
+
 SystemInfo = namedtuple('SystemInfo', ('time', 'CPU_utilization','memory', 'gpu', 'task'))
 MemoryInfo = namedtuple('MemoryInfo', ('total','free', 'used'))
-GPUInfo = namedtuple('GPUInfo', ('id','total', 'free', 'used', 'utilization'))
-# ProcessInfo = namedtuple('ProcessInfo', ('pid','memory_used', 'gpu_memory'))
+GPUInfo = namedtuple('GPUInfo', ('id','total', 'free', 'used', 'utilization', 
+                                 'memory_utilization', 'processes'), defaults=(None, ()))
+ProcessInfo = namedtuple('ProcessInfo', ('pid', 'gpu', 'gpu_memory'))
 
-nvmlInit()
 
+class NvmlBackend(object):
+    """
+    Read GPU info from NVML, device handles are resolved once.
 
-class System(object):
+    A backend has:
+        
+        gpu_nums()
+        memory_info(id)          object with `total`, `free`, `used` in bytes
+        utilization(id)          object with `gpu`, `memory` in percent, or None
+        processes(id)            objects with `pid`, `usedGpuMemory` in bytes
+        host_memory()            object with `total`, `available`, `used` in bytes
+        cpu_utilization()        percent
+        topology()               matrix of GPU pair distances (NVML topology 
+                                 level, lower is closer), or None
+        
+    Use `System.set_backend` to replace it (e.g. with a fake backend in tests).
+    """
+    def __init__(self):
+        nvmlInit()
+        self.handles = [nvmlDeviceGetHandleByIndex(i) for i in range(nvmlDeviceGetCount())]
+        self._topology = False
+
+    def gpu_nums(self):
+        return len(self.handles)
+
+    def memory_info(self, id):
+        return nvmlDeviceGetMemoryInfo(self.handles[id])
+
+    def utilization(self, id):
+        try:
+            return nvmlDeviceGetUtilizationRates(self.handles[id])
+        except NVMLError: # not supported by device
+            return None
+
+    def processes(self, id):
+        try:
+            return nvmlDeviceGetComputeRunningProcesses(self.handles[id])
+        except NVMLError:
+            return []
+
+    def host_memory(self):
+        return psutil.virtual_memory()
+
+    def cpu_utilization(self):
+        return psutil.cpu_percent()
+
+    def topology(self):
+        if self._topology is False:
+            try:
+                self._topology = [[0 if i == j else nvmlDeviceGetTopologyCommonAncestor(hi, hj)
+                                   for j, hj in enumerate(self.handles)]
+                                  for i, hi in enumerate(self.handles)]
+            except NVMLError: # not supported
+                self._topology = None
+        return self._topology
+
+
+class Sampler(object):
+    """
+    Sample GPU and memory info every `interval` seconds in a background
+    thread, keep the last `history` `SystemInfo` snapshots in a ring buffer.
     
+    `listeners` are called with each snapshot sampled by the thread.
+    
+    Snapshot times are read from `clock` (`time.time`, or the virtual clock
+    of `Simulator`).
+    """
+    def __init__(self, backend, interval=1, history=60, clock=time.time):
+        self.backend = backend
+        self.interval = interval
+        self.clock = clock
+        self.history = deque(maxlen=history)
+        self.listeners = []
+        self._thread = None
+        self._invalid = False
+
+    def sample(self):
+        gpus = []
+        for i in range(self.backend.gpu_nums()):
+            memorys = self.backend.memory_info(i)
+            utilization = self.backend.utilization(i)
+            processes = tuple(ProcessInfo(p.pid, i, (p.usedGpuMemory or 0)/1024/1024/1024)
+                              for p in self.backend.processes(i))
+            gpus.append(GPUInfo(i, memorys.total/1024/1024/1024,
+                                memorys.free/1024/1024/1024,
+                                memorys.used/1024/1024/1024,
+                                None if utilization is None else utilization.gpu / 100,
+                                None if utilization is None else utilization.memory / 100,
+                                processes))
+        memory = self.backend.host_memory()
+        memory = MemoryInfo(memory.total/1024/1024/1024,
+                            memory.available/1024/1024/1024,
+                            memory.used/1024/1024/1024)
+        info = SystemInfo(self.clock(), self.backend.cpu_utilization() / 100, memory, gpus, None)
+        self.history.append(info)
+        return info
+
+    def latest(self, max_staleness):
+        """
+        return the latest snapshot, sample now if it is older than
+        `max_staleness` seconds (or the sampler is not running).
+        """
+        info = self.history[-1] if self.history else None
+        if info is None or self._invalid or self.clock() - info.time > max_staleness:
+            self._invalid = False
+            info = self.sample()
+        return info
+
+    def invalidate(self):
+        """
+        resample on the next `latest`, e.g. memory was just released.
+        """
+        self._invalid = True
+
+    def _thread_sample(self):
+        while True:
+            try:
+                info = self.sample()
+                for listener in self.listeners:
+                    listener(info)
+            except Exception as e:
+                logging.warning(f'[sampler]: sample system info failed: {e}')
+            time.sleep(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_sample, daemon=True)
+            self._thread.start()
+
+
+class System(object):
+    """
+    System info, GPU and memory info are read from the latest `Sampler`
+    snapshot, which is at most `max_staleness` seconds old.
+    """
+    sampler = None
+    max_staleness = 5
+
+    @staticmethod
+    def set_backend(backend, interval=1, clock=time.time):
+        System.sampler = Sampler(backend, interval, clock=clock)
+
+    @staticmethod
+    def _sampler():
+        if System.sampler is None:
+            System.set_backend(NvmlBackend())
+        return System.sampler
+
+    @staticmethod
+    def set_sampling(interval=None, max_staleness=None):
+        if interval is not None:
+            System._sampler().interval = interval
+        if max_staleness is not None:
+            System.max_staleness = max_staleness
+
+    @staticmethod
+    def start_sampler(interval=None, max_staleness=None):
+        System.set_sampling(interval, max_staleness)
+        System._sampler().start()
+
+    @staticmethod
+    def time():
+        """
+        current time of the sampler clock (virtual in `Simulator`).
+        """
+        return System._sampler().clock()
+
+    @staticmethod
+    def add_listener(listener):
+        """
+        call `listener(info)` after each background sample.
+        """
+        System._sampler().listeners.append(listener)
+
+    @staticmethod
+    def invalidate():
+        System._sampler().invalidate()
+
+    @staticmethod
+    def snapshot():
+        return System._sampler().latest(System.max_staleness)
+
     @staticmethod
     def gpu_nums():
-        return nvmlDeviceGetCount()
-    
+        return len(System.snapshot().gpu)
+
     @staticmethod
     def gpu(id):
-        h = nvmlDeviceGetHandleByIndex(id)
-        memorys = nvmlDeviceGetMemoryInfo(h)
-        return GPUInfo(id, memorys.total/1024/1024/1024, 
-                       memorys.free/1024/1024/1024, 
-                       memorys.used/1024/1024/1024, None)
-    
+        return System.snapshot().gpu[id]
+
     @staticmethod
     def gpus():
-        return [System.gpu(i) for i in range(System.gpu_nums())]
-    
+        return list(System.snapshot().gpu)
+
     @staticmethod
     def cpu_nums():
         return psutil.cpu_count()
-    
+
     @staticmethod
     def cpu_usage(id):
         return psutil.cpu_percent(id) / 100
-    
+
     @staticmethod
     def cpu_mean():
-        sum([System.cpu_usage(i) for i in range(System.cpu_nums())]) / System.cpu_nums()
-       
+        return System.snapshot().CPU_utilization
+
+    @staticmethod
+    def gpu_utilization(id, window=10):
+        """
+        mean GPU `id` utilization of the snapshots in the last `window`
+        seconds, None if not available.
+        """
+        info = System.snapshot()
+        values = [history.gpu[id].utilization for history in list(System.sampler.history)
+                  if info.time - history.time <= window and id < len(history.gpu)]
+        values = [value for value in values if value is not None]
+        if not values:
+            return info.gpu[id].utilization
+        return sum(values) / len(values)
+
+    @staticmethod
+    def gpu_topology():
+        """
+        matrix of GPU pair distances, the NVML topology level of their
+        closest common ancestor in the PCIe tree (lower is closer, e.g. 
+        same PCIe switch), None if not available. NVLink is not included.
+        """
+        return System._sampler().backend.topology()
+
+    @staticmethod
+    def gpu_processes():
+        """
+        processes using GPU, list of `ProcessInfo` (gpu_memory in GB).
+        """
+        return [process for gpu in System.gpus() for process in gpu.processes]
+
     @staticmethod
     def memory():
-        memory = psutil.virtual_memory()
-        return MemoryInfo(memory.total/1024/1024/1024, 
-                          memory.available/1024/1024/1024, 
-                          memory.used/1024/1024/1024)
-    
+        return System.snapshot().memory
+
     @staticmethod
     def best_select_gpu_id():
-        return max([(i, gpu.free) for i, gpu in enumerate(System.gpus())], 
+        return max([(i, gpu.free) for i, gpu in enumerate(System.gpus())],
                                                       key=lambda x: x[1])[0]
-    
 
-    
+    @staticmethod
+    def best_select_gpu_ids(nums):
+        return [gpu.id for gpu in sorted(System.gpus(), key=lambda gpu: -gpu.free)[:nums]]
+
+
 
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from .tasks import ArchivedTask, STATUS_COMPLETE, STATUS_CMD_ERROR, STATUS_KILLED
+
+
+ARCHIVE_STATUS = (STATUS_COMPLETE, STATUS_CMD_ERROR, STATUS_KILLED)
+
+
+class TaskArchive(object):
+    """
+    Finished tasks, moved out of `TaskQueue` so that scheduling and `ls`
+    only iterate over live tasks.
+    
+    Tasks are stored as `ArchivedTask` records in finish order, when there are
+    more than `maxlen` records the oldest ones are evicted.
+    
+    Not thread safe, use it under `TaskManage.lock`. `cached_snapshot` is
+    a tuple of records (None if changed since `snapshot()`), which can be 
+    read without lock.
+    """
+    def __init__(self):
+        self._records = OrderedDict()
+        self.cached_snapshot = ()
+        
+    def __len__(self):
+        return len(self._records)
+    
+    def __contains__(self, id):
+        return id in self._records
+    
+    def add(self, task, maxlen=-1):
+        record = ArchivedTask(task)
+        self._records[record.id] = record
+        self.cached_snapshot = None
+        if maxlen >= 0:
+            while len(self._records) > maxlen:
+                self._records.popitem(last=False)
+        return record
+    
+    def get(self, id):
+        return self._records.get(id)
+    
+    def remove_many(self, ids):
+        removed = []
+        for id in ids:
+            record = self._records.pop(id, None)
+            if record is not None:
+                removed.append(record)
+        if removed:
+            self.cached_snapshot = None
+        return removed
+    
+    def records(self):
+        return list(self._records.values())
+    
+    def snapshot(self):
+        if self.cached_snapshot is None:
+            self.cached_snapshot = tuple(self._records.values())
+        return self.cached_snapshot
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+import threading
+
+
+# task attributes kept in journal records
+RECORD_FIELDS = ('id', 'pwd', 'cmds', 'priority', 'out_path', 'status', 'run_times',
+                 'start_time', 'end_time', 'debug_msg', 'gpu_mem', 'cpu_mem', 'gpu_num',
+                 'mem_estimated', 'peak_gpu_mem', 'peak_cpu_mem', 'gpu', 'pid')
+
+
+class TaskJournal(object):
+    """
+    Write-ahead journal of task changes, so the queue survives a restart
+    or crash of the server.
+
+    Files in `path` dir:
+
+        journal.log          append only, one json event per line:
+                             {"n": seq, "e": "put", "t": record}   task added / changed
+                             {"n": seq, "e": "del", "ids": [...]}   tasks removed
+        snapshot.json        {"seq": seq, "next_id": id, "tasks": [record, ...]}
+
+    `append` only buffers the event, a background thread writes buffered
+    events and fsyncs every `sync_interval` seconds (group commit), so a
+    crash loses at most the last `sync_interval` seconds of changes.
+
+    When the journal has more than `snapshot_events` events, the state from
+    `snapshot_func()` (returns (next_id, records), called under the task
+    lock so it matches the events appended so far) is written to
+    snapshot.json and the journal is truncated. Events with seq not bigger
+    than the snapshot seq are skipped on replay, so a crash between the two
+    steps is safe.
+
+    Functions:
+
+        replay()                     return (next_id, records)
+        append(event, **kwargs)
+        start(snapshot_func, lock)   start background thread
+        flush()                      write and fsync buffered events, do not 
+                                     call it under the task lock
+        snapshot()
+
+    """
+    def __init__(self, path, sync_interval=0.2, snapshot_events=100000):
+        self.path = path
+        self.journal_path = os.path.join(path, 'journal.log')
+        self.snapshot_path = os.path.join(path, 'snapshot.json')
+        self.sync_interval = sync_interval
+        self.snapshot_events = snapshot_events
+
+        self.lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._seq = 0
+        self._buffer = []
+        self._events = 0 # events in journal file
+        self._file = None
+        self._thread = None
+        self._snapshot_func = None
+        self._task_lock = None
+
+    @staticmethod
+    def record(task, **kwargs):
+        record = dict((name, getattr(task, name)) for name in RECORD_FIELDS)
+        record['status'] = str(task.status)
+        record.update(kwargs)
+        return record
+
+    def replay(self):
+        """
+        read snapshot and journal, return (next_id, records), records are
+        dicts of `RECORD_FIELDS` (and `order`, `archived`, `create_time`)
+        in snapshot / add order.
+        """
+        seq, next_id, records = 0, 0, {}
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            seq, next_id = snapshot['seq'], snapshot['next_id']
+            records = dict((record['id'], record) for record in snapshot['tasks'])
+        self._seq = seq
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                for i, line in enumerate(f):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        # last line is not complete if crashed when writing
+                        logging.warning(f'[journal]: skip broken line {i + 1} of {self.journal_path}.')
+                        continue
+                    self._events += 1
+                    self._seq = max(self._seq, event['n'])
+                    if event['n'] <= seq:
+                        continue
+                    if event['e'] == 'put':
+                        record = event['t']
+                        records[record['id']] = record
+                        next_id = max(next_id, record['id'] + 1)
+                    elif event['e'] == 'del':
+                        for id in event['ids']:
+                            records.pop(id, None)
+        return next_id, list(records.values())
+
+    def append(self, event, **kwargs):
+        with self.lock:
+            self._seq += 1
+            event = dict(n=self._seq, e=event, **kwargs)
+            self._buffer.append(json.dumps(event, separators=(',', ':')))
+
+    def _write(self):
+        with self._write_lock:
+            with self.lock:
+                buffer, self._buffer = self._buffer, []
+            if self._file is None:
+                self._file = open(self.journal_path, 'a')
+            if buffer:
+                self._file.write('\n'.join(buffer) + '\n')
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._events += len(buffer)
+
+    def flush(self):
+        self._write()
+
+    def snapshot(self):
+        with self._write_lock:
+            self._snapshot()
+            
+    def _snapshot(self):
+        self._write()
+        with self._task_lock:
+            next_id, records = self._snapshot_func()
+            with self.lock:
+                seq = self._seq
+        data = json.dumps({'seq': seq, 'next_id': next_id, 'tasks': records}, separators=(',', ':'))
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+        # events buffered after the snapshot are written to the new journal
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, 'w')
+        self._events = 0
+
+    def _thread_sync(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self._write()
+                if self._events > self.snapshot_events:
+                    start = time.time()
+                    self.snapshot()
+                    logging.info(f'[journal]: snapshot in {time.time() - start:.2f}s.')
+            except Exception as e:
+                logging.warning(f'[journal]: write failed: {e}')
+
+    def start(self, snapshot_func, lock):
+        self._snapshot_func = snapshot_func
+        self._task_lock = lock
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_sync, daemon=True)
+            self._thread.start()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import gzip
+import queue
+import shutil
+import logging
+import selectors
+import threading
+import traceback
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESS_NONE = 0
+COMPRESS_GZIP = 1
+COMPRESS_ZSTD = 2
+
+_SEGMENT = re.compile(r'\.\d+(\.gz|\.zst)?$')
+_ATTEMPT = re.compile(r'-\d+$')
+
+
+def attempt_path(out_path, attempt):
+    """
+    output file of the `attempt`-th run of a task, the first run writes
+    `out_path` (e.g. `3.log`), reruns write `3-2.log`, `3-3.log`, ...
+    """
+    if attempt <= 1:
+        return out_path
+    root, ext = os.path.splitext(out_path)
+    return f'{root}-{attempt}{ext}'
+
+
+def segment_path(path, n, compress=COMPRESS_NONE):
+    """
+    the `n`-th rotated segment of `path`, e.g. `3.log.1`, `3.log.2.gz`.
+    """
+    return f'{path}.{n}' + {COMPRESS_GZIP: '.gz', COMPRESS_ZSTD: '.zst'}.get(compress, '')
+
+
+def base_paths(path):
+    """
+    candidate `out_path`s of a log file, e.g. `3-2.log.1.gz` ->
+    [`3-2.log.1.gz`, `3-2.log`, `3.log`].
+    """
+    paths = [path]
+    path = _SEGMENT.sub('', path)
+    paths.append(path)
+    root, ext = os.path.splitext(path)
+    if _ATTEMPT.search(root):
+        paths.append(_ATTEMPT.sub('', root) + ext)
+    return paths
+
+
+class LogWriter(object):
+    """
+    Output file of one run, rotated when it is bigger than `max_size` bytes
+    (0: never): the file is renamed to the next segment `path.1`, `path.2`,
+    ... (compressed in background if `compress`), only the last `max_files`
+    segments are kept. `path` always has the latest output, so `log --tail`
+    and `log --follow` read it.
+
+    Written by the `OutputCapture` thread only.
+    """
+    def __init__(self, path, max_size=0, max_files=5, compress=COMPRESS_GZIP, compressor=None):
+        self.path = path
+        self.max_size = max_size
+        self.max_files = max_files
+        self.compress = compress
+        self.compressor = compressor
+
+        self.file = open(path, 'wb', buffering=0)
+        self.size = 0
+        self.segments = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.max_size > 0 and self.size > 0 and self.size + len(data) > self.max_size:
+            self._rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def _rotate(self):
+        self.file.close()
+        self.segments += 1
+        segment = segment_path(self.path, self.segments)
+        os.replace(self.path, segment)
+        self.file = open(self.path, 'wb', buffering=0)
+        self.size = 0
+
+        if self.compress and self.compressor is not None:
+            self.compressor.put(self.path, self.segments, self.compress)
+
+        old = self.segments - self.max_files
+        if old > 0:
+            for compress in (COMPRESS_NONE, COMPRESS_GZIP, COMPRESS_ZSTD):
+                try:
+                    os.remove(segment_path(self.path, old, compress))
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+            self.closed = True
+
+
+class Compressor(object):
+    """
+    Compress rotated segments in a background thread, `segment` is
+    replaced by `segment.gz` (or `.zst`, gzip if `zstandard` is not
+    installed).
+    """
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, path, n, compress):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._thread_compress, daemon=True)
+                self._thread.start()
+        self._queue.put((path, n, compress))
+
+    def join(self):
+        self._queue.join()
+
+    @staticmethod
+    def compress_file(path, n, compress):
+        if compress == COMPRESS_ZSTD and zstandard is None:
+            compress = COMPRESS_GZIP
+        segment = segment_path(path, n)
+        compressed = segment_path(path, n, compress)
+        tmp_path = compressed + '.tmp'
+        with open(segment, 'rb') as src:
+            if compress == COMPRESS_ZSTD:
+                with open(tmp_path, 'wb') as dst:
+                    zstandard.ZstdCompressor().copy_stream(src, dst)
+            else:
+                with gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, compressed)
+        try:
+            os.remove(segment)
+        except FileNotFoundError: # removed while compressing
+            os.remove(compressed)
+
+    def _thread_compress(self):
+        while True:
+            path, n, compress = self._queue.get()
+            try:
+                self.compress_file(path, n, compress)
+            except FileNotFoundError: # removed (too many segments, or evicted)
+                pass
+            except Exception:
+                logging.warning(f'[log]: compress {segment_path(path, n)} failed.\n{traceback.format_exc()}')
+            finally:
+                self._queue.task_done()
+
+
+class OutputCapture(object):
+    """
+    Read stdout pipes of all tasks in one thread and write them to their
+    `LogWriter`, instead of giving the log file to the task process, so the
+    output can be rotated.
+
+    When a pipe is closed (all processes of the task exited), its writer
+    is closed and `callback()` is called. If writing fails (e.g. disk is
+    full), the rest of the output is dropped, the pipe is still read so
+    that the task does not block or get SIGPIPE.
+
+    Functions:
+
+        capture(pipe, writer, callback=None)
+
+    """
+    def __init__(self, chunk_size=64 * 1024):
+        self.chunk_size = chunk_size
+        self.compressor = Compressor()
+
+        self._lock = threading.Lock()
+        self._selector = None
+        self._thread = None
+
+    def __len__(self):
+        return len(self._selector.get_map()) if self._selector else 0
+
+    def capture(self, pipe, writer, callback=None):
+        with self._lock:
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._thread = threading.Thread(target=self._thread_loop, daemon=True)
+                self._thread.start()
+            # register is thread safe for the default (epoll / poll) selector
+            self._selector.register(pipe, selectors.EVENT_READ, (writer, callback))
+
+    def _close(self, pipe, writer, callback):
+        self._selector.unregister(pipe)
+        pipe.close()
+        writer.close()
+        if callback is not None:
+            callback()
+
+    def _thread_loop(self):
+        while True:
+            # a pipe registered while waiting is selected in the next round
+            for key, _ in self._selector.select(0.5):
+                pipe, (writer, callback) = key.fileobj, key.data
+                try:
+                    data = os.read(pipe.fileno(), self.chunk_size)
+                except OSError:
+                    data = b''
+                if not data:
+                    self._close(pipe, writer, callback)
+                    continue
+                if writer.closed:
+                    continue
+                try:
+                    writer.write(data)
+                except Exception:
+                    logging.warning(f'[log]: write {writer.path} failed, drop the rest output.\n'
+                                    f'{traceback.format_exc()}')
+                    writer.close()
+
+
+output_capture = OutputCapture()
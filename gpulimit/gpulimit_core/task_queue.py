@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import threading
+
+from .tasks import STATUS_WAITING, STATUS_RUNTIME_ERROR
+
+
+RUNNABLE_STATUS = (STATUS_WAITING, STATUS_RUNTIME_ERROR)
+
+
+class TaskQueue(object):
+    """
+    Indexed priority queue of tasks.
+
+    Tasks are kept in a dict by id (listing order is given by `order`, which
+    `move` can change), runnable tasks are also kept in a heap keyed on
+    (status.sort_run, run_times, priority, order).
+
+    Heap entries are invalidated lazily: `update` marks the old entry removed
+    and pushes a new one, `pop_runnable` drops removed entries and re-pushes
+    entries whose task key changed since they were pushed.
+
+    `snapshot` returns an immutable tuple of tasks in listing order, it is
+    rebuilt (under lock) only after the queue changed, readers of an 
+    unchanged queue (e.g. `ls`, `status`) don't take the lock.
+
+    Functions:
+
+        push(task, order=None)       O(log n)
+        get(id)                      O(1)
+        order(id)                    listing order key of task
+        remove(id)                   O(1), heap entry dropped lazily
+        remove_many(ids)             O(n), remove tasks in one pass
+        update(task)                 O(log n), call after priority/status changed
+        move(id, index)              O(n), manual positioning
+        pop_runnable()               O(log n), pop next runnable task
+        ordered()                    all tasks in listing order
+        snapshot()                   tuple of all tasks in listing order, lock free
+
+    """
+    def __init__(self, lock=None):
+        self.lock = threading.RLock() if lock is None else lock
+
+        self._tasks = {}
+        self._order = {}
+        self._next_order = 0
+        self._ordered = []
+        self._snapshot = ()
+        self.renumbered = 0 # times all orders changed by `move`
+
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def __contains__(self, id):
+        return id in self._tasks
+
+    def __iter__(self):
+        return iter(self.ordered())
+
+    @staticmethod
+    def runnable(task):
+        return task.status in RUNNABLE_STATUS
+
+    def _key(self, task):
+        return (task.status.sort_run, task.run_times, task.priority, self._order[task.id])
+
+    def _push_entry(self, task):
+        entry = [self._key(task), next(self._counter), task.id]
+        self._entries[task.id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _drop_entry(self, id):
+        entry = self._entries.pop(id, None)
+        if entry is not None:
+            entry[-1] = None
+
+        # too many removed entries, rebuild heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[-1] is not None]
+            heapq.heapify(self._heap)
+
+    def push(self, task, order=None):
+        """
+        push task to the end, or at `order` (e.g. restored from journal), 
+        `order` must be bigger than orders of the pushed tasks.
+        """
+        with self.lock:
+            self._tasks[task.id] = task
+            self._order[task.id] = self._next_order if order is None else order
+            self._next_order = max(self._next_order, self._order[task.id]) + 1
+            if self._ordered is not None:
+                self._ordered.append(task)
+            self._snapshot = None
+            if self.runnable(task):
+                self._push_entry(task)
+
+    def get(self, id):
+        return self._tasks.get(id)
+
+    def order(self, id):
+        with self.lock:
+            return self._order.get(id)
+
+    def remove(self, id):
+        with self.lock:
+            task = self._tasks.pop(id, None)
+            if task is None:
+                return None
+            del self._order[id]
+            self._drop_entry(id)
+            self._ordered = None
+            self._snapshot = None
+            return task
+
+    def remove_many(self, ids):
+        with self.lock:
+            removed = []
+            for id in ids:
+                task = self._tasks.pop(id, None)
+                if task is None:
+                    continue
+                del self._order[id]
+                self._drop_entry(id)
+                removed.append(task)
+            if removed and self._ordered is not None:
+                self._ordered = [task for task in self._ordered if task.id in self._tasks]
+            if removed:
+                self._snapshot = None
+            return removed
+
+    def update(self, task):
+        with self.lock:
+            if task.id not in self._tasks:
+                return
+            self._drop_entry(task.id)
+            if self.runnable(task):
+                self._push_entry(task)
+
+    def move(self, id, index):
+        with self.lock:
+            task = self._tasks.get(id)
+            if task is None:
+                return False
+            others = [t for t in self.ordered() if t.id != id]
+            index = max(0, min(index, len(others)))
+
+            if not others:
+                order = 0
+            elif index == 0:
+                order = self._order[others[0].id] - 1
+            elif index == len(others):
+                order = self._order[others[-1].id] + 1
+            else:
+                low = self._order[others[index - 1].id]
+                high = self._order[others[index].id]
+                order = (low + high) / 2
+                if not low < order < high: # float precision exhausted
+                    others.insert(index, task)
+                    self._renumber(others)
+                    return True
+
+            self._order[id] = order
+            self._next_order = max(self._next_order, order + 1)
+            self._ordered = None
+            self._snapshot = None
+            self.update(task)
+            return True
+
+    def _renumber(self, tasks):
+        self.renumbered += 1
+        self._order = dict((t.id, i) for i, t in enumerate(tasks))
+        self._next_order = len(tasks)
+        self._ordered = tasks
+        self._snapshot = None
+        self._entries = {}
+        self._heap = []
+        for task in tasks:
+            if self.runnable(task):
+                self._push_entry(task)
+
+    def pop_runnable(self):
+        """
+        pop the next runnable task in scheduling order, return None if no
+        runnable task.
+
+        The task is taken out of the heap, use `update(task)` to put it back
+        if it is not started.
+        """
+        with self.lock:
+            while self._heap:
+                entry = heapq.heappop(self._heap)
+                key, _, id = entry
+                if id is None:
+                    continue
+                del self._entries[id]
+
+                task = self._tasks[id]
+                if not self.runnable(task):
+                    continue
+                if key != self._key(task):
+                    self._push_entry(task)
+                    continue
+                return task
+            return None
+
+    def ordered(self):
+        return list(self.snapshot())
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self.lock:
+            if self._snapshot is None:
+                if self._ordered is None:
+                    self._ordered = sorted(self._tasks.values(), key=lambda t: self._order[t.id])
+                self._snapshot = tuple(self._ordered)
+            return self._snapshot
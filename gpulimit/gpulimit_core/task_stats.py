@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+
+from collections import namedtuple
+
+
+TaskEstimate = namedtuple('TaskEstimate', ('gpu_mem', 'cpu_mem', 'runtime', 'count'))
+
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(\.\d*)?([eE]-?\d+)?(?![\w.])')
+
+
+def _bucket(match):
+    value = float(match.group(0))
+    if not math.isfinite(value):
+        return match.group(0)
+    if match.group(1) is None and match.group(2) is None:
+        # int: power of 2 bucket, e.g. batch size 100 and 128 are the same
+        return f'<i{(abs(int(value)) - 1).bit_length() if value else 0}>'
+    # float: order of magnitude bucket, e.g. lr 0.001 and 0.005
+    return f'<f{math.floor(math.log10(abs(value))) if value else 0}>'
+
+
+def signature(pwd, cmds):
+    """
+    normalized command signature of a task: `pwd` + `cmds` with numeric
+    args bucketed, so reruns of a script with different flag values share
+    the same history.
+    """
+    cmds = ' '.join([_NUMBER.sub(_bucket, cmd) for cmd in cmds])
+    return hashlib.sha1(f'{pwd}\0{cmds}'.encode('utf8')).hexdigest()[:16]
+
+
+class TaskStats(object):
+    """
+    Peak GPU / host memory (GB) and runtime (seconds) of finished tasks,
+    keyed by `signature`, stored in a json file.
+
+    Each signature keeps the peaks of its last `history` runs, the estimate
+    is the max of them, so a reservation is not smaller than a recent run.
+    When there are more than `maxlen` signatures, the least recently seen
+    ones are dropped.
+
+    `record` schedules a save in a timer thread, at most one every 
+    `save_interval` seconds, so finished tasks are written in batches and
+    nothing is written while no task ends.
+
+    Functions:
+
+        record(task)                 record a finished task
+        estimate(pwd, cmds)          TaskEstimate, or None if never seen
+        load()
+        save()
+
+    """
+    def __init__(self, path=None, history=5, maxlen=10000, save_interval=30):
+        self.path = path
+        self.history = history
+        self.maxlen = maxlen
+        self.save_interval = save_interval
+
+        self.lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # signature -> [count, gpu peaks, cpu peaks, mean runtime, last seen]
+        self._stats = {}
+        self._dirty = False
+        self._last_save = 0
+        self._save_timer = None
+        self.version = 0 # changed when an estimate may change
+
+    def __len__(self):
+        return len(self._stats)
+
+    def record(self, task):
+        if task.peak_gpu_mem is None and task.peak_cpu_mem is None:
+            return # not sampled
+        runtime = task.end_time - task.start_time
+        key = signature(task.pwd, task.cmds)
+        with self.lock:
+            count, gpu_peaks, cpu_peaks, mean_runtime, _ = self._stats.pop(key, (0, [], [], 0, 0))
+            gpu_peaks = (gpu_peaks + [round(task.peak_gpu_mem or 0, 3)])[-self.history:]
+            cpu_peaks = (cpu_peaks + [round(task.peak_cpu_mem or 0, 3)])[-self.history:]
+            mean_runtime = round(mean_runtime + (runtime - mean_runtime) / (count + 1), 1)
+            self._stats[key] = [count + 1, gpu_peaks, cpu_peaks, mean_runtime, int(time.time())]
+            while len(self._stats) > self.maxlen:
+                del self._stats[next(iter(self._stats))]
+            self._dirty = True
+            self.version += 1
+            if self.path is not None and self._save_timer is None:
+                delay = max(0, self._last_save + self.save_interval - time.time())
+                self._save_timer = threading.Timer(delay, self._timer_save)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def estimate(self, pwd, cmds):
+        with self.lock:
+            stats = self._stats.get(signature(pwd, cmds))
+            if stats is None:
+                return None
+            count, gpu_peaks, cpu_peaks, mean_runtime, _ = stats
+            return TaskEstimate(max(gpu_peaks), max(cpu_peaks), mean_runtime, count)
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                stats = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f'[stats]: load {self.path} failed: {e}')
+            return
+        with self.lock:
+            # oldest first, so that dict order is LRU order
+            self._stats = dict(sorted(stats.items(), key=lambda item: item[1][-1]))
+            self.version += 1
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self.lock:
+                data = json.dumps(self._stats, separators=(',', ':'))
+                self._dirty = False
+                self._last_save = time.time()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+
+    def _timer_save(self):
+        with self.lock:
+            self._save_timer = None
+            dirty = self._dirty
+        if dirty: # else saved by `save` meanwhile
+            try:
+                self.save()
+            except OSError as e:
+                logging.warning(f'[stats]: save {self.path} failed: {e}')
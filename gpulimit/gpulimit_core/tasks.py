@@ -7,7 +7,9 @@ import threading
 import logging
 import psutil
 
-from gpulimit.utils import asyn
+from .supervisor import supervisor
+from .task_log import LogWriter, attempt_path, output_capture
+from .events import emit
 
 class Status(int):
     _map = {
@@ -18,15 +20,16 @@ class Status(int):
         'CMD_ERROR': 4,
         'killed': 5,
         'paused': 6,
+        'interrupted': 7,
     }
     
     _int2str = dict([(v, k) for k, v in _map.items()])
     
-    _sort_show = dict(zip(['running', 'waiting', 'runtime_error', 'killed', 
-                           'complete', 'paused', 'CMD_ERROR'], range(7)))
+    _sort_show = dict(zip(['running', 'waiting', 'runtime_error', 'killed', 'interrupted',
+                           'complete', 'paused', 'CMD_ERROR'], range(8)))
     
-    _sort_run = dict(zip(['waiting', 'runtime_error', 'paused', 'killed', 
-                           'complete', 'CMD_ERROR', 'running'], range(7)))
+    _sort_run = dict(zip(['waiting', 'runtime_error', 'paused', 'killed', 'interrupted',
+                           'complete', 'CMD_ERROR', 'running'], range(8)))
     
     def __new__(cls, status):
         if isinstance(status, str):
@@ -61,25 +64,81 @@ STATUS_KILLED = Status('killed')
 STATUS_COMPLETE = Status('complete')
 STATUS_PAUSED = Status('paused')
 STATUS_CMD_ERROR = Status('CMD_ERROR')
+STATUS_INTERRUPTED = Status('interrupted') # server restarted while running
+
+# allowed status transitions of a task, see `Task.transition`
+TRANSITIONS = {
+    STATUS_WAITING: (STATUS_RUNNING,),
+    STATUS_RUNNING: (STATUS_COMPLETE, STATUS_RUNTIME_ERROR, STATUS_CMD_ERROR, 
+                     STATUS_KILLED, STATUS_PAUSED),
+    STATUS_PAUSED: (STATUS_RUNNING, STATUS_COMPLETE, STATUS_RUNTIME_ERROR, STATUS_KILLED),
+    STATUS_RUNTIME_ERROR: (STATUS_RUNNING,),
+    STATUS_KILLED: (STATUS_RUNNING,),
+    STATUS_INTERRUPTED: (STATUS_RUNNING,),
+    STATUS_COMPLETE: (),
+    STATUS_CMD_ERROR: (),
+}
+
+START_STATUS = (STATUS_WAITING, STATUS_RUNTIME_ERROR, STATUS_KILLED, STATUS_INTERRUPTED)
+ALIVE_STATUS = (STATUS_RUNNING, STATUS_PAUSED)
 
 
 class Task(object):
-    def __init__(self, id, pwd, cmds, priority=5, out_path=None, end_callback=None):
+    """
+    A task (command) in queue.
+    
+    `status` is changed only by `transition`, an atomic compare-and-set, so
+    the scheduler thread, server threads and the supervisor thread can not
+    both win a transition, e.g. start a task twice.
+    
+    Each run writes its own output file `log_path` (see `attempt_path`).
+    If `log_max_size` (bytes) > 0, output is read from a pipe by
+    `output_capture` and rotated, else the file is given to the process.
+    """
+    # seconds between SIGTERM and SIGKILL when the task is killed
+    kill_timeout = 5
+    
+    # current time of start / end times, a virtual clock in `Simulator`
+    clock = time.time
+    
+    # output rotation, see `LogWriter`
+    log_max_size = 0
+    log_max_files = 5
+    log_compress = 1
+    
+    _transition_lock = threading.Lock()
+    
+    def __init__(self, id, pwd, cmds, priority=5, out_path=None, end_callback=None, 
+                 gpu_mem=None, cpu_mem=None, gpu_num=1):
         self.id = id
         self.pwd = pwd
         self.cmds = cmds
         self.priority = priority
         self.out_path = out_path
         self.end_callback = end_callback
+        self.start_callback = None # called after the process is started
+        
+        # memory reservation (GB, per GPU), None if unknown
+        self.gpu_mem = gpu_mem
+        self.cpu_mem = cpu_mem
+        self.gpu_num = gpu_num
+        self.mem_estimated = False # gpu_mem / cpu_mem from `TaskStats`
         
-        self.gpu = None
+        # peak memory (GB, GPU is per GPU) of the current run, None if not sampled
+        self.peak_gpu_mem = None
+        self.peak_cpu_mem = None
+        
+        self.gpu = None # list of GPU ids when running
+        self.ready_time = self.clock() # added, or the last run ended
         self.start_time = None
         self.end_time = None
         
         self.run_times = 0
 
         self.out_file = None
+        self.log_writer = None # `LogWriter` of the current run if output is rotated
         self.pkg_process = None
+        self.pgid = None # process group of the task, POSIX only
         self.process = None
         
         self.status = STATUS_WAITING
@@ -93,15 +152,44 @@ class Task(object):
     
     @property
     def pid(self):
-        if self.status == Status('running'):
-            return self.process.pid
+        process = self.process
+        if self.status in ALIVE_STATUS and process is not None:
+            return process.pid
         return None
+    
+    def transition(self, expected, status, **changes):
+        """
+        if `status` of task is in `expected`, change it to `status` and set
+        attributes `changes` atomically, return True. else return False.
+        """
+        with self._transition_lock:
+            if self.status not in expected:
+                return False
+            # processes of the last run are still exiting (killed), `gpu` is
+            # released when all of them exited
+            if status == STATUS_RUNNING and self.status in START_STATUS and self.gpu is not None:
+                return False
+            if status not in TRANSITIONS[self.status]:
+                raise ValueError(f'task {self.id} can not change status from `{self.status}` to `{status}`.')
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.status = status
+            return True
 
+    @property
+    def log_path(self):
+        """
+        output file of the current (or last) run.
+        """
+        if self.out_path is None:
+            return None
+        return attempt_path(self.out_path, max(self.run_times, 1))
+    
     @property
     def running_time(self):
         if self.start_time is None:
             return 0
-        end_time = time.time() if self.end_time is None else self.end_time
+        end_time = self.clock() if self.end_time is None else self.end_time
         return end_time - self.start_time
             
     @staticmethod
@@ -109,93 +197,230 @@ class Task(object):
         if isinstance(inputs, (int, float, str)):
             return str(inputs) 
         if isinstance(inputs, (list, tuple)):
-            return str(inputs)[1: -1]
+            return ','.join([str(i) for i in inputs])
 
-    @asyn
     def _run_task(self, GPU_id):
-        self.start_time = time.time()
-        self.gpu = GPU_id
-        self.end_time = None
-        self.run_times += 1
-        self.status = STATUS_RUNNING
-        
         try:
+            stdout = None
             if self.out_path is not None:
-                self.out_file = open(self.out_path, 'w')
-                self.out_file.write(f'{self.pwd}# {self.cmds}\n')
+                header = f'{self.pwd}# {self.cmds}\n'.encode('utf8')
+                # pipes are not selectable on windows
+                if self.log_max_size > 0 and os.name == 'posix':
+                    self.log_writer = LogWriter(self.log_path, self.log_max_size, self.log_max_files, 
+                                                self.log_compress, output_capture.compressor)
+                    self.log_writer.write(header)
+                    stdout = subprocess.PIPE
+                else:
+                    self.out_file = open(self.log_path, 'wb')
+                    self.out_file.write(header)
+                    self.out_file.flush()
+                    stdout = self.out_file
             env = os.environ.copy()
             env['CUDA_VISIBLE_DEVICES'] = self._change_gpu_id(GPU_id)
-            self.process = subprocess.Popen(self.cmds, stdout=self.out_file, shell=False,
-                                            stderr=subprocess.STDOUT, cwd=self.pwd, env=env)
+            # own process group, so kill can signal the whole process tree
+            if os.name == 'posix':
+                group = {'start_new_session': True}
+            else:
+                group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+            self.process = subprocess.Popen(self.cmds, stdout=stdout, shell=False,
+                                            stderr=subprocess.STDOUT, cwd=self.pwd, env=env, **group)
+            self.pgid = self.process.pid if os.name == 'posix' else None
             
         except Exception as e:
-            self.status = STATUS_CMD_ERROR
-            logging.info(f'[CMD_ERROR({self.id}: GPU:{GPU_id})]: {self.pwd}$ {self.cmds} \nerror:\n{e}')
+            self._close_out_file()
+            if self.log_writer is not None:
+                self.log_writer.close()
+            self.transition((STATUS_RUNNING,), STATUS_CMD_ERROR, gpu=None)
             msg = traceback.format_exc()
-            logging.info(msg)
+            # traceback is kept in `debug_msg`, see `debug [id]`
+            emit('error', f'[CMD_ERROR({self.id}: GPU:{GPU_id})]: {self.pwd}$ {self.cmds} error: {e}', 
+                 id=self.id, error=str(e))
             self.debug_msg = 'cmds: ' + str(self.cmds) + "\n" + msg
             self.end_callback()
             return
         
-        logging.info(f'[starting({self.id}: GPU:{GPU_id})]: {self.pwd}$ {self.cmds}')
-        self.process.wait()
+        if self.log_writer is not None:
+            output_capture.capture(self.process.stdout, self.log_writer)
+        emit('start', f'[starting({self.id}: GPU:{GPU_id})]: {self.pwd}$ {self.cmds}', 
+             id=self.id, gpu=self.gpu, run_times=self.run_times, pid=self.process.pid, 
+             gpu_mem=self.gpu_mem, cpu_mem=self.cpu_mem, 
+             wait=round(self.start_time - self.ready_time, 3))
+        if self.start_callback is not None:
+            self.start_callback()
+        process = self.process
+        supervisor.watch(process, lambda returncode: self._process_end(process, returncode))
         
-        self.end_time = time.time()
-        self.gpu = None
+    def _process_end(self, process, returncode):
+        """
+        called by `supervisor` when the process exits.
         
-        if self.status == STATUS_RUNNING: # status is killed, pass
-            if self.process.poll() == 0:
-                self.status = STATUS_COMPLETE
-            else:
-                self.status = STATUS_RUNTIME_ERROR
+        Processes left in its group (e.g. workers) are terminated, the task
+        ends when all of them exited, so its GPU memory is released.
+        """
+        self._close_out_file()
+        if supervisor.group_alive(self.pgid, reap=True):
+            logging.info(f'[finish({self.id})]: process exited, wait for process group {self.pgid}.')
+            supervisor.terminate(process, self.kill_timeout, self.pgid)
+            supervisor.wait_group(self.pgid, lambda: self._tree_end(returncode), 
+                                  timeout=self.kill_timeout + 5)
+        else:
+            self._tree_end(returncode)
+        
+    def _tree_end(self, returncode):
+        GPU_id = self.gpu
+        # None: attached, exit code unknown
+        status = STATUS_COMPLETE if returncode == 0 or returncode is None else STATUS_RUNTIME_ERROR
+        end_time = self.clock()
+        if not self.transition(ALIVE_STATUS, status, end_time=end_time, ready_time=end_time, gpu=None):
+            # killed
+            with self._transition_lock:
+                self.end_time, self.ready_time, self.gpu = end_time, end_time, None
         
-        logging.info(f'[finish({self.id}: GPU:{GPU_id})]: {self.pwd}$ {self.cmds}')
+        oom = self._oom_reason(returncode) if self.status == STATUS_RUNTIME_ERROR else None
+        if oom is not None:
+            emit('oom', f'[oom({self.id}: GPU:{self._change_gpu_id(GPU_id)})]: {oom} out of memory.', 
+                 id=self.id, gpu=GPU_id, returncode=returncode, reason=oom)
+        emit('finish', f'[finish({self.id}: GPU:{self._change_gpu_id(GPU_id)})]: {self.pwd}$ {self.cmds}', 
+             id=self.id, gpu=GPU_id, status=str(self.status), returncode=returncode, 
+             runtime=round(self.running_time, 3), peak_gpu_mem=self.peak_gpu_mem, 
+             peak_cpu_mem=self.peak_cpu_mem)
         self.end_callback()
+        
+    def _oom_reason(self, returncode, tail_size=16 * 1024):
+        """
+        'host' if the process was killed by SIGKILL (not by `kill`, likely 
+        the OOM killer), 'gpu' if the end of output has an out of memory 
+        error (e.g. `CUDA out of memory`), else None.
+        """
+        if os.name == 'posix' and returncode == -signal.SIGKILL:
+            return 'host'
+        try:
+            with open(self.log_path, 'rb') as f:
+                f.seek(max(0, f.seek(0, os.SEEK_END) - tail_size))
+                tail = f.read().lower()
+        except (OSError, TypeError): # no output file
+            return None
+        if b'out of memory' in tail or b'outofmemoryerror' in tail:
+            return 'gpu'
+        return None
+        
+    def _close_out_file(self):
+        """
+        close the output file given to the process, a `log_writer` is
+        closed by `output_capture` when all output is read.
+        """
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+        
+    @property
+    def output_closed(self):
+        return self.out_file is None and (self.log_writer is None or self.log_writer.closed)
 
     def start(self, GPU_id):
         if self.status == STATUS_PAUSED:
             return self.resume()
-        if self.status in [STATUS_WAITING, STATUS_RUNTIME_ERROR, STATUS_KILLED]:
+        # only one caller can win, the task can not be started twice.
+        if self.transition(START_STATUS, STATUS_RUNNING, start_time=self.clock(), end_time=None, 
+                           gpu=list(GPU_id) if isinstance(GPU_id, (list, tuple)) else [GPU_id],
+                           run_times=self.run_times + 1, process=None, log_writer=None, 
+                           peak_gpu_mem=None, peak_cpu_mem=None):
             self._run_task(GPU_id)
             return 0, f'[info]: start task {self.id} succeed.'
         else:
             return 1, f'[info]: can not start task {self.id} which have status `{self.status}`'
    
-    @asyn
-    def _kill(self):
-        self.process.terminate()
-        time.sleep(5)
-        self.process.kill()
+    def attach(self, process):
+        """
+        wait `process` (`psutil.Process`) of this task, which was started 
+        by a previous server.
+        
+        It is not a child process, its exit code is unknown (None), so the 
+        task is complete when it exits.
+        """
+        emit('attach', f'[attach({self.id}: GPU:{self._change_gpu_id(self.gpu)})]: {self.pwd}$ {self.cmds}', 
+             id=self.id, gpu=self.gpu, pid=process.pid)
+        self.process = process
+        try:
+            self.pgid = process.pid if os.getpgid(process.pid) == process.pid else None
+        except (OSError, AttributeError): # exited, or not POSIX
+            self.pgid = None
+        supervisor.watch(process, lambda returncode: self._process_end(process, returncode))
 
     def kill(self):
-        if self.process is not None and self.status == STATUS_RUNNING:
-            self._kill()
-            self.gpu = None
-            self.status = STATUS_KILLED
-
+        """
+        SIGTERM the process group of task, SIGKILL it if it is still alive 
+        after `kill_timeout` seconds. `gpu` is kept until the processes exit.
+        """
+        process = self.process
+        if process is not None and self.transition(ALIVE_STATUS, STATUS_KILLED):
+            supervisor.terminate(process, self.kill_timeout, self.pgid)
+            emit('kill', f'[kill({self.id}: GPU:{self._change_gpu_id(self.gpu)})]: {self.pwd}$ {self.cmds}', 
+                 id=self.id, gpu=self.gpu, runtime=round(self.running_time, 3))
             return 0, f'[info]: kill task {self.id} succeed.'
         else:
             return 1, f'[warning]: can not kill task {self.id} which have status `{self.status}`'
 
     def pause(self):
-        if self.pid is not None:
-            if self.status != STATUS_PAUSED:
-                psutil.Process(self.pid).suspend()
-                self.status = STATUS_PAUSED
+        pid = self.pid
+        if pid is not None:
+            if self.transition((STATUS_RUNNING,), STATUS_PAUSED):
+                psutil.Process(pid).suspend()
+                emit('pause', f'[pause({self.id})]', id=self.id)
                 return 0, f'[Info]: task {self.id} paused.'
             return 1, f'[Warning]: task {self.id} have been paused before.'
         return 1, f'[Error]: task {self.id} not running.'
     
     def resume(self):
-        if self.pid is not None:
-            if self.status == STATUS_PAUSED:
-                psutil.Process(self.pid).resume()
-                self.status = STATUS_RUNNING
+        pid = self.pid
+        if pid is not None:
+            if self.transition((STATUS_PAUSED,), STATUS_RUNNING):
+                psutil.Process(pid).resume()
+                emit('resume', f'[resume({self.id})]', id=self.id)
                 return 0, f'[Info]: task {self.id} resume.'
             return 1, f'[Warning]: task {self.id} is running.'
         return 1, f'[Error]: task {self.id} not running.'
 
 
+class ArchivedTask(object):
+    """
+    Compact record of a finished task, kept in `TaskArchive` instead of the
+    `Task` object (no process, file or callback references).
+    
+    It has the same attributes as `Task` used by `ls`, `show`, `log` and
+    `debug`.
+    """
+    __slots__ = ('id', 'pwd', 'cmds', 'priority', 'out_path', 'status', 
+                 'run_times', 'start_time', 'end_time', 'debug_msg', 
+                 'gpu_mem', 'cpu_mem', 'gpu_num', 'mem_estimated', 
+                 'peak_gpu_mem', 'peak_cpu_mem')
+    
+    pid = None
+    gpu = None
+    output_closed = True
+    
+    log_path = Task.log_path
+    
+    def __init__(self, task):
+        for name in self.__slots__:
+            setattr(self, name, getattr(task, name))
+            
+    def __repr__(self):
+        return f'[ArchivedTask:({self.status})] {self.pwd}# {" ".join(self.cmds)}'
+    
+    @property
+    def running_time(self):
+        if self.start_time is None or self.end_time is None:
+            return 0
+        return self.end_time - self.start_time
+    
+    def start(self, GPU_id):
+        return 1, f'[info]: can not start task {self.id} which have status `{self.status}`'
+    
+    def kill(self):
+        return 1, f'[warning]: can not kill task {self.id} which have status `{self.status}`'
+
+
 if __name__ == '__main__':
     a = Task(0, './', ['sleep', '45'])
     
\ No newline at end of file
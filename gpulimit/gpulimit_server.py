@@ -2,15 +2,25 @@
 import os, sys, inspect
 import time
 import socket
+import logging
+import argparse
+import selectors
+import threading
 import traceback
 
-import pickle as pk
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) 
 sys.path.insert(0, parentdir) 
 
-from gpulimit.gpulimit_core import recv_all, send_all_str
+from gpulimit.gpulimit_core import recv_all
+from gpulimit.gpulimit_core.socket_utils import MessageTooLarge
 from gpulimit.gpulimit_core import task_manage
+from gpulimit.gpulimit_core import protocol
+from gpulimit.gpulimit_core.log_stream import LogStream, log_streamer
+from gpulimit.gpulimit_core import metrics
+from gpulimit.gpulimit_core.policies import policies, get_policy
 
 
 """
@@ -33,8 +43,37 @@ class Server(object):
     for each client requests, solve the requests and return a response,
     which is like Http protocol.
     
+    Requests are handled by a pool of `workers` threads, so a slow client 
+    does not block others. Connections waiting for their next request are
+    watched by the main thread (`selectors`), a worker is only taken while
+    a request is processed, so idle persistent connections (e.g. 
+    `GpulimitClient`) do not block other clients. `timeout` (seconds) is 
+    the socket timeout of each request, an idle persistent connection is 
+    closed after it.
+    
+    Streaming responses (`log --tail`, `log --follow`) are handed over to
+    `log_streamer` with the connection, so following a log does not keep a
+    worker thread.
+    
+    Requests bigger than `max_request_size` bytes (e.g. a huge `add-batch`)
+    are rejected before they are read.
+    
+    If `metrics_port` is set, metrics (see `gpulimit_core.metrics`) are
+    served at `http://metrics_host:metrics_port/metrics` for Prometheus.
+    
     """
-    def __init__(self):
+    DETACHED = 'detached'
+    
+    def __init__(self, workers=16, backlog=128, timeout=30, metrics_host='127.0.0.1', metrics_port=None, 
+                 policy=None, max_request_size=256 * 1024 * 1024):
+        self.workers = workers
+        self.max_request_size = max_request_size
+        self.backlog = backlog
+        self.timeout = timeout
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        
+
         if sys.platform == 'linux':
             server_address = '/tmp/gpulimit_uds_socket'
             try:
@@ -54,6 +93,8 @@ class Server(object):
         if not os.path.exists(logdir):
             os.makedirs(logdir)
             
+        if policy is not None:
+            self.task_manage.set_scheduling(get_policy(policy))
         self.task_manage.start(logdir=logdir)
         
         self.func_map = {
@@ -63,6 +104,7 @@ class Server(object):
             'help': self._help, 
             
             'add': self.task_manage.add,
+            'add-batch': self.task_manage.add_batch,
             
         }
         # add self.task_manage.func_map
@@ -78,12 +120,132 @@ class Server(object):
         else:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.bind(self.server_address)
-        sock.listen(5)
+        sock.listen(self.backlog)
         print('start gpulimit server.')
         print(f'listening at {self.server_address}')
-        while True:
-            connection, client_address = sock.accept()
-            self._process(connection)
+        if self.metrics_port:
+            self._start_metrics_server()
+        
+        sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(sock, selectors.EVENT_READ, 'accept')
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, 'wake')
+        self._returned = [] # connections kept alive by workers
+        self._returned_lock = threading.Lock()
+        
+        idle = {} # connection -> time of its last request
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                timeout = None
+                if idle:
+                    timeout = max(0, min(idle.values()) + self.timeout - time.time())
+                for key, mask in self._selector.select(timeout):
+                    if key.data == 'accept':
+                        try:
+                            connection, client_address = sock.accept()
+                        except (BlockingIOError, InterruptedError):
+                            continue
+                        connection.settimeout(self.timeout)
+                        self._selector.register(connection, selectors.EVENT_READ)
+                        idle[connection] = time.time()
+                    elif key.data == 'wake':
+                        try:
+                            while self._wake_r.recv(4096):
+                                pass
+                        except (BlockingIOError, InterruptedError):
+                            pass
+                        with self._returned_lock:
+                            returned, self._returned = self._returned, []
+                        for connection in returned:
+                            self._selector.register(connection, selectors.EVENT_READ)
+                            idle[connection] = time.time()
+                    else:
+                        # next request (or closed by client), in a worker
+                        self._selector.unregister(key.fileobj)
+                        del idle[key.fileobj]
+                        pool.submit(self._serve, key.fileobj)
+                        
+                now = time.time()
+                for connection in [c for c, last in idle.items() if now - last >= self.timeout]:
+                    self._selector.unregister(connection)
+                    del idle[connection]
+                    connection.close()
+                    
+    def _keep(self, connection):
+        """
+        hand a kept alive connection back to the main thread.
+        """
+        with self._returned_lock:
+            self._returned.append(connection)
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            pass # already woken
+                
+
+    def _start_metrics_server(self):
+        """
+        serve `GET /metrics` in a background thread.
+        """
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.registry.render().encode('utf8')
+                self.send_response(200)
+                self.send_header('Content-Type', metrics.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                
+            def log_message(self, format, *args):
+                pass # scraped every few seconds, don't fill the log
+                
+        httpd = ThreadingHTTPServer((self.metrics_host, self.metrics_port), MetricsHandler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f'metrics at http://{self.metrics_host}:{self.metrics_port}/metrics')
+        
+    def _readable(self, connection):
+        """
+        a request (or EOF) is waiting on `connection`, without waiting. 
+        
+        `select.select` fails on fds >= 1024, the server may have many open
+        (task pidfds and logs, streams, persistent connections).
+        """
+        connection.setblocking(False)
+        try:
+            connection.recv(1, socket.MSG_PEEK)
+            return True
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError: # reset by client, `_process` closes it
+            return True
+        finally:
+            connection.settimeout(self.timeout)
+        
+    def _serve(self, connection):
+        """
+        handle the requests of a connection in worker thread, until no 
+        request is waiting (pipelined requests are handled at once).
+        """
+        keep_alive = False
+        try:
+            keep_alive = self._process(connection)
+            while keep_alive is True and self._readable(connection):
+                keep_alive = self._process(connection)
+        except (ConnectionError, socket.timeout):
+            # client closed, or stopped sending for `timeout`
+            keep_alive = False
+        except Exception:
+            logging.warning(f'[server]: request failed.\n{traceback.format_exc()}')
+            keep_alive = False
+        if keep_alive is True:
+            self._keep(connection)
+        elif keep_alive != self.DETACHED: # else closed by `log_streamer`
             connection.close()
             
     def _process(self, sock):
@@ -96,19 +258,55 @@ class Server(object):
         
         And if any error were raised, we capture the traceback and return to 
         the client, which ensure that the server can not break incorrectly.
+        
+        Messages are described in `gpulimit_core.protocol`, commands return
+        `(code, msg)` or `(code, msg, data)`.
+        
+        Return True if the connection is kept, `DETACHED` if it is handed
+        over to `log_streamer`.
         """
-        msgs = recv_all(sock)
-        pwd, cmds = pk.loads(msgs)
+        try:
+            msgs = recv_all(sock, max_size=self.max_request_size)
+        except MessageTooLarge as e:
+            logging.warning(f'[server]: reject request: {e}')
+            try:
+                protocol.send_message(sock, protocol.make_response(
+                        None, protocol.CODE_BAD_REQUEST, f'[error]: {e}'))
+            except OSError: # client is still sending
+                pass
+            return False
+        start = time.time()
+        request_id = None
+        try:
+            request = protocol.decode(msgs)
+            request_id = request.get('id')
+            request_id, pwd, cmds = protocol.check_request(request)
+        except protocol.ProtocolError as e:
+            protocol.send_message(sock, protocol.make_response(
+                    request_id, protocol.CODE_BAD_REQUEST, f'[error]: {e}'))
+            return False
         
         try:
             if cmds[0] == 'add':
-                msg = self._create_task(pwd, cmds)
+                result = self._create_task(pwd, cmds)
+            elif cmds[0] == 'add-batch':
+                result = self._create_tasks(pwd, cmds)
             else:
-                msg = self._process_commands(pwd, cmds)
+                result = self._process_commands(pwd, cmds)
+            code, msg = result[:2]
+            data = result[2] if len(result) > 2 else None
         except Exception:
-            msg = traceback.format_exc()
-            
-        send_all_str(sock, msg)  
+            code, msg, data = protocol.CODE_SERVER_ERROR, traceback.format_exc(), None
+        
+        # only known commands, the label values are bounded
+        command = cmds[0] if cmds[0] in self.func_map else 'unknown'
+        if isinstance(data, LogStream):
+            log_streamer.add(sock, request_id, data)
+            metrics.request_duration.observe(time.time() - start, command=command)
+            return self.DETACHED
+        protocol.send_message(sock, protocol.make_response(request_id, code, msg, data))
+        metrics.request_duration.observe(time.time() - start, command=command)
+        return request_id is not None
         
     @staticmethod
     def _get_args(cmds, get_all=True):
@@ -133,9 +331,9 @@ class Server(object):
                 cmd = cmd.lstrip('--')
                 splits = cmd.split('=')
                 if len(splits) == 1:
-                    kwargs[cmd] = True
+                    kwargs[cmd.replace('-', '_')] = True
                     continue
-                key = splits[0]
+                key = splits[0].replace('-', '_') # `--gpu-mem` -> `gpu_mem`
                 value = '='.join(splits[1:])
                 kwargs[key] = value
             else:
@@ -183,7 +381,7 @@ class Server(object):
                 break
         cmds = cmds[i + 1:]
         if len(cmds) == 0:
-            return f'[Error]: you input args {kwargs}, but no cmd input.'
+            return 1, f'[Error]: you input args {kwargs}, but no cmd input.'
         
         err_msg = ''
         for arg in args:
@@ -191,10 +389,22 @@ class Server(object):
         for kwarg in kwargs:
             if kwarg not in inspect.getfullargspec(self.task_manage.add).kwonlyargs:
                 err_msg += f'[Error]: add not support kwargs {kwarg}'
-        if err_msg: return err_msg
+        if err_msg: return 1, err_msg
+        
+        return self.task_manage.add(pwd, cmds, **kwargs)
+        
+    def _create_tasks(self, pwd, cmds):
+        """
+        When user's command is `add-batch`, create tasks from `--lines`.
+        
+        """
+        args, kwargs = self._get_args(cmds[1:])
+        err_msg = self._check_input(self.task_manage.add_batch, [pwd] + args, kwargs)
+        if err_msg: return 1, err_msg
+        if 'lines' not in kwargs:
+            return 1, '[Error]: no task lines input.'
         
-        _, result = self.task_manage.add(pwd, cmds, **kwargs)
-        return result
+        return self.task_manage.add_batch(pwd, *args, **kwargs)
         
     def _process_commands(self, pwd, cmds):
         """
@@ -206,13 +416,12 @@ class Server(object):
             
             args, kwargs = self._get_args(cmds[1:])         
             err_msg = self._check_input(func, args, kwargs)
-            if err_msg: return err_msg
+            if err_msg: return 1, err_msg
             
-            _, return_msg = func(*args, **kwargs)
+            return func(*args, **kwargs)
 
         else:
-            return_msg = '[error]: no cmd found.'
-        return return_msg
+            return 1, '[error]: no cmd found.'
         
     def _help(self, cmd=None):
         '''
@@ -251,7 +460,28 @@ GPU Task Manage:
     
 
 def main():
-    server = Server()
+    parser = argparse.ArgumentParser(description='gpulimit server')
+    parser.add_argument('--workers', type=int, default=16, 
+                        help='number of threads handling requests.')
+    parser.add_argument('--backlog', type=int, default=128, 
+                        help='listen backlog of the server socket.')
+    parser.add_argument('--timeout', type=float, default=30, 
+                        help='socket timeout (seconds) of each request.')
+    parser.add_argument('--metrics-port', type=int, default=None, 
+                        help='serve OpenMetrics at http://[metrics-host]:[metrics-port]/metrics.')
+    parser.add_argument('--metrics-host', default='127.0.0.1', 
+                        help='address of the metrics endpoint.')
+    parser.add_argument('--max-request-size', type=float, default=256, 
+                        help='max size (MB) of a request, e.g. an `add-batch` file.')
+    parser.add_argument('--policy', default=None, 
+                        help='scheduling policy (see `gpulimit policy`), default `base`.')
+    args = parser.parse_args()
+    if args.policy is not None and args.policy not in policies():
+        parser.error(f'policy `{args.policy}` not found, use one of {list(policies())}.')
+    
+    server = Server(workers=args.workers, backlog=args.backlog, timeout=args.timeout, 
+                    metrics_host=args.metrics_host, metrics_port=args.metrics_port, 
+                    policy=args.policy, max_request_size=int(args.max_request_size * 1024 * 1024))
     server.start()
     
 
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import json
+import argparse
+import importlib
+
+from gpulimit.utils import prettytable as pt
+from gpulimit.utils import time_span
+from gpulimit.gpulimit_core.simulator import Simulator, load_trace, save_trace, synthetic_trace
+from gpulimit.gpulimit_core.policies import policies, get_policy, DEFAULT_POLICY
+
+
+def load_scheduling(name):
+    """
+    scheduling object of policy `name` (see `gpulimit policy`), or of 
+    class `module:Class`, e.g. `gpulimit.gpulimit_core.scheduling:BaseScheduling`.
+    """
+    scheduling = get_policy(name)
+    if scheduling is not None:
+        return scheduling
+    module, _, cls = name.rpartition(':')
+    if not module:
+        raise SystemExit(f'[error]: policy `{name}` not found, use one of {list(policies())} '
+                         f'or `module:Class`.')
+    return getattr(importlib.import_module(module), cls)()
+
+
+def parse_params(items):
+    params = {}
+    for item in items:
+        k, _, v = item.partition('=')
+        try:
+            params[k] = json.loads(v)
+        except ValueError:
+            params[k] = v
+    return params
+
+
+def _hours(seconds):
+    return f'{seconds / 3600:.2f}h'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='gpulimit scheduling simulator')
+    parser.add_argument('--trace', default=None, 
+                        help='trace file (json lines of tasks, or events.jsonl of a server).')
+    parser.add_argument('--synthetic', type=int, default=200, 
+                        help='number of tasks of a synthetic trace, if `--trace` is not given.')
+    parser.add_argument('--seed', type=int, default=0, 
+                        help='random seed of the synthetic trace.')
+    parser.add_argument('--interval', type=time_span, default=600, 
+                        help='mean time between submits of the synthetic trace, e.g. `10m`.')
+    parser.add_argument('--save-trace', default=None, 
+                        help='write the trace to a json lines file.')
+    parser.add_argument('--gpus', type=int, default=4, 
+                        help='number of GPUs.')
+    parser.add_argument('--gpu-memory', type=float, default=24, 
+                        help='memory (GB) of each GPU.')
+    parser.add_argument('--host-memory', type=float, default=256, 
+                        help='host memory (GB).')
+    parser.add_argument('--policy', action='append', default=None, 
+                        help='scheduling policy (see `gpulimit policy`) or class `module:Class` '
+                             'to compare, can be given more than once, default `base`.')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', 
+                        help='set param (see `gpulimit set`), e.g. `--set MAX_ERR_TIMES=3`.')
+    parser.add_argument('--max-time', type=time_span, default=None, 
+                        help='stop after this virtual time, e.g. `7d`.')
+    args = parser.parse_args()
+    
+    if args.trace is not None:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.synthetic, args.gpu_memory, args.seed, args.interval)
+    if args.save_trace is not None:
+        save_trace(trace, args.save_trace)
+    params = parse_params(args.set)
+    
+    table = pt.PrettyTable(['policy', 'tasks', 'complete', 'failed', 'unfinished', 'oom', 
+                            'makespan', 'GPU idle', 'mean wait', 'p95 wait', 'passes', 'pass time'])
+    for name in args.policy or [DEFAULT_POLICY]:
+        simulator = Simulator(load_scheduling(name), args.gpus, args.gpu_memory, args.host_memory, params)
+        report = simulator.run(trace, args.max_time)
+        table.add_row([name, report.tasks, report.complete, report.failed, report.unfinished, 
+                       report.oom, _hours(report.makespan), f'{report.gpu_idle_hours:.1f}h', 
+                       _hours(report.mean_wait), _hours(report.p95_wait), report.passes, 
+                       f'{report.pass_time / max(report.passes, 1) * 1000:.2f}ms'])
+    print(table)
+    
+
+if __name__=='__main__':
+    main()
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
 
-from .check import check_input
+from .check import check_input, check_ids, memory_size, time_span
 from .prettytable import PrettyTable
 from .asyn import asyn
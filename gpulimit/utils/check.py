@@ -22,3 +22,79 @@ def check_input(input_types, extra_args=(), extra_kwargs={}):
             
     return result_input, err_msg
 
+
+def check_ids(value):
+    '''
+    Parse task ids, return a list of (start, end) ranges (end included).
+    
+    Example:
+        
+        '3'        ->  [(3, 3)]
+        '3-40'     ->  [(3, 40)]
+        '1,5,9'    ->  [(1, 1), (5, 5), (9, 9)]
+        '1,3-5'    ->  [(1, 1), (3, 5)]
+    '''
+    id_ranges = []
+    for item in str(value).split(','):
+        try:
+            if '-' in item:
+                start, end = item.split('-', 1)
+                start, end = int(start), int(end)
+            else:
+                start = end = int(item)
+        except ValueError:
+            return [], f'[error]: input {value} is not task id(s), use `1`, `1,5,9` or `3-40`.\n'
+        if start > end:
+            return [], f'[error]: input {value} is not task id(s), range {item} is empty.\n'
+        id_ranges.append((start, end))
+    return id_ranges, ''
+
+
+def memory_size(value):
+    '''
+    Parse memory size to GB, `None` stays `None`.
+    
+    Example:
+        
+        '6G', '6GB', '6'  ->  6.0
+        '512M'            ->  0.5
+        '1T'              ->  1024.0
+    '''
+    if value is None:
+        return None
+    units = {'K': 1 / 1024 / 1024, 'M': 1 / 1024, 'G': 1, 'T': 1024}
+    value = str(value).strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    unit = 1
+    if value and value[-1] in units:
+        unit = units[value[-1]]
+        value = value[:-1]
+    size = float(value) * unit
+    if size < 0:
+        raise ValueError(f'memory size {value} < 0')
+    return size
+
+
+def time_span(value):
+    '''
+    Parse time span to seconds, `None` stays `None`.
+    
+    Example:
+        
+        '30', '30s'       ->  30.0
+        '10m'             ->  600.0
+        '2h', '1d'        ->  7200.0, 86400.0
+    '''
+    if value is None:
+        return None
+    units = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400}
+    value = str(value).strip().upper()
+    unit = 1
+    if value and value[-1] in units:
+        unit = units[value[-1]]
+        value = value[:-1]
+    span = float(value) * unit
+    if span < 0:
+        raise ValueError(f'time span {value} < 0')
+    return span
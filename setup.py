@@ -36,6 +36,7 @@ setup(
        'gpulimit-server = gpulimit.gpulimit_server:main',
        'gpulimit = gpulimit.gpulimit_client:main',
        'gpulimitc = gpulimit.gpulimit_client:main',
+       'gpulimit-sim = gpulimit.gpulimit_simulator:main',
     ]},
 
     zip_safe=False
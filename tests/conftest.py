@@ -0,0 +1,54 @@
+from collections import namedtuple
+
+import pytest
+
+from gpulimit.gpulimit_core.system_info import System
+
+
+_Memory = namedtuple('_Memory', ('total', 'free', 'used'))
+_HostMemory = namedtuple('_HostMemory', ('total', 'available', 'used'))
+
+
+class FakeBackend(object):
+    """
+    `System` backend of a machine with idle GPUs and no NVML.
+    """
+    def __init__(self, gpus=4, gpu_memory=24, host_memory=256):
+        self.gpus = gpus
+        self.gpu_memory = gpu_memory * 1024 ** 3
+        self.host_memory_size = host_memory * 1024 ** 3
+
+    def gpu_nums(self):
+        return self.gpus
+
+    def memory_info(self, id):
+        return _Memory(self.gpu_memory, self.gpu_memory, 0)
+
+    def utilization(self, id):
+        return None
+
+    def processes(self, id):
+        return []
+
+    def host_memory(self):
+        return _HostMemory(self.host_memory_size, self.host_memory_size, 0)
+
+    def cpu_utilization(self):
+        return 0
+
+    def topology(self):
+        return None
+
+
+@pytest.fixture
+def restore_system():
+    sampler, max_staleness = System.sampler, System.max_staleness
+    yield
+    System.sampler, System.max_staleness = sampler, max_staleness
+
+
+@pytest.fixture
+def fake_system(restore_system):
+    backend = FakeBackend()
+    System.set_backend(backend)
+    return backend
@@ -0,0 +1,53 @@
+import types
+
+import pytest
+
+from gpulimit.gpulimit_core.supervisor import supervisor
+from gpulimit.gpulimit_core.run_task_core import task_manage, show, kill
+from gpulimit.gpulimit_core.tasks import STATUS_RUNNING, STATUS_PAUSED, STATUS_KILLED, STATUS_WAITING
+
+
+@pytest.fixture
+def new_task():
+    tasks = []
+
+    def new_task(**kwargs):
+        with task_manage.lock:
+            task = task_manage._new_task(task_manage._id_give, '/tmp', ['sleep', '1'], 5, None, **kwargs)
+            task_manage._id_give += 1
+            task_manage.add_task(task)
+        tasks.append(task)
+        return task
+    yield new_task
+    task_manage.rm_tasks([task.id for task in tasks])
+
+
+def test_show_reserve_memory(new_task):
+    code, msg = show(str(new_task().id))
+    assert code == 0
+    assert 'GPU: -, CPU: -' in msg
+    assert 'NoneG' not in msg
+
+    code, msg = show(str(new_task(gpu_mem=6, cpu_mem=None).id))
+    assert 'GPU: 6G, CPU: -' in msg
+
+    task = new_task(gpu_mem=4.4, cpu_mem=2.2)
+    task.mem_estimated = True
+    code, msg = show(str(task.id))
+    assert 'GPU: 4.4G, CPU: 2.2G (estimated)' in msg
+
+
+def test_kill_all_paused(new_task, monkeypatch):
+    terminated = []
+    monkeypatch.setattr(supervisor, 'terminate', lambda process, *args: terminated.append(process.pid))
+    tasks = [new_task() for _ in range(3)]
+    for task, status in zip(tasks, (STATUS_RUNNING, STATUS_PAUSED)):
+        task.process = types.SimpleNamespace(pid=100000 + task.id)
+        task.status = status
+
+    code, msg = kill('all')
+    assert code == 0
+    assert terminated == [100000 + task.id for task in tasks[:2]]
+    assert [task.status for task in tasks] == [STATUS_KILLED, STATUS_KILLED, STATUS_WAITING]
+    for task in tasks[:2]:
+        task.process = None
@@ -0,0 +1,158 @@
+import random
+import threading
+import time
+
+import pytest
+
+from gpulimit.gpulimit_core import run_task_core, supervisor
+from gpulimit.gpulimit_core.run_task_core import TaskManage
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+from gpulimit.gpulimit_core.tasks import Task, TRANSITIONS, START_STATUS, STATUS_RUNNING, STATUS_PAUSED
+
+
+class _Process(object):
+    def __init__(self, pid):
+        self.pid = pid
+
+
+class RecordTask(Task):
+    """
+    A task which records its status changes, and runs no process: a run
+    ends when `Runs.end` calls `_tree_end`, as the supervisor does.
+    """
+    runs = None
+
+    @property
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        # set under `_transition_lock` by `transition`
+        old = getattr(self, '_status', None)
+        if old is not None:
+            self.runs.changes.append((self.id, old, status))
+        self._status = status
+
+    def _run_task(self, GPU_id):
+        self.process = _Process(100000 + self.id)
+        self.runs.start(self)
+
+
+class Runs(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alive = {} # task id -> task
+        self.starts = 0
+        self.errors = []
+        self.changes = []
+
+    def start(self, task):
+        with self.lock:
+            if task.id in self.alive:
+                self.errors.append(f'task {task.id} started twice.')
+            self.alive[task.id] = task
+            self.starts += 1
+
+    def end(self):
+        with self.lock:
+            if not self.alive:
+                return
+            task = self.alive.pop(random.choice(list(self.alive)))
+        task._tree_end(random.choice((0, 1)))
+
+
+@pytest.fixture
+def task_manage(fake_system, tmp_path, monkeypatch):
+    runs = Runs()
+    monkeypatch.setattr(RecordTask, 'runs', runs)
+    # killed runs end in `Runs.end`
+    monkeypatch.setattr(supervisor.supervisor, 'terminate', lambda *args, **kwargs: None)
+    task_manage = TaskManage(BaseScheduling())
+    task_manage.task_class = RecordTask
+    task_manage.logdir = str(tmp_path)
+    task_manage.set_param('MAX_ERR_TIMES', 1000)
+    task_manage.set_param('START_SETTLE_TIME', 0)
+    task_manage.set_param('SAFETY_KEEP_GPU_MEMORY', 0)
+    # `ls` and `status` read the snapshots of this task manage
+    monkeypatch.setattr(run_task_core, 'task_manage', task_manage)
+    task_manage.runs = runs
+    return task_manage
+
+
+def test_transition_race(task_manage):
+    runs = task_manage.runs
+    stop = threading.Event()
+    errors = []
+
+    def loop(func):
+        def run():
+            rng = random.Random()
+            try:
+                while not stop.is_set():
+                    func(rng)
+            except Exception as e:
+                errors.append(repr(e))
+                stop.set()
+        return threading.Thread(target=run)
+
+    def schedule(rng):
+        task_manage.scheduling.timer_call(task_manage)
+
+    def add(rng):
+        if len(task_manage) < 64:
+            task_manage.add('/tmp', ['task', str(rng.random())])
+
+    def pick(rng):
+        tasks = task_manage.tasks
+        return rng.choice(tasks) if tasks else None
+
+    def kill(rng):
+        task = pick(rng)
+        if task is not None:
+            with task_manage.lock:
+                task.kill()
+
+    def start(rng):
+        # `start [id]`, does not take the lock
+        task = pick(rng)
+        if task is not None:
+            task_manage.scheduling.user_start_scheduling(task_manage, task.id)
+
+    def remove(rng):
+        task = pick(rng)
+        if task is not None:
+            task_manage.rm_tasks([task.id])
+
+    def end(rng):
+        runs.end()
+        time.sleep(0.0001)
+
+    def snapshot(rng):
+        # lock-free reads, see `TaskQueue.snapshot`
+        # each snapshot is consistent, a task may end between the two
+        for tasks in (task_manage.tasks, task_manage.archived_tasks):
+            ids = [task.id for task in tasks]
+            assert len(ids) == len(set(ids)), 'task in snapshot twice'
+        assert run_task_core.ls(all=True)[0] == 0
+        assert run_task_core.ls(rows=True)[0] == 0
+        assert run_task_core.status()[0] == 0
+
+    threads = [loop(func) for func in (schedule, schedule, add, add, kill, start, remove, end, end,
+                                       snapshot)]
+    for thread in threads:
+        thread.start()
+    time.sleep(2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert not runs.errors
+    assert runs.starts > 100
+    for id, old, status in runs.changes:
+        assert status in TRANSITIONS[old], f'task {id}: {old} -> {status}'
+    # each run is started by exactly one transition
+    starts = [change for change in runs.changes if change[2] == STATUS_RUNNING and change[1] in START_STATUS]
+    assert len(starts) == runs.starts
+    assert not any(change[1] == STATUS_PAUSED for change in runs.changes)
@@ -0,0 +1,35 @@
+import pytest
+
+from gpulimit.gpulimit_core.simulator import Simulator, TraceTask
+from gpulimit.gpulimit_core.policies import FifoBackfillScheduling
+from gpulimit.gpulimit_core.tasks import STATUS_RUNNING, STATUS_WAITING
+
+
+@pytest.mark.parametrize('known', [False, True])
+def test_backfill_reserved_gpus(restore_system, known):
+    scheduling = FifoBackfillScheduling()
+    simulator = Simulator(scheduling, gpus=2, gpu_memory=24)
+    simulator._setup()
+    task_manage = simulator.task_manage
+    runtimes = {}
+    scheduling.expected_runtime = lambda task_manage, task: runtimes.get(task.id)
+
+    # task 0 holds GPU 0, task 1 needs both GPUs and reserves them
+    simulator._submit(TraceTask(submit=0, duration=3600, gpu_mem=15, request_gpu_mem=15))
+    assert scheduling.timer_call(task_manage)
+    simulator._submit(TraceTask(submit=0, duration=600, gpu_mem=10, request_gpu_mem=10, gpus=2))
+    # task 2 is short, and fits on GPU 1
+    simulator._submit(TraceTask(submit=0, duration=60, gpu_mem=5, request_gpu_mem=5))
+    runtimes[2] = 60
+    if known:
+        runtimes[0] = 3600
+    scheduling.timer_call(task_manage)
+
+    first, wide, short = task_manage.tasks
+    assert wide.status == STATUS_WAITING
+    if known:
+        # ends before task 0, does not delay the wide task
+        assert short.status == STATUS_RUNNING
+    else:
+        # task 0 may end any time, the reserved GPUs are kept free
+        assert short.status == STATUS_WAITING
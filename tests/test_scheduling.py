@@ -0,0 +1,93 @@
+import pytest
+
+from gpulimit.gpulimit_core.system_info import System, GPUInfo
+from gpulimit.gpulimit_core.simulator import Simulator, TraceTask
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+from gpulimit.gpulimit_core.tasks import Task, STATUS_RUNNING, STATUS_WAITING
+
+
+@pytest.fixture
+def simulator(restore_system):
+    simulator = Simulator(BaseScheduling(), gpus=1, gpu_memory=24)
+    simulator._setup()
+    return simulator
+
+
+def add_tasks(simulator, n):
+    for i in range(n):
+        simulator._submit(TraceTask(submit=0, duration=60))
+    return simulator.task_manage.tasks
+
+
+def test_failed_start_keeps_gpu(simulator):
+    task_manage = simulator.task_manage
+    first, second = add_tasks(simulator, 2)
+    # e.g. started by `start [id]` between placement and start
+    first.start = lambda gpu_ids: (1, f'[info]: can not start task {first.id}')
+
+    assert task_manage.scheduling.timer_call(task_manage)
+    assert first.status == STATUS_WAITING
+    assert second.status == STATUS_RUNNING and second.gpu == [0]
+    assert task_manage.queue.pop_runnable() is first
+
+
+@pytest.mark.parametrize('hidden', [False, True])
+def test_reservation_not_counted_twice(simulator, hidden):
+    task_manage = simulator.task_manage
+    backend = System.sampler.backend
+    if hidden:
+        # NVML reports PIDs of another namespace, e.g. the server runs in a container
+        processes = backend.processes
+        backend.processes = lambda id: [process._replace(pid=process.pid + 10 ** 8)
+                                        for process in processes(id)]
+    for _ in range(2):
+        simulator._submit(TraceTask(submit=0, duration=600, gpu_mem=10, request_gpu_mem=10))
+    assert task_manage.scheduling.timer_call(task_manage)
+    simulator._sample()
+
+    # 4G free and allocated by the running tasks
+    simulator._submit(TraceTask(submit=0, duration=600, gpu_mem=3, request_gpu_mem=3))
+    assert task_manage.scheduling.timer_call(task_manage)
+    assert len(simulator.running) == 3
+
+
+def test_place_best_fit():
+    scheduling = BaseScheduling()
+    gpus = [GPUInfo(id, 24, free, 24 - free, None) for id, free in enumerate([20, 9, 12, 24])]
+    gpu_free = [gpu.free for gpu in gpus]
+    place = lambda task, gpu_ids=range(4): scheduling.place(task, gpus, gpu_free, list(gpu_ids))
+
+    # the GPU with the least memory left
+    assert place(Task(0, '/tmp', ['task'], gpu_mem=8)) == [1]
+    assert place(Task(0, '/tmp', ['task'], gpu_mem=10)) == [2]
+    assert place(Task(0, '/tmp', ['task'], gpu_mem=10), [0, 3]) == [0]
+    assert place(Task(0, '/tmp', ['task'], gpu_mem=30)) is None
+    # without reservation, the GPU with the most free memory, if enough is free
+    assert place(Task(0, '/tmp', ['task'])) == [3]
+    assert place(Task(0, '/tmp', ['task']), [1, 2]) is None
+    assert place(Task(0, '/tmp', ['task'], gpu_num=2, gpu_mem=10)) == [2, 0]
+
+
+def test_place_topology():
+    scheduling = BaseScheduling()
+    gpus = [GPUInfo(id, 24, 24, 0, None) for id in range(4)]
+    # GPUs 0, 2 and 1, 3 share a switch
+    topology = [[0 if i == j else 10 if i % 2 == j % 2 else 20 for j in range(4)] for i in range(4)]
+    task = Task(0, '/tmp', ['task'], gpu_num=2, gpu_mem=10)
+    assert scheduling.place(task, gpus, [24, 24, 24, 24], [0, 1, 2, 3], topology) == [0, 2]
+    assert scheduling.place(task, gpus, [24, 15, 24, 15], [0, 1, 2, 3], topology) == [1, 3]
+    assert scheduling.place(task, gpus, [24, 15, 24, 15], [0, 1, 3], topology) == [1, 3]
+
+
+def test_best_fit_decreasing(restore_system):
+    # placed in queue order, the small task takes the room of a 12G task and
+    # only 3 tasks fit, biggest first all 4 fit
+    simulator = Simulator(BaseScheduling(), gpus=2, gpu_memory=24)
+    simulator._setup()
+    task_manage = simulator.task_manage
+    for gpu_mem in (4, 12, 12, 20):
+        simulator._submit(TraceTask(submit=0, duration=60, gpu_mem=gpu_mem, request_gpu_mem=gpu_mem))
+    assert task_manage.scheduling.timer_call(task_manage)
+    running = dict((task.gpu_mem, task.gpu) for task in task_manage.tasks if task.status == STATUS_RUNNING)
+    assert running == {20: [0], 4: [0], 12: [1]}
+    assert all(task.status == STATUS_RUNNING for task in task_manage.tasks)
@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+
+import pytest
+
+from gpulimit.gpulimit_server import Server
+from gpulimit.gpulimit_client import GpulimitClient
+
+
+def start_server(tmp_path, workers, timeout=30):
+    # without `__init__`, the global `task_manage` is not started
+    server = object.__new__(Server)
+    server.workers, server.backlog, server.timeout = workers, 16, timeout
+    server.metrics_port = None
+    server.max_request_size = 1024 * 1024
+    server.server_address = str(tmp_path / 'gpulimit.sock')
+    server.func_map = {'status': lambda: (0, 'ok')}
+    threading.Thread(target=server.start, daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(server.server_address):
+            break
+        time.sleep(0.01)
+    return server
+
+
+def test_idle_connections_do_not_block(tmp_path):
+    workers = 4
+    server = start_server(tmp_path, workers)
+    idle = [GpulimitClient(server.server_address) for _ in range(workers)]
+    for client in idle:
+        assert client.call(['status']) == 'ok'
+
+    # all persistent connections are idle, one more client is served at once
+    start = time.time()
+    with GpulimitClient(server.server_address) as client:
+        assert client.call(['status']) == 'ok'
+        assert client.pipeline([['status']] * 100) == ['ok'] * 100
+    assert time.time() - start < 1
+
+    for client in idle:
+        assert client.call(['status']) == 'ok'
+        client.close()
+
+
+def test_idle_connection_timeout(tmp_path):
+    server = start_server(tmp_path, 1, timeout=0.2)
+    with GpulimitClient(server.server_address) as client:
+        assert client.call(['status']) == 'ok'
+        client.sock.settimeout(5)
+        assert client.sock.recv(1) == b''
+
+
+def test_max_request_size(tmp_path):
+    server = start_server(tmp_path, 2)
+    # responses have no limit
+    server.func_map['big'] = lambda: (0, 'x' * (2 * server.max_request_size))
+    with GpulimitClient(server.server_address) as client:
+        assert len(client.call(['big'])) == 2 * server.max_request_size
+    with GpulimitClient(server.server_address) as client:
+        response = client.request(['status', 'x' * server.max_request_size])
+        assert response['code'] == 400
+
+
+def test_high_fds(tmp_path):
+    # connection fds >= 1024
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and hard < 1200:
+        pytest.skip('fd limit too low')
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1200) if hard == resource.RLIM_INFINITY 
+                                                else min(max(soft, 1200), hard), hard))
+    files = [open(os.devnull) for _ in range(1100)]
+    try:
+        server = start_server(tmp_path, 2)
+        with GpulimitClient(server.server_address) as client:
+            assert client.pipeline([['status']] * 10) == ['ok'] * 10
+            assert client.call(['status']) == 'ok'
+    finally:
+        for f in files:
+            f.close()
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
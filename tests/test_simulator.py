@@ -0,0 +1,61 @@
+import json
+
+from gpulimit.gpulimit_core.simulator import Simulator, TraceTask, load_trace, save_trace, synthetic_trace
+from gpulimit.gpulimit_core.scheduling import BaseScheduling
+
+
+def burst_trace(n=64, interval=0.2):
+    # a sweep submitted by a loop of `gpulimit add`, each task grows to
+    # 14G in its first 20 seconds
+    return [TraceTask(submit=i * interval, duration=600, gpu_mem=[(0, 0.5), (20, 14)], cpu_mem=2)
+            for i in range(n)]
+
+
+def test_burst_no_oom():
+    for params in ({}, {'BATCH_DISPATCH': 0}):
+        report = Simulator(BaseScheduling(), gpus=8, gpu_memory=24, params=params).run(burst_trace())
+        assert report.oom == 0, params
+        assert report.complete == 64, params
+
+
+def test_burst_without_settle_time_oom():
+    report = Simulator(BaseScheduling(), gpus=8, gpu_memory=24,
+                       params={'START_SETTLE_TIME': 0}).run(burst_trace())
+    assert report.oom > 0
+
+
+def test_settle_time_sized_tasks():
+    # tasks with `--gpu-mem` are packed by their reservation, not delayed
+    trace = [task._replace(request_gpu_mem=15) for task in burst_trace(8)]
+    report = Simulator(BaseScheduling(), gpus=8, gpu_memory=24).run(trace)
+    assert report.oom == 0
+    assert report.mean_wait == 0
+
+
+def test_trace_files(tmp_path):
+    trace = synthetic_trace(20)
+    save_trace(trace, tmp_path / 'trace.jsonl')
+    loaded = load_trace(tmp_path / 'trace.jsonl')
+    assert [task.submit for task in loaded] == [task.submit for task in trace]
+    assert [task.cmds for task in loaded] == [task.cmds for task in trace]
+
+    # events file of a server
+    events = [
+        {'time': 100, 'event': 'add', 'id': 0, 'pwd': '/a', 'cmds': ['a.py'], 'priority': 3, 'gpus': 2},
+        {'time': 110, 'event': 'add', 'id': 1, 'last_id': 2, 'count': 2, 'pwd': '/b'},
+        {'time': 120, 'event': 'start', 'id': 0, 'gpu_mem': 6, 'cpu_mem': None},
+        {'time': 130, 'event': 'finish', 'id': 0, 'status': 'runtime_error', 'runtime': 5},
+        {'time': 140, 'event': 'start', 'id': 0, 'gpu_mem': 8, 'cpu_mem': 4},
+        {'time': 150, 'event': 'finish', 'id': 0, 'status': 'complete', 'runtime': 600, 
+         'peak_gpu_mem': 7.5, 'peak_cpu_mem': 3},
+        {'time': 160, 'event': 'finish', 'id': 2, 'status': 'complete', 'runtime': 60},
+    ]
+    with open(tmp_path / 'events.jsonl', 'w') as f:
+        f.write('\n'.join(json.dumps(event) for event in events))
+    first, second = load_trace(tmp_path / 'events.jsonl')
+    assert first == TraceTask(submit=0, duration=600, gpu_mem=7.5, cpu_mem=3, gpus=2, priority=3,
+                              request_gpu_mem=8, request_cpu_mem=4, returncode=0, pwd='/a', 
+                              cmds=['a.py'])
+    assert (second.submit, second.gpus, second.pwd, second.cmds) == (10, 1, '/b', ['task', '2'])
+    report = Simulator(BaseScheduling(), gpus=2).run([first, second])
+    assert report.complete == 2
@@ -0,0 +1,47 @@
+import socket
+import threading
+
+import pytest
+
+from gpulimit.gpulimit_core import socket_utils
+from gpulimit.gpulimit_core.socket_utils import HEADER, MessageTooLarge, send_all, recv_all
+
+
+def test_roundtrip():
+    a, b = socket.socketpair()
+    with a, b:
+        send_all(a, b'x' * 100000)
+        assert recv_all(b) == b'x' * 100000
+
+
+def test_growing_buffer(monkeypatch):
+    monkeypatch.setattr(socket_utils, 'PREALLOCATE_SIZE', 1000)
+    a, b = socket.socketpair()
+    with a, b:
+        msg = bytes(range(256)) * 4000
+        sender = threading.Thread(target=send_all, args=(a, msg))
+        sender.start()
+        assert recv_all(b, buffer_size=4096) == msg
+        sender.join()
+
+
+def test_reject_large_header():
+    a, b = socket.socketpair()
+    with a, b:
+        # nothing is allocated for a header claiming 4 EiB
+        a.sendall(HEADER.pack(1 << 62))
+        with pytest.raises(MessageTooLarge):
+            recv_all(b, max_size=1024)
+        a.sendall(HEADER.pack(1025) + b'x' * 1025)
+        with pytest.raises(MessageTooLarge):
+            recv_all(b, max_size=1024)
+
+
+def test_no_limit_wrong_header():
+    a, b = socket.socketpair()
+    with b:
+        # the buffer only grows with the bytes sent
+        a.sendall(HEADER.pack(1 << 62) + b'x' * 10)
+        a.close()
+        with pytest.raises(ConnectionError):
+            recv_all(b)
@@ -0,0 +1,31 @@
+import os
+import sys
+import time
+import signal
+import subprocess
+
+from gpulimit.gpulimit_core.supervisor import ProcessSupervisor
+
+
+def test_terminate_stopped_process(tmp_path):
+    flag = tmp_path / 'terminated'
+    # the group and the process both get SIGTERM
+    code = (f'import os, signal, time\n'
+            f'def stop(*args):\n'
+            f'    open({str(flag)!r}, "w").close()\n'
+            f'    os._exit(0)\n'
+            f'signal.signal(signal.SIGTERM, stop)\n'
+            f'print("ready", flush=True)\n'
+            f'time.sleep(60)\n')
+    process = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, start_new_session=True)
+    assert process.stdout.readline() == b'ready\n'
+    # a paused task
+    os.kill(process.pid, signal.SIGSTOP)
+
+    supervisor = ProcessSupervisor()
+    start = time.time()
+    supervisor.terminate(process, timeout=30, pgid=process.pid)
+    assert process.wait(10) == 0
+    # exited by its SIGTERM handler, not by SIGKILL after the timeout
+    assert flag.exists()
+    assert time.time() - start < 10
@@ -0,0 +1,86 @@
+import threading
+
+from gpulimit.gpulimit_core.tasks import Task
+from gpulimit.gpulimit_core.task_journal import TaskJournal
+
+
+def put(journal, id, **kwargs):
+    task = Task(id, '/tmp', ['task', str(id)])
+    journal.append('put', t=TaskJournal.record(task, order=id, **kwargs))
+
+
+def open_journal(path, records=None):
+    """
+    journal whose snapshots hold `records` (a list of records, changed by
+    the test), without a background write.
+    """
+    journal = TaskJournal(str(path), sync_interval=3600)
+    if records is not None:
+        journal.start(lambda: (max([record['id'] + 1 for record in records] + [0]), list(records)),
+                      threading.Lock())
+    return journal
+
+
+def priorities(records):
+    return dict((record['id'], record['priority']) for record in records)
+
+
+def test_replay(tmp_path):
+    journal = open_journal(tmp_path)
+    for id in range(3):
+        put(journal, id)
+    put(journal, 1, priority=1)
+    journal.append('del', ids=[0])
+    journal.flush()
+
+    next_id, records = open_journal(tmp_path).replay()
+    assert next_id == 3
+    assert priorities(records) == {1: 1, 2: 5}
+
+
+def test_replay_torn_tail(tmp_path):
+    journal = open_journal(tmp_path)
+    for id in range(3):
+        put(journal, id)
+    journal.flush()
+    # crashed while writing the last line
+    with open(journal.journal_path, 'a') as f:
+        f.write('{"n":4,"e":"put","t":{"id":3,')
+
+    journal = open_journal(tmp_path)
+    next_id, records = journal.replay()
+    assert next_id == 3 and sorted(priorities(records)) == [0, 1, 2]
+    # new events are numbered after the replayed ones
+    put(journal, 3)
+    assert '"n":4' in journal._buffer[0]
+
+
+def test_replay_snapshot(tmp_path):
+    records = []
+    journal = open_journal(tmp_path, records)
+    for id in range(4):
+        put(journal, id)
+    journal.flush()
+    with open(journal.journal_path) as f:
+        events = f.read()
+
+    records += [TaskJournal.record(Task(id, '/tmp', ['task', str(id)], priority=3), order=id)
+                for id in range(4)]
+    journal.snapshot()
+    with open(journal.journal_path) as f:
+        assert f.read() == ''
+    put(journal, 4)
+    journal.append('del', ids=[0])
+    journal.flush()
+
+    next_id, replayed = open_journal(tmp_path).replay()
+    assert next_id == 5
+    assert priorities(replayed) == {1: 3, 2: 3, 3: 3, 4: 5}
+
+    # crashed after the snapshot was written, before the journal was
+    # truncated: events already in the snapshot are skipped
+    with open(journal.journal_path) as f:
+        events += f.read()
+    with open(journal.journal_path, 'w') as f:
+        f.write(events)
+    assert priorities(open_journal(tmp_path).replay()[1]) == {1: 3, 2: 3, 3: 3, 4: 5}
@@ -0,0 +1,113 @@
+from gpulimit.gpulimit_core.tasks import Task, STATUS_RUNNING, STATUS_WAITING
+from gpulimit.gpulimit_core.task_queue import TaskQueue
+
+
+def make_queue(priorities):
+    queue = TaskQueue()
+    for id, priority in enumerate(priorities):
+        queue.push(Task(id, '/tmp', ['task', str(id)], priority=priority))
+    return queue
+
+
+def pop_all(queue):
+    ids = []
+    while True:
+        task = queue.pop_runnable()
+        if task is None:
+            return ids
+        ids.append(task.id)
+
+
+def test_pop_order():
+    queue = make_queue([5, 3, 5, 3])
+    queue.get(1).status = STATUS_RUNNING
+    queue.update(queue.get(1))
+    assert pop_all(queue) == [3, 0, 2]
+    # popped tasks are out of the heap until updated
+    queue.update(queue.get(2))
+    assert pop_all(queue) == [2]
+
+
+def test_lazy_invalidation():
+    queue = make_queue([1, 5, 5])
+    queue.get(0).priority = 9
+    queue.update(queue.get(0))
+    assert len(queue._heap) == 4 # old entry is only marked removed
+    assert pop_all(queue) == [1, 2, 0]
+
+    # key changed without `update`, the entry is pushed again
+    queue = make_queue([1, 5, 5])
+    queue.get(0).priority = 9
+    assert queue.pop_runnable().id == 1
+
+    # a task no longer runnable is dropped
+    queue = make_queue([1, 5])
+    queue.get(0).status = STATUS_RUNNING
+    assert pop_all(queue) == [1]
+    queue.get(0).status = STATUS_WAITING
+    queue.update(queue.get(0))
+    assert pop_all(queue) == [0]
+
+
+def test_remove():
+    queue = make_queue([5] * 200)
+    assert queue.remove(0).id == 0
+    assert queue.remove(0) is None
+    assert [task.id for task in queue.remove_many([1, 2, 1000])] == [1, 2]
+    queue.remove_many(range(3, 150))
+    # removed entries are dropped from the heap in bulk
+    assert len(queue._heap) <= 2 * len(queue) + 64
+    assert pop_all(queue) == list(range(150, 200))
+    assert [task.id for task in queue.ordered()] == list(range(150, 200))
+
+
+def test_order_and_move():
+    queue = make_queue([5] * 4)
+    assert [queue.order(id) for id in range(4)] == [0, 1, 2, 3]
+    assert queue.move(3, 0)
+    assert queue.move(0, 2)
+    assert [task.id for task in queue.ordered()] == [3, 1, 0, 2]
+    assert queue.order(3) < queue.order(1) < queue.order(0) < queue.order(2)
+    assert queue.move(1, 100) and queue.ordered()[-1].id == 1
+    assert not queue.move(100, 0)
+    # same priority, popped in listing order
+    assert pop_all(queue) == [3, 0, 2, 1]
+
+    # new tasks go to the end
+    queue.push(Task(4, '/tmp', ['task']))
+    assert queue.ordered()[-1].id == 4
+
+
+def test_move_renumber():
+    queue = make_queue([5] * 4)
+    # each move halves the gap between two orders, until float precision runs out
+    for i in range(80):
+        queue.move(queue.ordered()[-1].id, 2)
+    assert queue.renumbered > 0
+    ids = [task.id for task in queue.ordered()]
+    assert ids[:2] == [0, 1] and sorted(ids) == [0, 1, 2, 3]
+    assert [queue.order(id) for id in ids] == sorted(queue.order(id) for id in ids)
+    assert pop_all(queue) == ids
+
+
+def test_push_order():
+    # restored from journal
+    queue = TaskQueue()
+    queue.push(Task(3, '/tmp', ['task']), order=-1.5)
+    queue.push(Task(1, '/tmp', ['task']), order=10)
+    queue.push(Task(4, '/tmp', ['task']))
+    assert queue.order(4) == 11
+    assert [task.id for task in queue.ordered()] == [3, 1, 4]
+    assert pop_all(queue) == [3, 1, 4]
+
+
+def test_snapshot():
+    queue = make_queue([5] * 3)
+    snapshot = queue.snapshot()
+    assert queue.snapshot() is snapshot
+    queue.get(0).priority = 1
+    queue.update(queue.get(0))
+    assert queue.snapshot() is snapshot
+    queue.remove(1)
+    assert [task.id for task in snapshot] == [0, 1, 2]
+    assert [task.id for task in queue.snapshot()] == [0, 2]
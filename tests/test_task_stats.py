@@ -0,0 +1,45 @@
+import time
+import types
+
+from gpulimit.gpulimit_core.task_stats import TaskStats
+
+
+def finished_task(gpu_mem=4):
+    return types.SimpleNamespace(pwd='/tmp', cmds=['python', 'train.py', '--lr=0.001'],
+                                 peak_gpu_mem=gpu_mem, peak_cpu_mem=2, start_time=0, end_time=60)
+
+
+def wait_saved(stats, timeout=5):
+    start = time.time()
+    while stats._save_timer is not None and time.time() - start < timeout:
+        time.sleep(0.01)
+    return not stats._dirty
+
+
+def test_save_after_record(tmp_path):
+    path = tmp_path / 'task_stats.json'
+    stats = TaskStats(str(path), save_interval=0.2)
+    stats.record(finished_task())
+    # first record is saved at once
+    assert wait_saved(stats)
+    saved = path.stat().st_mtime_ns
+
+    # records within `save_interval` are saved together
+    start = time.time()
+    stats.record(finished_task(gpu_mem=6))
+    stats.record(finished_task(gpu_mem=5))
+    assert stats._dirty and path.stat().st_mtime_ns == saved
+    assert wait_saved(stats)
+    assert time.time() - start >= 0.15
+
+    loaded = TaskStats(str(path))
+    loaded.load()
+    # lr of the same order of magnitude
+    assert loaded.estimate('/tmp', ['python', 'train.py', '--lr=0.005']) == (6, 2, 60, 3)
+
+
+def test_no_save_without_path():
+    stats = TaskStats()
+    stats.record(finished_task())
+    assert stats._save_timer is None
+    assert stats.estimate('/tmp', ['python', 'train.py', '--lr=0.001']).count == 1